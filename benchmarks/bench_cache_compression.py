@@ -0,0 +1,77 @@
+"""
+Compare the size and the read time of the metadata cache stored with each compression.
+
+    python benchmarks/bench_cache_compression.py --meta-dir ./cache/core_repo/azure-cli-2.51.0
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from cli_validator.loader.utils import COMPRESSIONS, load_from_local, store_to_local
+
+
+def _generate_metas(num_modules=100, num_commands=50):
+    """Generate metadata shaped like the metadata of Azure CLI when no cache is provided"""
+    rand = random.Random(0)
+    words = ['create', 'delete', 'show', 'list', 'update', 'wait', 'start', 'stop', 'restart', 'set']
+    metas = []
+    for m in range(num_modules):
+        commands = {}
+        for c in range(num_commands):
+            name = f'module{m} group{c // 10} {words[c % 10]}'
+            commands[name] = {"name": name, "help": f"{words[c % 10].capitalize()} a resource. " * 4, "parameters": [
+                {"name": f"param_{p}", "options": [f"--param-{p}", f"-{chr(97 + p)}"], "required": rand.random() < 0.2,
+                 "help": f"The parameter {p} of the resource. " * 3, "choices": words[:rand.randint(0, 5)]}
+                for p in range(rand.randint(3, 15))]}
+        metas.append(json.dumps({"module_name": f"module{m}", "commands": commands, "sub_groups": {}}))
+    return metas
+
+
+def _load_metas(meta_dir):
+    metas = []
+    for path in sorted(glob.glob(os.path.join(meta_dir, '*.json'))):
+        metas.append(load_from_local(path))
+    return metas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meta-dir', help='directory of cached metadata files, generated if not provided')
+    parser.add_argument('--repeat', type=int, default=3, help='times to read the cache')
+    args = parser.parse_args()
+
+    metas = _load_metas(args.meta_dir) if args.meta_dir else _generate_metas()
+    print(f'{len(metas)} files, {sum(len(meta) for meta in metas) / 2 ** 20:.1f} MiB of JSON')
+    print(f'{"compression":<12}{"size (MiB)":>12}{"write (s)":>12}{"read (s)":>12}{"read+decode (s)":>18}')
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for compression in [None] + list(COMPRESSIONS):
+            cache_dir = os.path.join(tmp_dir, compression or 'none')
+            paths = [os.path.join(cache_dir, f'{i}.json') for i in range(len(metas))]
+            start = time.perf_counter()
+            for meta, path in zip(metas, paths):
+                store_to_local(meta, path, compression=compression)
+            write_time = time.perf_counter() - start
+            size = sum(os.path.getsize(path) for path in paths)
+            read_time = decode_time = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = [load_from_local(path) for path in paths]
+                read_end = time.perf_counter()
+                for d in data:
+                    json.loads(d)
+                read_time = min(read_time, read_end - start)
+                decode_time = min(decode_time, time.perf_counter() - start)
+            print(f'{compression or "none":<12}{size / 2 ** 20:>12.2f}{write_time:>12.3f}{read_time:>12.3f}'
+                  f'{decode_time:>18.3f}')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare the time to split commands with placeholders by the tokenizer and by `re.sub` followed by `shlex.split`.
+
+    python benchmarks/bench_tokenizer.py --count 20000
+"""
+import argparse
+import random
+import re
+import shlex
+import time
+
+from cli_validator import tokenizer
+
+_PLACEHOLDER = re.compile(r' ((\$\([a-zA-Z0-9_ -.\[\]]*\))|(\${[a-zA-Z0-9_ -.\[\]]*})|'
+                          r'(<[a-zA-Z0-9_ ]*>)|(<<[a-zA-Z0-9_ -]*>>))')
+
+_TEMPLATES = [
+    'az vm list',
+    'az group show -n {name} --query id -o tsv',
+    'az vm create -g <Resource Group> -n {name} --image Ubuntu2204 --admin-username azureuser --generate-ssh-keys',
+    'az webapp create -g $RG -p ${{PLAN NAME}} -n {name} --runtime "PYTHON|3.11"',
+    'az keyvault secret set --vault-name <<vault name>> -n {name} --value \'p@ss w0rd\' # set the secret',
+    'az network vnet subnet update -g rg --vnet-name $(az network vnet list --query [0].name) -n {name}',
+]
+
+
+def _generate_commands(count: int):
+    rand = random.Random(0)
+    return [rand.choice(_TEMPLATES).format(name=f'name{i}') for i in range(count)]
+
+
+def _split_shlex(command: str):
+    return shlex.split(_PLACEHOLDER.sub(r' "\1"', command))
+
+
+def _split_tokenizer(command: str):
+    return tokenizer.split(tokenizer.quote_placeholders(command))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=20000, help='number of commands to split')
+    parser.add_argument('--repeat', type=int, default=3, help='times to split the commands')
+    args = parser.parse_args()
+
+    commands = _generate_commands(args.count)
+    print(f'{len(commands)} commands')
+    print(f'{"splitter":<12}{"time (s)":>12}{"per command (us)":>20}')
+    results = []
+    for name, split in [('shlex', _split_shlex), ('tokenizer', _split_tokenizer)]:
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tokens = [split(command) for command in commands]
+            best = min(best, time.perf_counter() - start)
+        results.append(tokens)
+        print(f'{name:<12}{best:>12.3f}{best / len(commands) * 1e6:>20.1f}')
+    assert results[0] == results[1], 'the tokenizer splits the commands differently'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import logging
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Optional, Callable, Hashable, Any
+
+logger = logging.getLogger(__name__)
+
+
+def approx_size(obj):
+    """
+    Estimate the memory occupied by a decoded JSON object or an index built from it, including the objects
+    it contains
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approx_size(key) + approx_size(value)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approx_size(item)
+    return size
+
+
+class CacheStats(object):
+    def __init__(self, hits: int = 0, misses: int = 0, evictions: int = 0, size: int = 0, weight: int = 0,
+                 evicted_weight: int = 0, rejections: int = 0):
+        self.hits = hits
+        self.misses = misses
+        self.evictions = evictions
+        self.size = size
+        self.weight = weight
+        self.evicted_weight = evicted_weight
+        # Values not cached because they alone weigh more than `max_weight`
+        self.rejections = rejections
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __repr__(self):
+        return f'CacheStats(hits={self.hits}, misses={self.misses}, evictions={self.evictions}, size={self.size}, ' \
+               f'weight={self.weight}, evicted_weight={self.evicted_weight}, rejections={self.rejections})'
+
+
+# Caches whose locks are created again in a forked process
+_caches = weakref.WeakSet()
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe LRU cache which records hit/miss/eviction counters.
+    A value that weighs more than `max_weight` is not cached, which is counted as a rejection.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 256, max_weight: Optional[int] = None,
+                 weigher: Optional[Callable[[Any], int]] = None):
+        """
+        :param maxsize: max number of entries kept in the cache. `None` means unbounded and `0` disables the cache
+        :param max_weight: max total weight of entries kept in the cache, e.g. a memory budget in bytes.
+            `None` means unbounded
+        :param weigher: function to compute the weight of a value, every value weighs 1 if not provided
+        """
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self._data = OrderedDict()
+        self._weights = {}
+        self._lock = threading.Lock()
+        _caches.add(self)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.weight = 0
+        self.evicted_weight = 0
+        self.rejections = 0
+
+    def __getstate__(self):
+        # The cached values are not pickled, an unpickled cache starts empty with the same bounds
+        return {'maxsize': self.maxsize, 'max_weight': self.max_weight, 'weigher': self.weigher}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        if self.maxsize == 0:
+            return
+        weight = self.weigher(value) if self.weigher else 1
+        with self._lock:
+            self._store(key, value, weight)
+
+    def _store(self, key, value, weight):
+        if self.max_weight is not None and weight > self.max_weight:
+            # Caching it would flush every other entry and still exceed the budget
+            self.rejections += 1
+            if self.rejections == 1:
+                logger.warning("Value of weight %d exceeds the cache budget %d and is not cached", weight,
+                               self.max_weight)
+            return
+        self.weight += weight - self._weights.get(key, 0)
+        self._data[key] = value
+        self._weights[key] = weight
+        self._data.move_to_end(key)
+        self._evict()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]):
+        """
+        Get the cached value of `key`, create it with `factory` and cache it if missing.
+        The factory is called without holding the lock, so concurrent misses of the same key may both build a value,
+        in which case the first stored one wins.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = factory()
+        if self.maxsize == 0:
+            return value
+        weight = self.weigher(value) if self.weigher else 1
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+            self._store(key, value, weight)
+        return value
+
+    def pop(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.weight -= self._weights.pop(key)
+            return self._data.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def _evict(self):
+        while self._data and ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                              (self.max_weight is not None and self.weight > self.max_weight)):
+            key, _ = self._data.popitem(last=False)
+            weight = self._weights.pop(key)
+            self.weight -= weight
+            self.evicted_weight += weight
+            self.evictions += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self._data), self.weight,
+                              self.evicted_weight, self.rejections)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+def _reset_after_fork():
+    # The lock may be held by a thread of the parent process, which doesn't exist in the forked process
+    for cache in list(_caches):
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,10 +1,11 @@
 import shlex
-from typing import List
+import sys
+from typing import List, Optional
 
 from cli_validator.command import CommandInfo
 from cli_validator.exceptions import EmptyCommandException, NonAzCommandException, CommandTreeCorruptedException, \
     UnknownCommandException, MissingSubCommandException
-from cli_validator.result import CommandSource
+from cli_validator.result import CommandSource, Failure
 
 
 class CommandTreeParser(object):
@@ -18,11 +19,23 @@ class CommandTreeParser(object):
         :param command: command to be validated
         :return: parsed `CommandInfo`. The `module` of `CommandInfo` is `None` if the command is a help command.
         """
+        result = self.match_command(command)
+        if isinstance(result, Failure):
+            raise result.exception
+        return result
+
+    def match_command(self, command: List[str]):
+        """
+        Parse a Command into CommandInfo using CommandTree without raising `ValidateFailureException`
+        :param command: command to be validated
+        :return: parsed `CommandInfo`, or the `Failure` if the command can't be parsed.
+            The `module` of `CommandInfo` is `None` if the command is a help command.
+        """
         if len(command) == 0:
-            raise EmptyCommandException()
+            return Failure(EmptyCommandException)
         elif command[0] != 'az':
-            raise NonAzCommandException()
-        elif command[1] == 'help' and len(command) == 2:
+            return Failure(NonAzCommandException)
+        elif len(command) == 2 and command[1] == 'help':
             return CommandInfo(None, [command[1]], [])
         parameters = command[1:]
         signature = []
@@ -38,9 +51,123 @@ class CommandTreeParser(object):
                 elif isinstance(cur_node[part], dict):
                     cur_node = cur_node[part]
                 else:
-                    raise CommandTreeCorruptedException(self.source)
+                    return Failure(CommandTreeCorruptedException, self.source)
             elif parameters[0] in ['--help', '-h'] and len(parameters) == 1:
                 return CommandInfo(None, signature, parameters)
             else:
-                raise UnknownCommandException(shlex.join(command))
-        raise MissingSubCommandException(shlex.join(command))
+                return Failure(UnknownCommandException, tuple(command), build=_join_command)
+        return Failure(MissingSubCommandException, tuple(command), build=_join_command)
+
+
+def _join_command(code, command: List[str]):
+    return code(shlex.join(command))
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'modules', 'group_mask', 'corrupt_mask')
+
+    def __init__(self):
+        self.children = {}
+        # The module of the command in each source if the node is a command
+        self.modules: Optional[List[Optional[str]]] = None
+        # Bit `i` is set if the node is a command group in the `i`-th source
+        self.group_mask = 0
+        self.corrupt_mask = 0
+
+
+class MergedCommandTree(object):
+    """
+    A trie merged from the command trees of several sources, which parses a command for all the sources in one walk.
+    The parsed result is the same as trying `CommandTreeParser.match_command` of each source in order until
+    one of them doesn't fail with `UnknownCommandException`.
+    """
+
+    HELP_FLAGS = ['--help', '-h']
+    _UNKNOWN = object()
+    _CORRUPTED = object()
+
+    def __init__(self, trees: List[CommandTreeParser]):
+        """
+        :param trees: command trees of the sources, ordered by priority
+        """
+        self.trees = trees
+        self.root = _TrieNode()
+        for idx, tree in enumerate(trees):
+            self._merge(self.root, tree.cmd_tree, idx)
+
+    def _merge(self, node: _TrieNode, cmd_tree: dict, idx: int):
+        bit = 1 << idx
+        for name, value in cmd_tree.items():
+            name = sys.intern(name)
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = _TrieNode()
+            if isinstance(value, str):
+                if child.modules is None:
+                    child.modules = [None] * len(self.trees)
+                child.modules[idx] = sys.intern(value)
+            elif isinstance(value, dict):
+                child.group_mask |= bit
+                self._merge(child, value, idx)
+            else:
+                child.corrupt_mask |= bit
+
+    def _decide(self, outcomes: list):
+        for idx, outcome in enumerate(outcomes):
+            if outcome is None:
+                return None
+            elif outcome is self._CORRUPTED:
+                return Failure(CommandTreeCorruptedException, self.trees[idx].source)
+            elif outcome is not self._UNKNOWN:
+                return idx, outcome
+        return self._UNKNOWN
+
+    def match_command(self, command: List[str], missing_as_help=False):
+        """
+        Parse a Command into CommandInfo using the merged CommandTree without raising `ValidateFailureException`
+        :param command: command to be validated
+        :param missing_as_help: treat a command group without sub command as a help command
+            instead of an unknown command
+        :return: tuple of the index of the source and the parsed `CommandInfo`, `None` if the command is unknown to all
+            the sources, or the `Failure` if the command can't be parsed.
+            The `module` of `CommandInfo` is `None` if the command is a help command.
+        """
+        if not self.trees:
+            return None
+        if len(command) == 0:
+            return Failure(EmptyCommandException)
+        elif command[0] != 'az':
+            return Failure(NonAzCommandException)
+        elif len(command) == 2 and command[1] == 'help':
+            return 0, CommandInfo(None, [command[1]], [])
+        parts = command[1:]
+        last = len(parts) - 1
+        signature = []
+        # The outcome of each source, `None` while the source is still walking through command groups
+        outcomes = [None] * len(self.trees)
+        walking = range(len(self.trees))
+        node = self.root
+        for pos, part in enumerate(parts):
+            child = node.children.get(part)
+            next_walking = []
+            for idx in walking:
+                if child is not None and child.modules is not None and child.modules[idx] is not None:
+                    outcomes[idx] = CommandInfo(child.modules[idx], signature + [part], parts[pos + 1:])
+                elif child is not None and child.group_mask >> idx & 1:
+                    next_walking.append(idx)
+                elif child is not None and child.corrupt_mask >> idx & 1:
+                    outcomes[idx] = self._CORRUPTED
+                elif pos == last and part in self.HELP_FLAGS:
+                    outcomes[idx] = CommandInfo(None, list(signature), [part])
+                else:
+                    outcomes[idx] = self._UNKNOWN
+            signature.append(part)
+            walking = next_walking
+            result = self._decide(outcomes)
+            if result is not None:
+                return result if result is not self._UNKNOWN else None
+            node = child
+        for idx in walking:
+            outcomes[idx] = CommandInfo(None, signature, []) if missing_as_help else self._UNKNOWN
+        result = self._decide(outcomes)
+        return result if result is not self._UNKNOWN else None
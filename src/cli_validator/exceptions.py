@@ -6,6 +6,11 @@ class VersionNotExistException(Exception):
         self.msg = f'Metadata of {product} {version} not Found'
 
 
+class InvalidSnapshotException(Exception):
+    def __init__(self, path: str, reason: str):
+        self.msg = f'Invalid snapshot `{path}`: {reason}'
+
+
 class ValidateFailureException(Exception):
     def __init__(self, msg):
         self.msg = msg
@@ -1,23 +1,62 @@
 import os
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 
 from cli_validator.cmd_tree import CommandTreeParser
+from cli_validator.loader.meta_store import MetaStore
 
 
 class CacheStrategy(str, Enum):
+    # Use the cache if it exists without sending any request
     CacheAside = 'CacheAside'
+    # Revalidate the cache, and use it if the request fails
     Fallback = 'Fallback'
+    # Revalidate the cache, and raise the error if the request fails
+    Revalidate = 'Revalidate'
+    # Use the cache validated within the max stale age and revalidate it in background,
+    # otherwise the same as `Fallback`
+    StaleWhileRevalidate = 'StaleWhileRevalidate'
 
 
 class BaseLoader(object):
     def __init__(self, cache_dir: Optional[str] = None):
         self.cache_dir = cache_dir
         self.metas = None
+        self.version: Optional[str] = None
         self.command_tree: Optional[CommandTreeParser] = None
+        self.meta_store: Optional[MetaStore] = None
+        self.command_index: Optional[Dict[Tuple[str, ...], Tuple[str, dict]]] = None
+        # Increased whenever the loaded metadata changes, so that results validated against it can be told apart
+        self.generation = 0
         if self.cache_dir:
             os.makedirs(cache_dir, exist_ok=True)
 
+    def get_meta_version(self, module: str):
+        """
+        Get the version of metadata that provides commands of the module.
+        :param module: module or extension name of the command
+        :return: the version, `None` if unknown
+        """
+        return self.version
+
+    def get_module_meta(self, module: str):
+        """
+        Get metadata of a module.
+        :param module: module name
+        :return: the decoded metadata file of the module, `None` if metadata is not loaded
+        """
+        if not self.metas:
+            return None
+        return self.metas[f'az_{module}_meta.json']
+
+    def get_command_index(self, module: str):
+        """
+        Get the flat index of commands that contains the commands of a module.
+        :param module: module name
+        :return: the index built by `build_command_index`, `None` if metadata is not loaded
+        """
+        return self.command_index
+
     def load_command_meta(self, signature: List[str], module: str):
         """
         Load metadata of specific command.
@@ -25,10 +64,52 @@ class BaseLoader(object):
         :param module:
         :return:
         """
-        if not self.metas:
+        if self.meta_store is not None:
+            return self.meta_store.get(' '.join(signature))
+        command_index = self.get_command_index(module)
+        if not command_index:
+            return None
+        indexed = command_index.get(tuple(signature))
+        return indexed[1] if indexed is not None else None
+
+    async def get_command_index_async(self, module: str):
+        """
+        Get the flat index of commands that contains the commands of a module without blocking the event loop.
+        :param module: module name
+        :return: the index built by `build_command_index`, `None` if metadata is not loaded
+        """
+        return self.get_command_index(module)
+
+    async def load_command_meta_async(self, signature: List[str], module: str):
+        """
+        Load metadata of specific command without blocking the event loop.
+        :param signature: command signature
+        :param module:
+        :return:
+        """
+        if self.meta_store is not None:
+            return self.meta_store.get(' '.join(signature))
+        command_index = await self.get_command_index_async(module)
+        if not command_index:
             return None
-        module_meta = self.metas[f'az_{module}_meta.json']
-        meta = module_meta
-        for idx in range(len(signature) - 1):
-            meta = meta['sub_groups'][' '.join(signature[:idx + 1])]
-        return meta['commands'][' '.join(signature)]
+        indexed = command_index.get(tuple(signature))
+        return indexed[1] if indexed is not None else None
+
+
+def _index_group(group: dict, module: Optional[str], command_index: dict):
+    for name, command in group['commands'].items():
+        command_index[tuple(name.split())] = (module, command)
+    for sub_group in group['sub_groups'].values():
+        _index_group(sub_group, module, command_index)
+
+
+def build_command_index(metas: dict):
+    """
+    Flatten the command groups of metadata into an index from the signature of each command to its metadata.
+    :param metas: metadata of modules or extensions, keyed by file name
+    :return: dict from the signature tuple, e.g. `('vm', 'create')`, to the module name and the command metadata
+    """
+    command_index = {}
+    for meta in metas.values():
+        _index_group(meta, meta.get('module_name'), command_index)
+    return command_index
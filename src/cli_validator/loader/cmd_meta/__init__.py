@@ -2,15 +2,17 @@ import concurrent.futures
 import json
 import logging
 import os
-import shutil
-from typing import Optional
+import threading
+from typing import Optional, Callable
 
-import requests
+import httpx
 
 from cli_validator.cmd_tree import CommandTreeParser
 from cli_validator.exceptions import VersionNotExistException
 from cli_validator.loader import CacheStrategy
-from cli_validator.loader.utils import load_from_local, store_to_local
+from cli_validator.loader.http import get_client_pool
+from cli_validator.loader.utils import load_from_local, load_validators, store_stream, mark_validated, \
+    within_max_stale, conditional_headers, FileLock
 
 BLOB_URL = 'https://azcmdchangemgmt.blob.core.windows.net'
 CONTAINER_NAME = 'cmd-metadata-per-version'
@@ -19,42 +21,172 @@ logger = logging.getLogger(__name__)
 
 
 def load_http(url: str, cache_path: Optional[str] = None, cache_strategy: CacheStrategy = CacheStrategy.CacheAside,
-              encoding: str = 'utf-8'):
-    if cache_strategy == CacheStrategy.CacheAside and cache_path and os.path.exists(cache_path):
-        return load_from_local(cache_path, encoding)
+              encoding: str = 'utf-8', max_stale: Optional[float] = None,
+              on_refresh: Optional[Callable[[str], None]] = None, compression: Optional[str] = None):
+    """
+    Load a file through network or from local cache
+    :param url: url of the file
+    :param cache_path: path to cache the file, `None` to disable the cache
+    :param cache_strategy: when to use the cache
+    :param encoding: encoding of the file
+    :param max_stale: seconds that the cache can be used since it is validated with `StaleWhileRevalidate`,
+        `None` for no limit
+    :param on_refresh: called with the changed file when it is refreshed in background with `StaleWhileRevalidate`
+    :param compression: compress the cached file with `gzip` or `lzma`, `None` for no compression.
+        Compressed files are read regardless of it
+    :return: content of the file
+    """
+    return _load_cached(url, cache_path, cache_strategy, lambda data: data.decode(encoding), max_stale, on_refresh,
+                        compression)
+
+
+def load_http_json(url: str, cache_path: Optional[str] = None,
+                   cache_strategy: CacheStrategy = CacheStrategy.CacheAside, max_stale: Optional[float] = None,
+                   on_refresh: Optional[Callable[[object], None]] = None, compression: Optional[str] = None):
+    """
+    Load a JSON file through network or from local cache, which is parsed from the bytes of the file.
+    The parameters are the same as `load_http`.
+    :return: the decoded JSON
+    """
+    return _load_cached(url, cache_path, cache_strategy, json.loads, max_stale, on_refresh, compression)
+
+
+def _load_cached(url: str, cache_path: Optional[str], cache_strategy: CacheStrategy, parse: Callable[[bytes], object],
+                 max_stale: Optional[float] = None, on_refresh: Optional[Callable] = None,
+                 compression: Optional[str] = None):
+    if cache_path and not os.path.exists(cache_path):
+        # Only one process downloads a missing file, the others wait for it and load the downloaded file
+        with FileLock(cache_path):
+            if not os.path.exists(cache_path):
+                return _load_http(url, cache_path, cache_strategy, parse, compression=compression)
+        return parse(load_from_local(cache_path, None))
+    return _load_http(url, cache_path, cache_strategy, parse, max_stale, on_refresh, compression)
+
+
+def _load_http(url: str, cache_path: Optional[str], cache_strategy: CacheStrategy, parse: Callable[[bytes], object],
+               max_stale: Optional[float] = None, on_refresh: Optional[Callable] = None,
+               compression: Optional[str] = None):
+    if cache_path and os.path.exists(cache_path):
+        if cache_strategy == CacheStrategy.CacheAside:
+            return parse(load_from_local(cache_path, None))
+        if cache_strategy == CacheStrategy.StaleWhileRevalidate and within_max_stale(cache_path, max_stale):
+            data = parse(load_from_local(cache_path, None))
+            _refresh_in_background(url, cache_path, parse, on_refresh, compression)
+            return data
     try:
-        resp = requests.get(url, params=None)
-        resp.raise_for_status()
-        data = resp.text
+        if cache_path:
+            _revalidate(url, cache_path, compression)
+        else:
+            data = _download(url)
     except Exception as e:
         logger.error("Fail to Download Blob", exc_info=e)
-        if cache_strategy == CacheStrategy.Fallback and cache_path and os.path.exists(cache_path):
-            return load_from_local(cache_path, encoding)
-        raise e from e
+        if not (cache_strategy in (CacheStrategy.Fallback, CacheStrategy.StaleWhileRevalidate)
+                and cache_path and os.path.exists(cache_path)):
+            raise e from e
     if cache_path:
-        store_to_local(data, cache_path, encoding)
-    return data
+        data = load_from_local(cache_path, None)
+    return parse(data)
+
+
+def _download(url: str):
+    resp = get_client_pool().get(url)
+    resp.raise_for_status()
+    return resp.content
+
+
+def _revalidate(url: str, cache_path: str, compression: Optional[str] = None):
+    """
+    Download a file into the cache, which is a conditional request if the file is cached.
+    The response is written to the cache file in chunks as it is received.
+    :return: whether the cached file is changed
+    """
+    validators = load_validators(cache_path)
+    with get_client_pool().stream(url, headers=conditional_headers(validators)) as resp:
+        if resp.status_code == 304 and validators:
+            mark_validated(cache_path)
+            return False
+        resp.raise_for_status()
+        store_stream(resp.iter_bytes(), resp.headers, cache_path, compression)
+    return True
 
 
-def load_version_index(target_dir: Optional[str] = None, ext_name: Optional[str] = None):
+# Cache paths that are being refreshed in background
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def _refresh_in_background(url: str, cache_path: str, parse: Callable[[bytes], object],
+                           on_refresh: Optional[Callable], compression: Optional[str] = None):
+    with _refreshing_lock:
+        if cache_path in _refreshing:
+            return
+        _refreshing.add(cache_path)
+
+    def refresh():
+        try:
+            if _revalidate(url, cache_path, compression) and on_refresh is not None:
+                on_refresh(parse(load_from_local(cache_path, None)))
+        except Exception as e:
+            logger.warning("Fail to Refresh Blob in Background", exc_info=e)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_path)
+
+    threading.Thread(target=refresh, name=f'refresh-{os.path.basename(cache_path)}', daemon=True).start()
+
+
+def _reset_after_fork():
+    # The refresh threads are not running in a forked process, and the lock may be held by one of them
+    global _refreshing_lock
+    _refreshing_lock = threading.Lock()
+    _refreshing.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def load_version_index(target_dir: Optional[str] = None, ext_name: Optional[str] = None,
+                       max_stale: Optional[float] = None):
+    """
+    :param max_stale: seconds to use the cached version list while refreshing it in background,
+        `None` to always revalidate it before use
+    """
     ext_sep = f'/azure-cli-extensions/ext-{ext_name}' if ext_name else ''
     cache_path = f'{target_dir}{ext_sep}/version_list.txt' if target_dir else None
-    data = load_http(f'{BLOB_URL}/{CONTAINER_NAME}{ext_sep}/version_list.txt', cache_path, CacheStrategy.Fallback)
+    cache_strategy = CacheStrategy.Fallback if max_stale is None else CacheStrategy.StaleWhileRevalidate
+    data = load_http(f'{BLOB_URL}/{CONTAINER_NAME}{ext_sep}/version_list.txt', cache_path, cache_strategy,
+                     max_stale=max_stale)
     data = data.strip(' \n')
     return [v.strip() for v in data.split() if v.strip()]
 
 
-def load_latest_version(target_dir: Optional[str] = None, ext_name: Optional[str] = None):
-    version_list = load_version_index(target_dir, ext_name=ext_name)
+def load_latest_version(target_dir: Optional[str] = None, ext_name: Optional[str] = None,
+                        max_stale: Optional[float] = None):
+    version_list = load_version_index(target_dir, ext_name=ext_name, max_stale=max_stale)
     return version_list[-1]
 
 
-def try_load_meta(rel_uri: str, target_dir: Optional[str] = None):
+def get_version_dir(version: Optional[str] = None, target_dir: Optional[str] = None,
+                    max_stale: Optional[float] = None):
+    """
+    Get the directory of a version in the Blob, e.g. `azure-cli-2.51.0`
+    :param version: version of `azure-cli`, the latest version if not provided
+    :param target_dir: root directory to cache Command Metadata
+    :param max_stale: seconds to use the cached version list while refreshing it in background
+    """
+    if not version:
+        return load_latest_version(target_dir, max_stale=max_stale)
+    return f'azure-cli-{version}'
+
+
+def try_load_meta(rel_uri: str, target_dir: Optional[str] = None,
+                  cache_strategy: CacheStrategy = CacheStrategy.CacheAside, compression: Optional[str] = None):
     cache_path = f'{target_dir}/{rel_uri}' if target_dir else None
     try:
-        meta = load_http(f'{BLOB_URL}/{CONTAINER_NAME}/{rel_uri}', cache_path)
-        return json.loads(meta)
-    except requests.HTTPError as e:
+        return load_http_json(f'{BLOB_URL}/{CONTAINER_NAME}/{rel_uri}', cache_path, cache_strategy,
+                              compression=compression)
+    except httpx.HTTPStatusError as e:
         logger.error(f'`{rel_uri}` not Found', exc_info=e)
         return None
     except json.JSONDecodeError as e:
@@ -62,40 +194,47 @@ def try_load_meta(rel_uri: str, target_dir: Optional[str] = None):
         return None
 
 
-def try_load_core_meta(version_dir: str, file_name: str, target_dir: Optional[str] = None):
-    return try_load_meta(f'{version_dir}/{file_name}', target_dir)
+def try_load_core_meta(version_dir: str, file_name: str, target_dir: Optional[str] = None,
+                       cache_strategy: CacheStrategy = CacheStrategy.CacheAside, compression: Optional[str] = None):
+    return try_load_meta(f'{version_dir}/{file_name}', target_dir, cache_strategy, compression)
 
 
-def load_meta_index(version_dir: str, target_dir: Optional[str] = './cmd_meta'):
+def load_meta_index(version_dir: str, target_dir: Optional[str] = './cmd_meta',
+                    cache_strategy: CacheStrategy = CacheStrategy.Fallback):
     try:
         cache_path = f'{target_dir}/{version_dir}/index.txt' if target_dir else None
         index = load_http(f'{BLOB_URL}/{CONTAINER_NAME}/{version_dir}/index.txt', cache_path,
-                          cache_strategy=CacheStrategy.Fallback)
-    except requests.HTTPError as e:
+                          cache_strategy=cache_strategy)
+    except httpx.HTTPStatusError as e:
         raise VersionNotExistException(version_dir, 'Azure CLI') from e
     file_list = [f.strip() for f in index.strip(' \n').split()]
     return file_list
 
 
-def load_core_metas(version: Optional[str] = None, meta_dir: Optional[str] = './cmd_meta', force_refresh=False):
+def load_core_metas(version: Optional[str] = None, meta_dir: Optional[str] = './cmd_meta', force_refresh=False,
+                    version_dir: Optional[str] = None, compression: Optional[str] = None,
+                    index_cache_strategy: CacheStrategy = CacheStrategy.Fallback):
     """
     Load Command Metadata from local cache, fetch from Blob if not found
     :param version: version of `azure-cli` to be loaded
     :param meta_dir: root directory to cache Command Metadata
-    :param force_refresh: load the metadata through network no matter whether there is a cache
+    :param force_refresh: revalidate the cached metadata through network, and download only the changed files
+    :param version_dir: the directory of the version in the Blob if it is already resolved from `version`
+    :param compression: compress the cached metadata with `gzip` or `lzma`, `None` for no compression
+    :param index_cache_strategy: how the list of the metadata files is loaded, `CacheStrategy.CacheAside` to
+        use the cached list without network
     :return: list of command metadata
     """
-    if not version:
-        version_dir = load_latest_version(meta_dir)
-    else:
-        version_dir = f'azure-cli-{version}'
+    if not version_dir:
+        version_dir = get_version_dir(version, meta_dir)
     if meta_dir:
-        if force_refresh and os.path.exists(f'{meta_dir}/{version_dir}'):
-            shutil.rmtree(f'{meta_dir}/{version_dir}')
         os.makedirs(f'{meta_dir}/{version_dir}', exist_ok=True)
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        file_names = load_meta_index(version_dir, meta_dir)
-        metas = executor.map(lambda file_name: try_load_core_meta(version_dir, file_name, meta_dir), file_names)
+    cache_strategy = CacheStrategy.Revalidate if force_refresh else CacheStrategy.CacheAside
+    with concurrent.futures.ThreadPoolExecutor(get_client_pool().max_connections) as executor:
+        file_names = load_meta_index(version_dir, meta_dir, index_cache_strategy)
+        metas = executor.map(
+            lambda file_name: try_load_core_meta(version_dir, file_name, meta_dir, cache_strategy, compression),
+            file_names)
         metas = dict(zip(file_names, metas))
         metas = dict([(file_name, meta) for (file_name, meta) in metas.items() if meta is not None])
     if not metas:
@@ -2,57 +2,189 @@ import asyncio
 import json
 import logging
 import os
-import shutil
-from typing import Optional
+from typing import Optional, Callable
 
 import httpx
 
 from cli_validator.exceptions import VersionNotExistException
 from cli_validator.loader import CacheStrategy
-from cli_validator.loader.utils import load_from_local, store_to_local
+from cli_validator.loader.http import get_client_pool
+from cli_validator.loader.utils import load_from_local, run_in_executor, load_validators, store_validators, \
+    remove_validators, mark_validated, within_max_stale, conditional_headers, FileLock, AtomicFile
 
 BLOB_URL = 'https://azcmdchangemgmt.blob.core.windows.net'
 CONTAINER_NAME = 'cmd-metadata-per-version'
 
 logger = logging.getLogger(__name__)
 
+# Bytes of a response buffered before they are written to the cache file in the executor
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 async def load_http(url: str, cache_path: Optional[str] = None,
-                    cache_strategy: CacheStrategy = CacheStrategy.CacheAside, encoding: str = 'utf-8'):
-    if cache_strategy == CacheStrategy.CacheAside and cache_path and os.path.exists(cache_path):
-        return load_from_local(cache_path, encoding)
+                    cache_strategy: CacheStrategy = CacheStrategy.CacheAside, encoding: str = 'utf-8',
+                    max_stale: Optional[float] = None, on_refresh: Optional[Callable[[str], None]] = None,
+                    compression: Optional[str] = None):
+    """
+    Load a file through network or from local cache
+    :param url: url of the file
+    :param cache_path: path to cache the file, `None` to disable the cache
+    :param cache_strategy: when to use the cache
+    :param encoding: encoding of the file
+    :param max_stale: seconds that the cache can be used since it is validated with `StaleWhileRevalidate`,
+        `None` for no limit
+    :param on_refresh: called with the changed file when it is refreshed in background with `StaleWhileRevalidate`
+    :param compression: compress the cached file with `gzip` or `lzma`, `None` for no compression.
+        Compressed files are read regardless of it
+    :return: content of the file
+    """
+    return await _load_cached(url, cache_path, cache_strategy, lambda data: data.decode(encoding), max_stale,
+                              on_refresh, compression)
+
+
+async def load_http_json(url: str, cache_path: Optional[str] = None,
+                         cache_strategy: CacheStrategy = CacheStrategy.CacheAside, max_stale: Optional[float] = None,
+                         on_refresh: Optional[Callable[[object], None]] = None, compression: Optional[str] = None):
+    """
+    Load a JSON file through network or from local cache, which is parsed from the bytes of the file.
+    Decoding a large file would block the event loop, so it is parsed in the executor.
+    The parameters are the same as `load_http`.
+    :return: the decoded JSON
+    """
+    return await _load_cached(url, cache_path, cache_strategy, json.loads, max_stale, on_refresh, compression)
+
+
+def _load_local(cache_path: str, parse: Callable[[bytes], object]):
+    return parse(load_from_local(cache_path, None))
+
+
+async def _load_cached(url: str, cache_path: Optional[str], cache_strategy: CacheStrategy,
+                       parse: Callable[[bytes], object], max_stale: Optional[float] = None,
+                       on_refresh: Optional[Callable] = None, compression: Optional[str] = None):
+    if cache_path and not await run_in_executor(os.path.exists, cache_path):
+        # Only one process downloads a missing file, the others wait for it and load the downloaded file
+        lock = FileLock(cache_path)
+        await lock.acquire_async()
+        try:
+            if not await run_in_executor(os.path.exists, cache_path):
+                return await _load_http(url, cache_path, cache_strategy, parse, compression=compression)
+        finally:
+            await run_in_executor(lock.release)
+        return await run_in_executor(_load_local, cache_path, parse)
+    return await _load_http(url, cache_path, cache_strategy, parse, max_stale, on_refresh, compression)
+
+
+async def _load_http(url: str, cache_path: Optional[str], cache_strategy: CacheStrategy,
+                     parse: Callable[[bytes], object], max_stale: Optional[float] = None,
+                     on_refresh: Optional[Callable] = None, compression: Optional[str] = None):
+    if cache_path and await run_in_executor(os.path.exists, cache_path):
+        if cache_strategy == CacheStrategy.CacheAside:
+            return await run_in_executor(_load_local, cache_path, parse)
+        if cache_strategy == CacheStrategy.StaleWhileRevalidate and within_max_stale(cache_path, max_stale):
+            data = await run_in_executor(_load_local, cache_path, parse)
+            _refresh_in_background(url, cache_path, parse, on_refresh, compression)
+            return data
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            data = resp.text
+        if cache_path:
+            await _revalidate(url, cache_path, compression)
+        else:
+            data = await _download(url)
     except Exception as e:
         logger.error("Fail to Download Blob", exc_info=e)
-        if cache_strategy == CacheStrategy.Fallback and cache_path and os.path.exists(cache_path):
-            return load_from_local(cache_path, encoding)
-        raise e from e
+        if not (cache_strategy in (CacheStrategy.Fallback, CacheStrategy.StaleWhileRevalidate)
+                and cache_path and await run_in_executor(os.path.exists, cache_path)):
+            raise e from e
     if cache_path:
-        store_to_local(data, cache_path, encoding)
-    return data
+        return await run_in_executor(_load_local, cache_path, parse)
+    return await run_in_executor(parse, data)
+
 
+async def _download(url: str):
+    resp = await get_client_pool().get_async(url)
+    resp.raise_for_status()
+    return resp.content
 
-async def load_version_index(target_dir: Optional[str] = None):
-    cache_path = f'{target_dir}/version_list.txt' if target_dir else None
-    data = await load_http(f'{BLOB_URL}/{CONTAINER_NAME}/version_list.txt', cache_path, CacheStrategy.Fallback)
+
+async def _revalidate(url: str, cache_path: str, compression: Optional[str] = None):
+    """
+    Download a file into the cache, which is a conditional request if the file is cached.
+    The received chunks are buffered and written to the cache file in the executor about `_WRITE_BUFFER_SIZE`
+    bytes at a time.
+    :return: whether the cached file is changed
+    """
+    validators = await run_in_executor(load_validators, cache_path)
+    async with get_client_pool().stream_async(url, headers=conditional_headers(validators)) as resp:
+        if resp.status_code == 304 and validators:
+            await run_in_executor(mark_validated, cache_path)
+            return False
+        resp.raise_for_status()
+        await run_in_executor(remove_validators, cache_path)
+        cache_file = await run_in_executor(AtomicFile, cache_path, None, compression)
+        try:
+            buffer = bytearray()
+            async for chunk in resp.aiter_bytes():
+                buffer += chunk
+                if len(buffer) >= _WRITE_BUFFER_SIZE:
+                    await run_in_executor(cache_file.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await run_in_executor(cache_file.write, bytes(buffer))
+        except BaseException:
+            await run_in_executor(cache_file.discard)
+            raise
+        await run_in_executor(cache_file.commit)
+        await run_in_executor(store_validators, cache_path, resp.headers)
+    return True
+
+
+# Background refreshes by cache path, which are referenced until they are done
+_refreshing = {}
+
+
+def _refresh_in_background(url: str, cache_path: str, parse: Callable[[bytes], object],
+                           on_refresh: Optional[Callable], compression: Optional[str] = None):
+    if cache_path in _refreshing:
+        return
+
+    async def refresh():
+        try:
+            if await _revalidate(url, cache_path, compression) and on_refresh is not None:
+                on_refresh(await run_in_executor(_load_local, cache_path, parse))
+        except Exception as e:
+            logger.warning("Fail to Refresh Blob in Background", exc_info=e)
+        finally:
+            _refreshing.pop(cache_path, None)
+
+    _refreshing[cache_path] = asyncio.ensure_future(refresh())
+
+
+async def load_version_index(target_dir: Optional[str] = None, ext_name: Optional[str] = None,
+                             max_stale: Optional[float] = None):
+    """
+    :param max_stale: seconds to use the cached version list while refreshing it in background,
+        `None` to always revalidate it before use
+    """
+    ext_sep = f'/azure-cli-extensions/ext-{ext_name}' if ext_name else ''
+    cache_path = f'{target_dir}{ext_sep}/version_list.txt' if target_dir else None
+    cache_strategy = CacheStrategy.Fallback if max_stale is None else CacheStrategy.StaleWhileRevalidate
+    data = await load_http(f'{BLOB_URL}/{CONTAINER_NAME}{ext_sep}/version_list.txt', cache_path, cache_strategy,
+                           max_stale=max_stale)
     data = data.strip(' \n')
     return [v.strip() for v in data.split() if v.strip()]
 
 
-async def load_latest_version(target_dir: Optional[str] = None):
-    version_list = await load_version_index(target_dir)
+async def load_latest_version(target_dir: Optional[str] = None, ext_name: Optional[str] = None,
+                              max_stale: Optional[float] = None):
+    version_list = await load_version_index(target_dir, ext_name=ext_name, max_stale=max_stale)
     return version_list[-1]
 
 
-async def try_load_meta(version_dir: str, file_name: str, target_dir: Optional[str] = None):
+async def try_load_meta(version_dir: str, file_name: str, target_dir: Optional[str] = None,
+                        cache_strategy: CacheStrategy = CacheStrategy.CacheAside, compression: Optional[str] = None):
     cache_path = f'{target_dir}/{version_dir}/{file_name}' if target_dir else None
     try:
-        meta = await load_http(f'{BLOB_URL}/{CONTAINER_NAME}/{version_dir}/{file_name}', cache_path)
-        return json.loads(meta)
+        return await load_http_json(f'{BLOB_URL}/{CONTAINER_NAME}/{version_dir}/{file_name}', cache_path,
+                                    cache_strategy, compression=compression)
     except httpx.HTTPStatusError as e:
         logger.error(f'`{version_dir}/{file_name}` not Found', exc_info=e)
         return None
@@ -75,27 +207,40 @@ async def load_meta_index(version_dir: str, target_dir: Optional[str] = './cmd_m
     return file_list
 
 
-async def load_metas(version: Optional[str] = None, meta_dir: Optional[str] = './cmd_meta', force_refresh=False):
+async def get_version_dir(version: Optional[str] = None, target_dir: Optional[str] = None,
+                          max_stale: Optional[float] = None):
+    """
+    Get the directory of a version in the Blob, e.g. `azure-cli-2.51.0`
+    :param version: version of `azure-cli`, the latest version if not provided
+    :param target_dir: root directory to cache Command Metadata
+    :param max_stale: seconds to use the cached version list while refreshing it in background
+    """
+    if not version:
+        return await load_latest_version(target_dir, max_stale=max_stale)
+    return f'azure-cli-{version}'
+
+
+async def load_metas(version: Optional[str] = None, meta_dir: Optional[str] = './cmd_meta', force_refresh=False,
+                     version_dir: Optional[str] = None, compression: Optional[str] = None):
     """
     Load Command Metadata from local cache, fetch from Blob if not found
     :param version: version of `azure-cli` to be loaded
     :param meta_dir: root directory to cache Command Metadata
-    :param force_refresh: load the metadata through network no matter whether there is a cache
+    :param force_refresh: revalidate the cached metadata through network, and download only the changed files
+    :param version_dir: the directory of the version in the Blob if it is already resolved from `version`
+    :param compression: compress the cached metadata with `gzip` or `lzma`, `None` for no compression
     :return: list of command metadata
     """
-    if not version:
-        version_dir = await load_latest_version(meta_dir)
-    else:
-        version_dir = f'azure-cli-{version}'
+    if not version_dir:
+        version_dir = await get_version_dir(version, meta_dir)
     if meta_dir:
-        if force_refresh and os.path.exists(f'{meta_dir}/{version_dir}'):
-            shutil.rmtree(f'{meta_dir}/{version_dir}')
         os.makedirs(f'{meta_dir}/{version_dir}', exist_ok=True)
+    cache_strategy = CacheStrategy.Revalidate if force_refresh else CacheStrategy.CacheAside
     files = []
     tasks = []
     for file_name in await load_meta_index(version_dir, meta_dir):
         files.append(file_name)
-        tasks.append(asyncio.create_task(try_load_meta(version_dir, file_name, meta_dir)))
+        tasks.append(asyncio.create_task(try_load_meta(version_dir, file_name, meta_dir, cache_strategy, compression)))
     metas = []
     if len(tasks) > 0:
         metas = await asyncio.gather(*tasks)
@@ -1,33 +1,207 @@
+import json
+import os
 from typing import Optional
 
+from cli_validator.cache import LRUCache
 from cli_validator.cmd_tree import CommandTreeParser
-from cli_validator.loader import BaseLoader
-from cli_validator.loader.cmd_meta import load_core_metas
+from cli_validator.loader import BaseLoader, CacheStrategy, build_command_index
+from cli_validator.loader.cmd_meta import load_core_metas, get_version_dir, try_load_core_meta
+from cli_validator.loader.meta_store import MetaStore, write_meta_store
+from cli_validator.loader.utils import load_json_from_local, store_to_local, run_in_executor, InflightLoads, \
+    check_compression
 from cli_validator.result import CommandSource
 
 
 class CoreRepoLoader(BaseLoader):
     BLOB_URL = 'https://azcmdchangemgmt.blob.core.windows.net'
     CONTAINER_NAME = 'cmd-metadata-per-version'
+    COMMAND_TREE_FILE = 'command_tree.json'
+    META_STORE_FILE = 'command_meta.store'
 
-    def __init__(self, cache_dir: Optional[str] = './core_repo'):
+    def __init__(self, cache_dir: Optional[str] = './core_repo', lazy=False, max_modules: Optional[int] = None,
+                 use_meta_store=False, max_stale: Optional[float] = None, compression: Optional[str] = None):
         """
         :param cache_dir: cache directory that store the downloaded metadata
+        :param lazy: only build the command tree when loading, and decode the metadata of a module
+            the first time one of its commands is validated
+        :param max_modules: max number of decoded modules kept in memory in lazy mode, `None` for unbounded
+        :param use_meta_store: keep the metadata in a memory-mapped `MetaStore` and decode only the validated command,
+            which implies `lazy`
+        :param max_stale: seconds to use the cached version list since it is validated when loading the latest
+            version, while refreshing it in background. `None` to always revalidate it before use
+        :param compression: compress the cached metadata with `gzip` or `lzma`, `None` for no compression
         """
+        check_compression(compression)
         super().__init__(cache_dir)
+        self.lazy = lazy or use_meta_store
+        # The configured mode, which `lazy` returns to when loading again after a snapshot
+        self._configured_lazy = self.lazy
+        self.use_meta_store = use_meta_store
+        self.max_stale = max_stale
+        self.compression = compression
+        self.version_dir: Optional[str] = None
+        self.module_metas = LRUCache(max_modules)
+        self._module_loads = InflightLoads()
+        # Whether the loaded metadata can be loaded again from `cache_dir` without network
+        self._from_cache = False
 
     def load(self, version: Optional[str] = None, force_refresh=False):
         """
         :param version: the version of `azure-cli` that provides the metadata
         :param force_refresh: load the metadata through network no matter whether there is a cache
         """
-        self.metas = load_core_metas(version, self.cache_dir, force_refresh=force_refresh)
+        self._load(version, force_refresh)
+
+    def _load(self, version: Optional[str] = None, force_refresh=False,
+              index_cache_strategy: CacheStrategy = CacheStrategy.Fallback):
+        self.lazy = self._configured_lazy
+        if self.lazy:
+            self._load_lazy(version, force_refresh, index_cache_strategy)
+            return
+        version_dir = get_version_dir(version, self.cache_dir, max_stale=self.max_stale)
+        self.metas = load_core_metas(version, self.cache_dir, force_refresh=force_refresh, version_dir=version_dir,
+                                     compression=self.compression, index_cache_strategy=index_cache_strategy)
+        self.version = version
+        self.version_dir = version_dir
         self.command_tree = build_command_tree(self.metas, CommandSource.CORE_MODULE)
+        self.command_index = build_command_index(self.metas)
+        self._from_cache = bool(self.cache_dir)
+        self.generation += 1
 
     async def load_async(self, version: Optional[str] = None, force_refresh=False):
-        from cli_validator.loader.cmd_meta.aio import load_metas
-        self.metas = await load_metas(version, self.cache_dir, force_refresh=force_refresh)
+        import asyncio
+        from cli_validator.loader.cmd_meta import aio
+        self.lazy = self._configured_lazy
+        if self.lazy:
+            await asyncio.get_running_loop().run_in_executor(None, self._load_lazy, version, force_refresh)
+            return
+        version_dir = await aio.get_version_dir(version, self.cache_dir, max_stale=self.max_stale)
+        self.metas = await aio.load_metas(version, self.cache_dir, force_refresh=force_refresh,
+                                          version_dir=version_dir, compression=self.compression)
+        self.version = version
+        self.version_dir = version_dir
         self.command_tree = build_command_tree(self.metas, CommandSource.CORE_MODULE)
+        self.command_index = build_command_index(self.metas)
+        self._from_cache = bool(self.cache_dir)
+        self.generation += 1
+
+    def load_snapshot(self, version_dir: str, command_tree: dict, metas: dict):
+        """
+        Load the command tree and metadata restored from a snapshot
+        :param version_dir: the directory of the version in the Blob, e.g. `azure-cli-2.51.0`
+        :param command_tree: the built command tree
+        :param metas: metadata of all modules
+        """
+        # All the metadata is in the snapshot, until the loader loads again in the configured mode
+        self.lazy = False
+        self.module_metas.clear()
+        self.meta_store = None
+        self.metas = metas
+        self.version = version_dir[len('azure-cli-'):]
+        self.version_dir = version_dir
+        self.command_tree = CommandTreeParser(command_tree, CommandSource.CORE_MODULE)
+        self.command_index = build_command_index(metas)
+        self._from_cache = False
+        self.generation += 1
+
+    def get_meta_version(self, module: str):
+        return self.version_dir
+
+    def _load_lazy(self, version: Optional[str] = None, force_refresh=False,
+                   index_cache_strategy: CacheStrategy = CacheStrategy.Fallback):
+        version_dir = get_version_dir(version, self.cache_dir, max_stale=self.max_stale)
+        tree_path = os.path.join(self.cache_dir, version_dir, self.COMMAND_TREE_FILE) if self.cache_dir else None
+        metas = None
+        if tree_path and os.path.exists(tree_path) and not force_refresh:
+            tree = load_json_from_local(tree_path)
+        else:
+            # All the metadata has to be decoded once to know the module of each command
+            metas = load_core_metas(version, self.cache_dir, force_refresh=force_refresh, version_dir=version_dir,
+                                    compression=self.compression, index_cache_strategy=index_cache_strategy)
+            tree = build_command_tree(metas, CommandSource.CORE_MODULE).cmd_tree
+            if tree_path:
+                store_to_local(json.dumps(tree), tree_path, compression=self.compression)
+        if self.use_meta_store:
+            store_path = os.path.join(self.cache_dir, version_dir, self.META_STORE_FILE) if self.cache_dir else None
+            if metas is not None and store_path:
+                write_meta_store(store_path, metas)
+            self.meta_store = MetaStore.open_or_create(store_path, lambda: metas or load_core_metas(
+                version, self.cache_dir, version_dir=version_dir, compression=self.compression,
+                index_cache_strategy=index_cache_strategy))
+        self.metas = None
+        self.command_index = None
+        self.module_metas.clear()
+        self.version = version
+        self.version_dir = version_dir
+        self.command_tree = CommandTreeParser(tree, CommandSource.CORE_MODULE)
+        self._from_cache = bool(self.cache_dir)
+        self.generation += 1
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._from_cache:
+            # The metadata is loaded again from the cache when unpickled instead of being pickled
+            for key in ('metas', 'command_tree', 'command_index', 'meta_store'):
+                state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._from_cache:
+            version = self.version
+            # Only the cache is read, without fetching the list of the metadata files again
+            self._load(self.version_dir[len('azure-cli-'):], index_cache_strategy=CacheStrategy.CacheAside)
+            self.version = version
+
+    def _load_lazy_module(self, module: str):
+        if self.version_dir is None:
+            return None
+        # The decoded metadata is kept along with the index of its commands
+        loaded = self.module_metas.get(module)
+        if loaded is None:
+            meta = try_load_core_meta(self.version_dir, f'az_{module}_meta.json', self.cache_dir,
+                                      compression=self.compression)
+            if meta is None:
+                return None
+            loaded = (meta, build_command_index({module: meta}))
+            self.module_metas.put(module, loaded)
+        return loaded
+
+    async def _load_lazy_module_async(self, module: str):
+        from cli_validator.loader.cmd_meta import aio
+        version_dir = self.version_dir
+        meta = await aio.try_load_meta(version_dir, f'az_{module}_meta.json', self.cache_dir,
+                                       compression=self.compression)
+        if meta is None:
+            return None
+        loaded = (meta, await run_in_executor(build_command_index, {module: meta}))
+        if version_dir == self.version_dir:
+            self.module_metas.put(module, loaded)
+        return loaded
+
+    def get_module_meta(self, module: str):
+        if not self.lazy:
+            return super().get_module_meta(module)
+        loaded = self._load_lazy_module(module)
+        return loaded[0] if loaded is not None else None
+
+    def get_command_index(self, module: str):
+        if not self.lazy:
+            return super().get_command_index(module)
+        loaded = self._load_lazy_module(module)
+        return loaded[1] if loaded is not None else None
+
+    async def get_command_index_async(self, module: str):
+        if not self.lazy:
+            return super().get_command_index(module)
+        if self.version_dir is None:
+            return None
+        loaded = self.module_metas.get(module)
+        if loaded is None:
+            # Concurrent validations of commands in the same module share one load
+            loaded = await self._module_loads.load((self.version_dir, module),
+                                                   lambda: self._load_lazy_module_async(module))
+        return loaded[1] if loaded is not None else None
 
 
 def _attach_sub_group_to_node(sub_group, tree_node, module):
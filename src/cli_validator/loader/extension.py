@@ -1,63 +1,311 @@
-import json
 import logging
 import os
-from typing import Optional, List
+import threading
+import time
+import weakref
+from typing import Optional, List, Dict
 
-import requests
+import httpx
 
+from cli_validator.cache import LRUCache, approx_size
 from cli_validator.cmd_tree import CommandTreeParser
 from cli_validator.exceptions import CommandMetaNotFoundException, ExtensionNotFoundException
-from cli_validator.loader import BaseLoader, CacheStrategy
+from cli_validator.loader import BaseLoader, CacheStrategy, build_command_index
 from cli_validator.loader.cmd_meta import load_latest_version, try_load_meta
+from cli_validator.loader.meta_store import MetaStore
+from cli_validator.loader.utils import load_json_from_local, run_in_executor, InflightLoads, check_compression
 from cli_validator.result import CommandSource
 
 logger = logging.getLogger(__name__)
 
 
+# Loaders whose locks are created again in a forked process
+_loaders = weakref.WeakSet()
+
+
 class ExtensionLoader(BaseLoader):
     EXTENSION_COMMAND_TREE_URL = \
         'https://azurecliextensionsync.blob.core.windows.net/cmd-index/extensionCommandTree.json'
 
-    def __init__(self, cache_dir: Optional[str] = './extension'):
+    def __init__(self, cache_dir: Optional[str] = './extension', version_ttl: Optional[float] = 3600,
+                 meta_cache_bytes: Optional[int] = 64 * 1024 * 1024, use_meta_store=False,
+                 max_stale: Optional[float] = None, compression: Optional[str] = None):
+        """
+        :param cache_dir: cache directory that store the downloaded metadata
+        :param version_ttl: seconds to reuse the resolved latest version of an extension before fetching the version
+            list again, `None` to never expire
+        :param meta_cache_bytes: approximate memory budget of decoded extension metadata kept in memory,
+            `None` for unbounded and `0` to decode the metadata file for every command. The metadata of an extension
+            larger than the budget is decoded for every command, which is counted in `meta_cache.stats.rejections`
+        :param use_meta_store: convert the metadata of each extension into a memory-mapped `MetaStore` and decode
+            only the validated command instead of keeping decoded metadata in memory
+        :param max_stale: seconds to use the cached command tree and version lists since they are validated,
+            while refreshing them in background. `None` to always revalidate them before use
+        :param compression: compress the cached command tree and metadata with `gzip` or `lzma`,
+            `None` for no compression
+        """
+        check_compression(compression)
         super().__init__(cache_dir)
         self.tree_path = os.path.join(self.cache_dir, 'ext_command_tree.json') if self.cache_dir else None
+        self.version_ttl = version_ttl
+        # The metadata file name resolved for each extension, which contains the extension version
+        self.versions: Dict[str, str] = {}
+        self._resolved_at: Dict[str, float] = {}
+        self._version_lock = threading.Lock()
+        self.meta_cache = LRUCache(0 if meta_cache_bytes == 0 else None, max_weight=meta_cache_bytes,
+                                   weigher=approx_size)
+        self.use_meta_store = use_meta_store
+        self.meta_stores: Dict[str, MetaStore] = {}
+        self._store_lock = threading.Lock()
+        _loaders.add(self)
+        self._inflight = InflightLoads()
+        self.max_stale = max_stale
+        self.compression = compression
+        # Whether the command tree can be loaded again from `tree_path` without network
+        self._from_cache = False
 
     def load(self):
-        from cli_validator.loader.cmd_meta import load_http
+        from cli_validator.loader.cmd_meta import load_http_json
         if self.cache_dir:
             os.makedirs(self.cache_dir, exist_ok=True)
-        raw_tree = load_http(self.EXTENSION_COMMAND_TREE_URL, self.tree_path, cache_strategy=CacheStrategy.Fallback)
-        tree = json.loads(raw_tree)
+        tree = load_http_json(self.EXTENSION_COMMAND_TREE_URL, self.tree_path, cache_strategy=self._cache_strategy(),
+                              max_stale=self.max_stale, on_refresh=self._swap_command_tree,
+                              compression=self.compression)
         self.command_tree = CommandTreeParser(tree, CommandSource.EXTENSION)
+        self._from_cache = bool(self.tree_path)
+        self.generation += 1
+        self.refresh_versions()
 
     async def load_async(self):
-        from cli_validator.loader.cmd_meta.aio import load_http
+        from cli_validator.loader.cmd_meta.aio import load_http_json
         if self.cache_dir:
             os.makedirs(self.cache_dir, exist_ok=True)
-        raw_tree = await load_http(self.EXTENSION_COMMAND_TREE_URL, self.tree_path,
-                                   cache_strategy=CacheStrategy.Fallback)
-        tree = json.loads(raw_tree)
+        tree = await load_http_json(self.EXTENSION_COMMAND_TREE_URL, self.tree_path,
+                                    cache_strategy=self._cache_strategy(), max_stale=self.max_stale,
+                                    on_refresh=self._swap_command_tree, compression=self.compression)
         self.command_tree = CommandTreeParser(tree, CommandSource.EXTENSION)
+        self._from_cache = bool(self.tree_path)
+        self.generation += 1
+        self.refresh_versions()
+
+    def _cache_strategy(self):
+        return CacheStrategy.Fallback if self.max_stale is None else CacheStrategy.StaleWhileRevalidate
+
+    def _swap_command_tree(self, tree: dict):
+        # Called with the command tree refreshed in background, which replaces the loaded tree at once
+        if self._from_cache:
+            self.command_tree = CommandTreeParser(tree, CommandSource.EXTENSION)
+            self.generation += 1
+
+    def load_snapshot(self, command_tree: dict):
+        """
+        Load the command tree restored from a snapshot
+        :param command_tree: the extension command tree
+        """
+        self.command_tree = CommandTreeParser(command_tree, CommandSource.EXTENSION)
+        self._from_cache = False
+        self.generation += 1
+        self.refresh_versions()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_version_lock'], state['_store_lock']
+        # Memory-mapped stores are opened again on use, and the tree is loaded again from the cache
+        state['meta_stores'] = {}
+        if self._from_cache:
+            state['command_tree'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._version_lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        _loaders.add(self)
+        if self._from_cache:
+            self.command_tree = CommandTreeParser(load_json_from_local(self.tree_path), CommandSource.EXTENSION)
+
+    def resolve_version(self, ext_name: str):
+        """
+        Get the metadata file name of the latest version of an extension.
+        The result is reused for `version_ttl` seconds so that the version list is not fetched for every command.
+        :param ext_name: name of the extension
+        :return: metadata file name, e.g. `az_devcenter_meta_1.0.0.json`
+        """
+        file_name = self._get_resolved_version(ext_name)
+        if file_name:
+            return file_name
+        file_name = load_latest_version(self.cache_dir, ext_name, max_stale=self.max_stale)
+        self._set_resolved_version(ext_name, file_name)
+        return file_name
+
+    async def resolve_version_async(self, ext_name: str):
+        """
+        Get the metadata file name of the latest version of an extension without blocking the event loop.
+        Concurrent calls for the same extension share one fetch of the version list.
+        :param ext_name: name of the extension
+        :return: metadata file name, e.g. `az_devcenter_meta_1.0.0.json`
+        """
+        from cli_validator.loader.cmd_meta import aio
+        file_name = self._get_resolved_version(ext_name)
+        if file_name:
+            return file_name
+        file_name = await self._inflight.load(
+            ('version', ext_name), lambda: aio.load_latest_version(self.cache_dir, ext_name, max_stale=self.max_stale))
+        self._set_resolved_version(ext_name, file_name)
+        return file_name
+
+    def _get_resolved_version(self, ext_name: str):
+        with self._version_lock:
+            file_name = self.versions.get(ext_name)
+            if file_name and (self.version_ttl is None
+                              or time.monotonic() - self._resolved_at[ext_name] < self.version_ttl):
+                return file_name
+        return None
+
+    def _set_resolved_version(self, ext_name: str, file_name: str):
+        with self._version_lock:
+            if self.versions.get(ext_name, file_name) != file_name:
+                self.generation += 1
+            self.versions[ext_name] = file_name
+            self._resolved_at[ext_name] = time.monotonic()
+
+    def refresh_versions(self, ext_name: Optional[str] = None):
+        """
+        Forget the resolved versions so that they are fetched again on next use.
+        :param ext_name: the extension to refresh, `None` for all extensions
+        """
+        with self._version_lock:
+            if ext_name is None:
+                self.versions.clear()
+                self._resolved_at.clear()
+            else:
+                self.versions.pop(ext_name, None)
+                self._resolved_at.pop(ext_name, None)
+            self.generation += 1
 
     def _ext_meta_rel_uri(self, ext_name: str, version: Optional[str] = None):
         if not version:
-            file_name = load_latest_version(self.cache_dir, ext_name)
+            file_name = self.resolve_version(ext_name)
         else:
             file_name = f'az_{ext_name}_meta_{version}.json'
-        return f'azure-cli-extensions/ext-{ext_name}/{file_name}'
+        return f'{self._ext_meta_dir(ext_name)}/{file_name}'
+
+    @staticmethod
+    def _ext_meta_dir(ext_name: str):
+        return f'azure-cli-extensions/ext-{ext_name}'
+
+    def get_meta_version(self, module: str):
+        return self.versions.get(module)
+
+    def _load_ext_index(self, rel_uri: str):
+        # Only the flat index of commands is kept, the command groups of the decoded metadata are dropped
+        command_index = self.meta_cache.get(rel_uri)
+        if command_index is None:
+            meta = try_load_meta(rel_uri, self.cache_dir, compression=self.compression)
+            if not meta:
+                return None
+            command_index = build_command_index({rel_uri: meta})
+            self.meta_cache.put(rel_uri, command_index)
+        return command_index
+
+    def _load_ext_store(self, rel_uri: str):
+        store = self.meta_stores.get(rel_uri)
+        if store is not None:
+            return store
+        store_path = f'{self.cache_dir}/{rel_uri}.store' if self.cache_dir else None
+        store = MetaStore.try_open(store_path) if store_path else None
+        if store is None:
+            meta = try_load_meta(rel_uri, self.cache_dir, compression=self.compression)
+            if meta is None:
+                return None
+            store = MetaStore.open_or_create(store_path, lambda: {rel_uri: meta})
+        with self._store_lock:
+            return self.meta_stores.setdefault(rel_uri, store)
 
     def load_command_meta(self, signature: List[str], module: str):
         try:
             rel_uri = self._ext_meta_rel_uri(module, version=None)
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             logger.warning(f'{e} when retrieving versions of {module}')
             raise ExtensionNotFoundException(signature, module) from e
-        meta = try_load_meta(rel_uri, self.cache_dir)
-        if meta:
-            try:
-                for idx in range(len(signature) - 1):
-                    meta = meta['sub_groups'][' '.join(signature[:idx + 1])]
-                return meta['commands'][' '.join(signature)]
-            except KeyError as e:
-                raise CommandMetaNotFoundException(signature) from e
-        return None
+        if self.use_meta_store:
+            store = self._load_ext_store(rel_uri)
+            if store is None:
+                return None
+            meta = store.get(' '.join(signature))
+            if meta is None:
+                raise CommandMetaNotFoundException(signature)
+            return meta
+        command_index = self._load_ext_index(rel_uri)
+        if command_index is None:
+            return None
+        indexed = command_index.get(tuple(signature))
+        if indexed is None:
+            raise CommandMetaNotFoundException(signature)
+        return indexed[1]
+
+    async def _load_ext_index_async(self, ext_name: str, file_name: str):
+        from cli_validator.loader.cmd_meta import aio
+        rel_uri = f'{self._ext_meta_dir(ext_name)}/{file_name}'
+        meta = await aio.try_load_meta(self._ext_meta_dir(ext_name), file_name, self.cache_dir,
+                                       compression=self.compression)
+        if not meta:
+            return None
+        command_index = await run_in_executor(build_command_index, {rel_uri: meta})
+        self.meta_cache.put(rel_uri, command_index)
+        return command_index
+
+    async def _load_ext_store_async(self, ext_name: str, file_name: str):
+        from cli_validator.loader.cmd_meta import aio
+        rel_uri = f'{self._ext_meta_dir(ext_name)}/{file_name}'
+        store_path = f'{self.cache_dir}/{rel_uri}.store' if self.cache_dir else None
+        store = await run_in_executor(MetaStore.try_open, store_path) if store_path else None
+        if store is None:
+            meta = await aio.try_load_meta(self._ext_meta_dir(ext_name), file_name, self.cache_dir,
+                                           compression=self.compression)
+            if meta is None:
+                return None
+            store = await run_in_executor(MetaStore.open_or_create, store_path, lambda: {rel_uri: meta})
+        with self._store_lock:
+            return self.meta_stores.setdefault(rel_uri, store)
+
+    async def load_command_meta_async(self, signature: List[str], module: str):
+        try:
+            file_name = await self.resolve_version_async(module)
+        except httpx.HTTPError as e:
+            logger.warning(f'{e} when retrieving versions of {module}')
+            raise ExtensionNotFoundException(signature, module) from e
+        rel_uri = f'{self._ext_meta_dir(module)}/{file_name}'
+        # Concurrent validations of commands in the same extension share one load of its metadata
+        if self.use_meta_store:
+            store = self.meta_stores.get(rel_uri)
+            if store is None:
+                store = await self._inflight.load(('store', rel_uri),
+                                                  lambda: self._load_ext_store_async(module, file_name))
+                if store is None:
+                    return None
+            meta = store.get(' '.join(signature))
+            if meta is None:
+                raise CommandMetaNotFoundException(signature)
+            return meta
+        command_index = self.meta_cache.get(rel_uri)
+        if command_index is None:
+            command_index = await self._inflight.load(('index', rel_uri),
+                                                      lambda: self._load_ext_index_async(module, file_name))
+            if command_index is None:
+                return None
+        indexed = command_index.get(tuple(signature))
+        if indexed is None:
+            raise CommandMetaNotFoundException(signature)
+        return indexed[1]
+
+
+def _reset_after_fork():
+    # The locks may be held by a thread of the parent process, which doesn't exist in the forked process
+    for loader in list(_loaders):
+        loader._version_lock = threading.Lock()
+        loader._store_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
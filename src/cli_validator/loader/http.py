@@ -0,0 +1,140 @@
+import asyncio
+import contextlib
+import os
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpClientPool(object):
+    """
+    HTTP clients shared by all the downloads of metadata, which keep connections alive between requests.
+    The sync client is shared by all threads, and an async client is created for each event loop.
+    """
+
+    def __init__(self, max_connections: int = 16, timeout: Optional[float] = 30.0, http2: Optional[bool] = None):
+        """
+        :param max_connections: max number of concurrent requests and open connections
+        :param timeout: seconds to wait for connecting, reading or writing, `None` to wait forever
+        :param http2: use HTTP/2 if the server supports it, which requires `h2`. Enabled if `h2` is installed
+            when not provided
+        """
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.http2 = _http2_available() if http2 is None else http2
+        self._client: Optional[httpx.Client] = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _client_args(self):
+        return dict(limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    timeout=httpx.Timeout(self.timeout), http2=self.http2, follow_redirects=True)
+
+    def get_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_args())
+            return self._client
+
+    def get_async_client(self):
+        """
+        Get the async client of the running event loop and the semaphore that bounds the concurrent requests in it
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = (httpx.AsyncClient(**self._client_args()), asyncio.Semaphore(self.max_connections))
+                self._async_clients[loop] = client
+            return client
+
+    def get(self, url: str, headers: Optional[dict] = None) -> httpx.Response:
+        return self.get_client().get(url, headers=headers)
+
+    async def get_async(self, url: str, headers: Optional[dict] = None) -> httpx.Response:
+        client, semaphore = self.get_async_client()
+        async with semaphore:
+            return await client.get(url, headers=headers)
+
+    def stream(self, url: str, headers: Optional[dict] = None):
+        """
+        Send a request whose response body is not read until it is iterated
+        :return: context manager of the response, which closes the response on exit
+        """
+        return self.get_client().stream('GET', url, headers=headers)
+
+    @contextlib.asynccontextmanager
+    async def stream_async(self, url: str, headers: Optional[dict] = None):
+        """
+        Send a request whose response body is not read until it is iterated, which holds a connection of the
+        bounded concurrent requests until the response is closed
+        :return: async context manager of the response
+        """
+        client, semaphore = self.get_async_client()
+        async with semaphore:
+            async with client.stream('GET', url, headers=headers) as resp:
+                yield resp
+
+    def close(self):
+        """
+        Close the sync client. Async clients are dropped along with their event loops.
+        """
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    def _reset(self):
+        # Connections inherited by a forked process can't be shared with the parent process
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+
+_pool: Optional[HttpClientPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_client_pool() -> HttpClientPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HttpClientPool()
+        return _pool
+
+
+def configure_http(max_connections: int = 16, timeout: Optional[float] = 30.0, http2: Optional[bool] = None):
+    """
+    Configure the HTTP clients used to download metadata, which replaces the clients created before
+    :param max_connections: max number of concurrent requests and open connections
+    :param timeout: seconds to wait for connecting, reading or writing, `None` to wait forever
+    :param http2: use HTTP/2 if the server supports it, which requires `h2`. Enabled if `h2` is installed
+        when not provided
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, HttpClientPool(max_connections, timeout, http2)
+    if pool is not None:
+        pool.close()
+
+
+def _reset_after_fork():
+    global _pool_lock
+    _pool_lock = threading.Lock()
+    if _pool is not None:
+        _pool._reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,145 @@
+"""
+A read-only store of command metadata that decodes only the command being validated.\n
+The store is one file: `b'CLIVMETA'`, format version and index length, followed by the JSON index that maps a
+command signature to the offset and length of its blob, and the JSON metadata blob of each command.
+Only JSON is decoded from the file, so a store in a shared cache can't run code in the reading process.
+The file is opened with `mmap`, so its pages are shared by all the processes reading it.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Optional, Dict, Tuple, Union
+
+from cli_validator.meta.util import strip_command_meta
+
+MAGIC = b'CLIVMETA'
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('>8sHQ')
+
+
+def _iter_commands(meta: dict):
+    yield from meta['commands'].items()
+    for sub_group in meta['sub_groups'].values():
+        yield from _iter_commands(sub_group)
+
+
+def _dump_json(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def dump_meta_store(metas: Dict[str, dict]) -> bytes:
+    """
+    Serialize command metadata into the store format
+    :param metas: metadata of modules or extensions, keyed by file name
+    """
+    index: Dict[str, Tuple[int, int]] = {}
+    blobs = []
+    offset = 0
+    for meta in metas.values():
+        for signature, command in _iter_commands(meta):
+            if signature in index:
+                continue
+            blob = _dump_json(strip_command_meta(command))
+            index[signature] = (offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+    raw_index = _dump_json(index)
+    return b''.join([_HEADER.pack(MAGIC, FORMAT_VERSION, len(raw_index)), raw_index] + blobs)
+
+
+def write_meta_store(path: str, metas: Dict[str, dict]):
+    """
+    Write command metadata into a store file, the file is replaced atomically
+    :param path: path of the store file
+    :param metas: metadata of modules or extensions, keyed by file name
+    """
+    data = dump_meta_store(metas)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as store_file:
+        store_file.write(data)
+    os.replace(tmp_path, path)
+
+
+class MetaStore(object):
+    def __init__(self, buffer: Union[bytes, mmap.mmap]):
+        """
+        :param buffer: content of a store, use `MetaStore.open` to map a store file
+        """
+        magic, format_version, index_length = _HEADER.unpack_from(buffer)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('Unsupported metadata store')
+        self.buffer = buffer
+        start = _HEADER.size
+        self.index: Dict[str, Tuple[int, int]] = json.loads(buffer[start: start + index_length])
+        self.data_start = start + index_length
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        Map a store file into memory
+        :param path: path of the store file
+        """
+        with open(path, 'rb') as store_file:
+            buffer = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer)
+        except Exception:
+            buffer.close()
+            raise
+
+    @classmethod
+    def open_or_create(cls, path: Optional[str], metas_factory):
+        """
+        Map a store file, which is written with the metadata from `metas_factory` if it doesn't exist.
+        The store is kept in memory if `path` is `None`.
+        :param path: path of the store file
+        :param metas_factory: a callable that returns metadata of modules or extensions, keyed by file name
+        """
+        if path is None:
+            return cls(dump_meta_store(metas_factory()))
+        store = cls.try_open(path)
+        if store is None:
+            write_meta_store(path, metas_factory())
+            store = cls.open(path)
+        return store
+
+    @classmethod
+    def try_open(cls, path: str):
+        """
+        Map a store file if it exists and is in the current format
+        :param path: path of the store file
+        :return: the store, `None` if it should be written again
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            return cls.open(path)
+        except ValueError:
+            # Written in another format, e.g. by an older version
+            return None
+
+    def get(self, signature: str) -> Optional[dict]:
+        """
+        Decode metadata of a command
+        :param signature: full signature of the command, e.g. `vm create`
+        :return: the command metadata, `None` if not found
+        """
+        location = self.index.get(signature)
+        if location is None:
+            return None
+        offset, length = location
+        offset += self.data_start
+        return json.loads(self.buffer[offset: offset + length])
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __contains__(self, signature: str):
+        return signature in self.index
+
+    def __len__(self):
+        return len(self.index)
@@ -1,20 +1,301 @@
+import gzip
+import json
 import logging
+import lzma
 import os
+import threading
+import time
+from typing import Optional, Iterable
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 logger = logging.getLogger(__name__)
 
 
+# Modules of the supported compression of cache files, and the magic number that starts a compressed file
+COMPRESSIONS = {'gzip': (gzip, b'\x1f\x8b'), 'lzma': (lzma, b'\xfd7zXZ\x00')}
+
+
+def check_compression(compression: Optional[str]):
+    """
+    :param compression: `gzip`, `lzma` or `None` for no compression
+    :raise ValueError: if the compression is not supported
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f'Unsupported compression: {compression}, choose from {", ".join(COMPRESSIONS)}')
+
+
+def open_local(cache_path: str, encoding: Optional[str] = 'utf-8'):
+    """
+    Open a cache file to read, which is decompressed while reading if the file is compressed
+    :param encoding: encoding to read text, `None` to read bytes
+    """
+    with open(cache_path, "rb") as cache_file:
+        head = cache_file.read(6)
+    mode = "rb" if encoding is None else "rt"
+    for module, magic in COMPRESSIONS.values():
+        if head.startswith(magic):
+            return module.open(cache_path, mode, encoding=encoding)
+    return open(cache_path, mode, encoding=encoding)
+
+
 def load_from_local(cache_path: str, encoding='utf-8'):
-    with open(cache_path, "r", encoding=encoding) as cache_file:
+    with open_local(cache_path, encoding) as cache_file:
         return cache_file.read()
 
 
-def store_to_local(data: str, cache_path: str, encoding='utf-8'):
-    cache_dir = os.path.dirname(cache_path)
-    if not os.path.exists(cache_path):
-        os.makedirs(cache_dir, exist_ok=True)
+def load_json_from_local(cache_path: str):
+    """
+    Parse a cached JSON file from its bytes, without decoding the file into another string first
+    """
+    with open_local(cache_path, None) as cache_file:
+        return json.loads(cache_file.read())
+
+
+class AtomicFile(object):
+    """
+    A cache file written into a temporary file, which replaces the cache file at once when the writing is done,
+    so that readers in other threads or processes never see a partial file
+    """
+
+    def __init__(self, cache_path: str, encoding: Optional[str] = None, compression: Optional[str] = None):
+        """
+        :param cache_path: path of the cache file
+        :param encoding: encoding to write text, `None` to write bytes
+        :param compression: compress the file with `gzip` or `lzma`, `None` for no compression
+        """
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        self.cache_path = cache_path
+        self.tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        mode = "wb" if encoding is None else "wt"
+        if compression is None:
+            self._file = open(self.tmp_path, mode, encoding=encoding)
+        else:
+            self._file = COMPRESSIONS[compression][0].open(self.tmp_path, mode, encoding=encoding)
+
+    def write(self, data):
+        self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.cache_path)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+def store_to_local(data: str, cache_path: str, encoding='utf-8', compression: Optional[str] = None):
+    """
+    :param compression: compress the file with `gzip` or `lzma`, `None` for no compression
+    """
     try:
-        with open(cache_path, "w", encoding=encoding) as cache_file:
+        with AtomicFile(cache_path, encoding, compression) as cache_file:
             cache_file.write(data)
     except FileNotFoundError as e:
         logger.warning("Cache File (%s) Not Found! ", cache_path, exc_info=e)
+
+
+def store_chunks_to_local(chunks: Iterable[bytes], cache_path: str, compression: Optional[str] = None):
+    """
+    Write chunks of bytes, e.g. a streamed response, into a cache file
+    :param compression: compress the file with `gzip` or `lzma`, `None` for no compression
+    """
+    with AtomicFile(cache_path, compression=compression) as cache_file:
+        for chunk in chunks:
+            cache_file.write(chunk)
+
+
+class FileLock(object):
+    """
+    Exclusive lock of a cache file shared by threads and processes, which is held on a lock file next to it.
+    It doesn't lock anything on platforms without `fcntl` or `msvcrt`.
+    """
+
+    def __init__(self, cache_path: str):
+        self.lock_path = f'{cache_path}.lock'
+        self._lock_file = None
+
+    def acquire(self, blocking=True):
+        """
+        :param blocking: wait until the lock is released by others
+        :return: whether the lock is acquired
+        """
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            if blocking:
+                raise
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        lock_file, self._lock_file = self._lock_file, None
+        if lock_file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        lock_file.close()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    async def acquire_async(self, interval=0.05):
+        """
+        Wait for the lock without blocking the event loop or a thread of the executor.
+        Each attempt opens the lock file in the executor.
+        :param interval: seconds between attempts
+        """
+        import asyncio
+        while not await run_in_executor(self.acquire, False):
+            await asyncio.sleep(interval)
+
+
+def _validators_path(cache_path: str):
+    return f'{cache_path}.validators'
+
+
+def load_validators(cache_path: str):
+    """
+    Load the `ETag` and `Last-Modified` of a cached response from its sidecar file
+    :param cache_path: path of the cached response
+    :return: dict of the validators, empty if they are unknown or the cached response doesn't exist
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(_validators_path(cache_path), "r", encoding='utf-8') as validators_file:
+            return json.load(validators_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_validators(cache_path: str, headers):
+    """
+    Store the `ETag` and `Last-Modified` of a response into the sidecar file of its cache
+    :param cache_path: path of the cached response
+    :param headers: headers of the response
+    """
+    validators = {name: headers[name] for name in ('etag', 'last-modified') if name in headers}
+    if validators:
+        store_to_local(json.dumps(validators), _validators_path(cache_path))
+
+
+def remove_validators(cache_path: str):
+    try:
+        os.remove(_validators_path(cache_path))
+    except FileNotFoundError:
+        pass
+
+
+def store_stream(chunks: Iterable[bytes], headers, cache_path: str, compression: Optional[str] = None):
+    """
+    Store a streamed response and its validators into the cache
+    """
+    remove_validators(cache_path)
+    store_chunks_to_local(chunks, cache_path, compression)
+    store_validators(cache_path, headers)
+
+
+def mark_validated(cache_path: str):
+    """
+    Record that a cached response is confirmed to be up to date, which restarts its stale age
+    """
+    try:
+        os.utime(cache_path)
+    except OSError as e:
+        logger.warning("Fail to Update Cache File (%s)", cache_path, exc_info=e)
+
+
+def within_max_stale(cache_path: str, max_stale: Optional[float]):
+    """
+    Check whether a cached response was downloaded or validated within `max_stale` seconds
+    :param cache_path: path of the cached response
+    :param max_stale: max seconds, `None` for no limit
+    """
+    try:
+        validated_at = os.path.getmtime(cache_path)
+    except OSError:
+        return False
+    return max_stale is None or time.time() - validated_at <= max_stale
+
+
+def conditional_headers(validators: dict):
+    """
+    Build the headers of a conditional request from the validators of the cached response
+    """
+    headers = {}
+    if 'etag' in validators:
+        headers['If-None-Match'] = validators['etag']
+    if 'last-modified' in validators:
+        headers['If-Modified-Since'] = validators['last-modified']
+    return headers
+
+
+async def run_in_executor(func, *args):
+    """
+    Run a blocking function in the default executor of the running event loop
+    """
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class InflightLoads(object):
+    """Concurrent loads with the same key share one task, which is forgotten once it is done"""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    async def load(self, key, factory):
+        """
+        Await the pending load of `key`, or start one by calling `factory` if there is none.
+        Cancelling one of the waiters doesn't cancel the load shared by the others.
+        :param key: identifies the loaded object
+        :param factory: function that returns a coroutine to load the object
+        :return: the loaded object
+        """
+        import asyncio
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
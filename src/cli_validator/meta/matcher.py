@@ -0,0 +1,311 @@
+import argparse
+import re
+from typing import List, Optional
+
+from cli_validator.meta.parser import CLIParser
+from cli_validator.meta.util import support_ids
+from cli_validator.exceptions import ParserHelpException, ParserFailureException, ChoiceNotExistsException, \
+    ValidateFailureException
+from cli_validator.result import Failure
+
+
+class _Fallback(Exception):
+    """The input uses a syntax the matcher doesn't model, parse it with argparse instead."""
+
+
+class _Action(object):
+    __slots__ = ('dest', 'option_strings', 'name', 'nargs', 'type', 'type_name', 'choices', 'placeholder_choices',
+                 'default')
+
+    STORE_TRUE = 0
+    HELP = -1
+
+    def __init__(self, dest, option_strings, nargs=None, type=None, choices=None, placeholder_choices=None,
+                 default=None):
+        self.dest = dest
+        self.option_strings = option_strings
+        self.name = '/'.join(option_strings)
+        self.nargs = nargs
+        self.type = type
+        self.type_name = getattr(type, '__name__', repr(type))
+        self.choices = choices
+        self.placeholder_choices = placeholder_choices
+        self.default = default
+
+
+def _invalid_choice(code, action: _Action, value):
+    return code('argument {}: invalid choice: {!r} (choose from {})'.format(
+        action.name, value, ', '.join(map(repr, action.choices))))
+
+
+class ParamMatcher(object):
+    """
+    A precompiled matcher of command parameters, which is equivalent to parsing them with `CLIParser`
+    but skips the generic machinery of argparse.\n
+    Inputs using syntax that is not modelled here (positional arguments, `--`, concatenated short options, ...) are
+    parsed by the argparse `parser`, which stays the reference implementation.
+    """
+
+    NEGATIVE_NUMBER = re.compile(r'^-\d+$|^-\d*\.\d+$')
+    PLACEHOLDER = re.compile(CLIParser.PLACEHOLDER_REGEX)
+
+    def __init__(self, meta: dict, placeholder=True):
+        """
+        :param meta: metadata of the command
+        :param placeholder: allow placeholder like <ResourceName>, $ResourceName as field value
+        """
+        self.meta = meta
+        self.placeholder = placeholder
+        self._parser: Optional[CLIParser] = None
+        self._option_actions = {}
+        self._defaults = {}
+        try:
+            self._compile()
+            self.supported = True
+        except _Fallback:
+            self.supported = False
+
+    @property
+    def parser(self) -> CLIParser:
+        """The argparse parser equivalent to this matcher, which is built on first use"""
+        if self._parser is None:
+            parser = CLIParser(add_help=True)
+            parser.load_meta(self.meta, placeholder=self.placeholder)
+            self._parser = parser
+        return self._parser
+
+    def _compile(self):
+        actions = [_Action(argparse.SUPPRESS, ['-h', '--help'], nargs=_Action.HELP)]
+        for param in self.meta['parameters']:
+            if not param['options']:
+                # Positional arguments interleave with options in ways that only argparse models exactly
+                raise _Fallback()
+            if param['name'] == 'yes':
+                if 'type' in param or ('choices' in param and not self.placeholder):
+                    raise _Fallback()
+                actions.append(_Action(param['name'], param['options'], nargs=_Action.STORE_TRUE,
+                                       default=param.get('default')))
+                continue
+            nargs = param.get('nargs', '?')
+            if nargs not in [None, '?', '*', '+'] and not (isinstance(nargs, int) and nargs > 0):
+                raise _Fallback()
+            param_type = CLIParser.TYPE_MAP.get(param['type'], str) if 'type' in param else None
+            choices = param['choices'] if 'choices' in param and not self.placeholder else None
+            actions.append(_Action(param['name'], param['options'], nargs=nargs, type=param_type, choices=choices,
+                                   default=param.get('default')))
+
+        output_choices = list(CLIParser._OUTPUT_FORMAT_DICT)
+        actions.extend([
+            _Action('_log_verbosity_verbose', [CLIParser.VERBOSE_FLAG], nargs=_Action.STORE_TRUE, default=False),
+            _Action('_log_verbosity_debug', [CLIParser.DEBUG_FLAG], nargs=_Action.STORE_TRUE, default=False),
+            _Action('_log_verbosity_only_show_errors', [CLIParser.ONLY_SHOW_ERRORS_FLAG], nargs=_Action.STORE_TRUE,
+                    default=False),
+            _Action(CLIParser.OUTPUT_DEST, ['--output', '-o'], type=str.lower, default='json',
+                    choices=output_choices if not self.placeholder else None,
+                    placeholder_choices=output_choices if self.placeholder else None),
+            _Action('_jmespath_query', ['--query'], type=CLIParser.jmespath_type),
+        ])
+        if 'subscription' not in [p['name'] for p in self.meta['parameters']]:
+            actions.append(_Action('_subscription', ['--subscription']))
+        if support_ids(self.meta) and 'ids' not in [param['name'] for param in self.meta['parameters']]:
+            actions.append(_Action('ids', ['--ids'], nargs='+'))
+
+        for action in actions:
+            for option in action.option_strings:
+                # Conflicting or unusual options make argparse fail or behave specially, keep its behavior
+                if option in self._option_actions or not option.startswith('-') or len(option) < 2 or \
+                        self.NEGATIVE_NUMBER.match(option):
+                    raise _Fallback()
+                self._option_actions[option] = action
+            if action.dest == argparse.SUPPRESS:
+                continue
+            if action.dest in self._defaults:
+                raise _Fallback()
+            default = action.default
+            if isinstance(default, str) and action.nargs != _Action.STORE_TRUE:
+                try:
+                    # argparse converts string defaults of the arguments that are not given
+                    default = self._convert(action, default)
+                except Exception as e:
+                    raise _Fallback() from e
+                if isinstance(default, Failure):
+                    raise _Fallback()
+            self._defaults[action.dest] = default
+
+    def parse_args(self, args: List[str]):
+        """
+        Match the parameters with the command metadata
+        :param args: parameters in command to be validated
+        :return: parsed namespace
+        """
+        result = self.match(args)
+        if isinstance(result, Failure):
+            raise result.exception
+        return result
+
+    def match(self, args: List[str]):
+        """
+        Match the parameters with the command metadata without raising `ValidateFailureException`
+        :param args: parameters in command to be validated
+        :return: parsed namespace, or the `Failure` if the parameters don't match
+        """
+        if self.supported:
+            try:
+                return self._match(args)
+            except _Fallback:
+                pass
+        try:
+            return self.parser.parse_args(args)
+        except ValidateFailureException as e:
+            return Failure.from_exception(e)
+
+    def _classify(self, arg: str):
+        """
+        Tell whether an argument is an option, the same way as `argparse.ArgumentParser._parse_optional`
+        :return: `None` for a value, a tuple of (action, option string, explicit argument) for an option,
+            or the `Failure` if the option is ambiguous
+        """
+        if not arg or arg[0] != '-':
+            return None
+        if arg in self._option_actions:
+            return self._option_actions[arg], arg, None
+        if len(arg) == 1:
+            return None
+        if arg == '--':
+            raise _Fallback()
+        if '=' in arg:
+            option_string, explicit_arg = arg.split('=', 1)
+            if option_string in self._option_actions:
+                return self._option_actions[option_string], option_string, explicit_arg
+        if arg[1] == '-':
+            option_prefix, explicit_arg = arg.split('=', 1) if '=' in arg else (arg, None)
+            matches = [(action, option_string) for option_string, action in self._option_actions.items()
+                       if option_string.startswith(option_prefix)]
+            if len(matches) > 1:
+                if len(set(action for action, _ in matches)) == 1:
+                    # Python versions disagree whether aliases of a single action are ambiguous
+                    raise _Fallback()
+                return Failure.format(ParserFailureException, 'ambiguous option: {} could match {}',
+                                      arg, ', '.join([option_string for _, option_string in matches]))
+            elif len(matches) == 1:
+                action, option_string = matches[0]
+                return action, option_string, explicit_arg
+        elif any(option_string == arg[:2] or option_string.startswith(arg) for option_string in self._option_actions):
+            # Short options concatenated with their values or with other flags
+            raise _Fallback()
+        if self.NEGATIVE_NUMBER.match(arg) or ' ' in arg:
+            return None
+        return None, arg, None
+
+    def _match(self, args: List[str]):
+        option_tuples = []
+        for arg in args:
+            option_tuple = self._classify(arg)
+            if isinstance(option_tuple, Failure):
+                return option_tuple
+            option_tuples.append(option_tuple)
+        namespace = dict(self._defaults)
+        extras = []
+        idx = 0
+        arg_num = len(args)
+        while idx < arg_num:
+            option_tuple = option_tuples[idx]
+            if option_tuple is None or option_tuple[0] is None:
+                extras.append(args[idx])
+                idx += 1
+                continue
+            action, option_string, explicit_arg = option_tuple
+            if explicit_arg is not None:
+                if action.nargs in [_Action.STORE_TRUE, _Action.HELP] or \
+                        (isinstance(action.nargs, int) and action.nargs != 1):
+                    raise _Fallback()
+                values = [explicit_arg]
+                idx += 1
+            else:
+                start = idx + 1
+                end = start
+                while end < arg_num and option_tuples[end] is None:
+                    end += 1
+                count = self._count_values(action, end - start)
+                if isinstance(count, Failure):
+                    return count
+                values = args[start: start + count]
+                idx = start + count
+            if action.nargs == _Action.HELP:
+                return Failure(ParserHelpException)
+            elif action.nargs == _Action.STORE_TRUE:
+                namespace[action.dest] = True
+            else:
+                value = self._get_values(action, values)
+                if isinstance(value, Failure):
+                    return value
+                namespace[action.dest] = value
+        if extras:
+            return Failure.format(ParserFailureException, 'unrecognized arguments: {}', ' '.join(extras))
+        result = argparse.Namespace()
+        result.__dict__.update(namespace)
+        return result
+
+    @staticmethod
+    def _count_values(action: _Action, available: int):
+        nargs = action.nargs
+        if nargs is None:
+            if available < 1:
+                return Failure.format(ParserFailureException, 'argument {}: expected one argument', action.name)
+            return 1
+        elif nargs == '?':
+            return min(available, 1)
+        elif nargs == '*':
+            return available
+        elif nargs == '+':
+            if available < 1:
+                return Failure.format(ParserFailureException, 'argument {}: expected at least one argument',
+                                      action.name)
+            return available
+        elif nargs in [_Action.STORE_TRUE, _Action.HELP]:
+            return 0
+        if available < nargs:
+            return Failure.format(ParserFailureException, 'argument {}: expected {} argument{}',
+                                  action.name, nargs, '' if nargs == 1 else 's')
+        return nargs
+
+    def _get_values(self, action: _Action, values: List[str]):
+        if not values and action.nargs == '?':
+            return None
+        elif len(values) == 1 and action.nargs in [None, '?']:
+            return self._get_value(action, values[0])
+        result = []
+        for value in values:
+            value = self._get_value(action, value)
+            if isinstance(value, Failure):
+                return value
+            result.append(value)
+        return result
+
+    def _get_value(self, action: _Action, value: str):
+        value = self._convert(action, value)
+        if isinstance(value, Failure):
+            return value
+        return self._check_value(action, value)
+
+    def _convert(self, action: _Action, value: str):
+        if action.type is None:
+            return value
+        if self.placeholder and self.PLACEHOLDER.match(value):
+            return value
+        try:
+            result = action.type(value)
+        except argparse.ArgumentTypeError as e:
+            return Failure.format(ParserFailureException, 'argument {}: {}', action.name, e)
+        except (TypeError, ValueError):
+            return Failure.format(ParserFailureException, 'argument {}: invalid {} value: {!r}',
+                                  action.name, action.type_name, value)
+        if action.placeholder_choices and result not in action.placeholder_choices:
+            return Failure(ChoiceNotExistsException, action.option_strings, result, action.placeholder_choices)
+        return result
+
+    @staticmethod
+    def _check_value(action: _Action, value):
+        if action.choices is not None and value not in action.choices:
+            return Failure(ParserFailureException, action, value, build=_invalid_choice)
+        return value
@@ -7,3 +7,30 @@ def support_ids(meta):
     elif len(id_parts) > 0:
         return True
     return False
+
+
+_GROUP_KEYS = ['module_name', 'name']
+_COMMAND_KEYS = ['name', 'confirmation']
+_PARAMETER_KEYS = ['name', 'options', 'required', 'default', 'choices', 'nargs', 'type', 'id_part']
+
+
+def strip_command_meta(meta: dict):
+    """
+    Drop the fields of command metadata that are not used in validation, e.g. help messages
+    :param meta: metadata of a command
+    """
+    result = {key: meta[key] for key in _COMMAND_KEYS if key in meta}
+    result['parameters'] = [{key: param[key] for key in _PARAMETER_KEYS if key in param}
+                            for param in meta['parameters']]
+    return result
+
+
+def strip_module_meta(meta: dict):
+    """
+    Drop the fields of module metadata that are not used in validation, e.g. help messages
+    :param meta: metadata of a module or a command group
+    """
+    result = {key: meta[key] for key in _GROUP_KEYS if key in meta}
+    result['commands'] = {name: strip_command_meta(command) for name, command in meta['commands'].items()}
+    result['sub_groups'] = {name: strip_module_meta(group) for name, group in meta['sub_groups'].items()}
+    return result
@@ -1,10 +1,18 @@
 import re
-from typing import List
+from typing import List, Optional
 
+from cli_validator.cache import LRUCache
+from cli_validator.meta.matcher import ParamMatcher
 from cli_validator.meta.parser import CLIParser
 from cli_validator.meta.util import support_ids
 from cli_validator.exceptions import ValidateHelpException, ParserHelpException, ConfirmationNoYesException, \
     ValidateFailureException, AmbiguousOptionException
+from cli_validator.result import Failure
+
+
+def _missing_arguments(code, template: str, params: List[dict]):
+    return code(template.format(', '.join(['/'.join(param['options']) if param['options']
+                                           else f'<{param["name"].upper()}>' for param in params])))
 
 
 class CommandMetaValidator(object):
@@ -29,11 +37,15 @@ class CommandMetaValidator(object):
         "options": ["--query"]
     }]
 
-    def __init__(self, meta: dict):
+    def __init__(self, meta: dict, parser_cache: Optional[LRUCache] = None, cache_key: Optional[tuple] = None):
         """
         :param meta: cache directory that store the downloaded metadata
+        :param parser_cache: cache of built parameter matchers shared between validators
+        :param cache_key: key that identifies `meta` in `parser_cache`, e.g. source, signature and metadata version
         """
         self.meta = meta
+        self.parser_cache = parser_cache
+        self.cache_key = cache_key
 
     def validate_params(self, parameters: List[str], non_interactive=False, placeholder=True, no_help=True):
         """
@@ -42,38 +54,59 @@ class CommandMetaValidator(object):
         :param non_interactive: check `--yes` in a command with confirmation
         :param placeholder: allow placeholder like <ResourceName>, $ResourceName as field value
         :param no_help: reject commands with `--help`
-        :return: parsed namespace
         """
+        failure = self.check_params(parameters, non_interactive, placeholder, no_help)
+        if failure is not None:
+            raise failure.exception
 
-        def handle_help(e=None):
-            if no_help:
-                raise ValidateHelpException() from e
-            return None
-
-        parser = self.build_parser(self.meta, placeholder)
-        try:
-            namespace = parser.parse_args(parameters)
-        except ParserHelpException as e:
-            return handle_help(e)
+    def check_params(self, parameters: List[str], non_interactive=False, placeholder=True, no_help=True):
+        """
+        Validate a command without raising `ValidateFailureException`
+        :param parameters: parameters in command to be validated
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param placeholder: allow placeholder like <ResourceName>, $ResourceName as field value
+        :param no_help: reject commands with `--help`
+        :return: the `Failure` if the command is invalid, else `None`
+        """
+        namespace = self.get_matcher(placeholder).match(parameters)
+        if isinstance(namespace, Failure):
+            if namespace.code is ParserHelpException:
+                return Failure(ValidateHelpException) if no_help else None
+            return namespace
 
-        missing_args = []
+        missing_params = []
         for param in self.meta['parameters']:
             if 'ids' in namespace and namespace.ids and 'id_part' in param:
                 continue
             if param.get('required', False) and namespace.__getattribute__(param['name']) is None:
-                missing_args.append('/'.join(param['options']) if param['options'] else f'<{param["name"].upper()}>')
-        if len(missing_args) > 0:
-            raise ValidateFailureException(f"the following arguments are required: {', '.join(missing_args)} ")
+                missing_params.append(param)
+        if len(missing_params) > 0:
+            return Failure(ValidateFailureException, 'the following arguments are required: {} ', missing_params,
+                           build=_missing_arguments)
 
         if self.meta.get('confirmation', False) and non_interactive and not ('yes' in namespace and namespace.yes):
-            raise ConfirmationNoYesException()
+            return Failure(ConfirmationNoYesException)
+        return None
 
     def validate_param_keys(self, parameters: List[str], non_interactive=False, no_help=True):
-        def handle_help(e=None):
-            if no_help:
-                raise ValidateHelpException() from e
-            return None
+        """
+        Validate the parameter keys used with a command
+        :param parameters: parameter key list
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        """
+        failure = self.check_param_keys(parameters, non_interactive, no_help)
+        if failure is not None:
+            raise failure.exception
 
+    def check_param_keys(self, parameters: List[str], non_interactive=False, no_help=True):
+        """
+        Validate the parameter keys used with a command without raising `ValidateFailureException`
+        :param parameters: parameter key list
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        :return: the `Failure` if the parameters are invalid, else `None`
+        """
         unresolved = []
         param_metas = self.meta['parameters'] + self.GLOBAL_PARAMETERS_META
         if 'subscription' not in [p['name'] for p in self.meta['parameters']]:
@@ -83,7 +116,9 @@ class CommandMetaValidator(object):
         required = self._get_required_options(param_metas)
         for param in parameters:
             param_meta = self._find_meta(option_map, param)
-            if param_meta:
+            if isinstance(param_meta, Failure):
+                return param_meta
+            elif param_meta:
                 if param_meta.get('required', False) and param_meta['name'] in required:
                     required.pop(param_meta['name'])
             elif param == '--ids' and support_ids(self.meta):
@@ -91,7 +126,7 @@ class CommandMetaValidator(object):
                     if param_name in required:
                         required.pop(param_name)
             elif param in ['--help', '-h']:
-                return handle_help()
+                return Failure(ValidateHelpException) if no_help else None
             elif re.match(r'<[a-zA-Z-_.|]+>', param):
                 if len(positional_metas) == 1 and positional_metas[0]['name'] in required:
                     required.pop(positional_metas[0]['name'])
@@ -100,16 +135,15 @@ class CommandMetaValidator(object):
             else:
                 unresolved.append(param)
         if len(unresolved) > 0:
-            raise ValidateFailureException('unrecognized arguments: {}'.format(', '.join(unresolved)))
+            return Failure.format(ValidateFailureException, 'unrecognized arguments: {}', ', '.join(unresolved))
         if len(required) > 0:
-            raise ValidateFailureException(
-                'the following arguments are required: {}'.format(
-                    ', '.join(['/'.join(param['options']) if param['options'] else f'<{param["name"].upper()}>'
-                               for param in required.values()])))
+            return Failure(ValidateFailureException, 'the following arguments are required: {}',
+                           list(required.values()), build=_missing_arguments)
 
         if self.meta.get('confirmation', False) and non_interactive \
                 and not ('--yes' in parameters or '-y' in parameters):
-            raise ConfirmationNoYesException()
+            return Failure(ConfirmationNoYesException)
+        return None
 
     @staticmethod
     def _build_option_map(params):
@@ -145,13 +179,32 @@ class CommandMetaValidator(object):
                         for option in meta['options']:
                             if option.startswith(user_param):
                                 options.append(option)
-                    raise AmbiguousOptionException(user_param, options)
+                    return Failure(AmbiguousOptionException, user_param, options)
                 elif len(param_meta) == 1:
                     return param_meta[0]
             elif isinstance(param_meta, dict):
                 return param_meta
         return None
 
+    def get_matcher(self, placeholder=True):
+        """
+        Get the parameter matcher of the command, which is built only once for each `cache_key`
+        if `parser_cache` is provided
+        :param placeholder: allow placeholder like <ResourceName>, $ResourceName as field value
+        """
+        if self.parser_cache is None or self.cache_key is None:
+            return ParamMatcher(self.meta, placeholder)
+        return self.parser_cache.get_or_create(self.cache_key + (placeholder,),
+                                               lambda: ParamMatcher(self.meta, placeholder))
+
+    def get_parser(self, placeholder=True):
+        """
+        Get the argparse parser of the command, which is built only once for each `cache_key`
+        if `parser_cache` is provided
+        :param placeholder: allow placeholder like <ResourceName>, $ResourceName as field value
+        """
+        return self.get_matcher(placeholder).parser
+
     @staticmethod
     def build_parser(meta, placeholder=True):
         parser = CLIParser(add_help=True)
@@ -0,0 +1,68 @@
+import gc
+import itertools
+import multiprocessing
+from typing import Iterable, Iterator, Optional
+
+from cli_validator.result import ValidationResult
+
+# The validator shared by the commands validated in a worker process
+_validator = None
+
+
+def _init_worker(validator):
+    global _validator
+    _validator = validator
+
+
+def _validate_chunk(args):
+    commands, kwargs = args
+    return _validator.validate_commands(commands, **kwargs)
+
+
+def _iter_chunks(commands: Iterable[str], chunk_size: int, kwargs: dict):
+    commands = iter(commands)
+    while True:
+        chunk = list(itertools.islice(commands, chunk_size))
+        if not chunk:
+            return
+        yield chunk, kwargs
+
+
+def get_context():
+    """
+    Get the multiprocessing context used by the worker pool. Worker processes are forked where supported,
+    so that they share the command trees and the metadata loaded in the parent process copy-on-write.
+    Otherwise the validator is pickled, which refers to the snapshot file or the cache it is loaded from.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def validate_commands_parallel(validator, commands: Iterable[str], processes: Optional[int] = None,
+                               chunk_size=256, **kwargs) -> Iterator[ValidationResult]:
+    """
+    Validate commands in a pool of worker processes.
+    Where the workers are forked, the objects in the parent process are frozen with `gc.freeze()` while the workers
+    are started, unless the application has frozen objects itself.
+    :param validator: the `CLIValidator` with loaded metadata
+    :param commands: to be validated
+    :param processes: number of worker processes, the number of CPUs if not provided
+    :param chunk_size: number of commands sent to a worker process at a time
+    :param kwargs: options of `CLIValidator.validate_commands`
+    :return: iterator of the validated results in the order of `commands`
+    """
+    ctx = get_context()
+    # Objects loaded so far are moved out of the collected generations while forking, so that collections in the
+    # workers don't touch their pages and copy them. They are thawed in the parent process once the workers are started
+    freeze = ctx.get_start_method() == 'fork' and gc.get_freeze_count() == 0
+    if freeze:
+        gc.freeze()
+    try:
+        pool = ctx.Pool(processes, initializer=_init_worker, initargs=(validator,))
+    finally:
+        if freeze:
+            gc.unfreeze()
+    with pool:
+        for results in pool.imap(_validate_chunk, _iter_chunks(commands, chunk_size, kwargs)):
+            yield from results
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Type, Callable
 
 from cli_validator.exceptions import ValidateFailureException
 
@@ -10,18 +10,86 @@ class CommandSource(str, Enum):
     EXTENSION = "Extension"
 
 
+def _format_message(code: Type[ValidateFailureException], template: str, *args):
+    return code(template.format(*args))
+
+
+class Failure(object):
+    """
+    A failed validation returned instead of raised, whose exception and message are built only when they are read
+    """
+    __slots__ = ('code', 'args', '_build', '_exception')
+
+    def __init__(self, code: Type[ValidateFailureException], *args, build: Optional[Callable] = None):
+        """
+        :param code: type of the exception that describes the failure
+        :param args: arguments to build the exception
+        :param build: callable that builds the exception from `code` and `args`, `code(*args)` if not provided
+        """
+        self.code = code
+        self.args = args
+        self._build = build
+        self._exception: Optional[ValidateFailureException] = None
+
+    @staticmethod
+    def format(code: Type[ValidateFailureException], template: str, *args):
+        """A failure of `code` with message `template.format(*args)`"""
+        return Failure(code, template, *args, build=_format_message)
+
+    @staticmethod
+    def from_exception(e: ValidateFailureException):
+        failure = Failure(type(e))
+        failure._exception = e
+        return failure
+
+    def __reduce__(self):
+        # Only the code and the message are pickled, the arguments may refer to objects that can't be pickled
+        return _restore_failure, (self.code, self.msg)
+
+    @property
+    def exception(self) -> ValidateFailureException:
+        if self._exception is None:
+            self._exception = self._build(self.code, *self.args) if self._build else self.code(*self.args)
+        return self._exception
+
+    @property
+    def msg(self) -> str:
+        return self.exception.msg
+
+
+def _restore_failure(code: Type[ValidateFailureException], msg: str):
+    exception = code.__new__(code)
+    exception.msg = msg
+    return Failure.from_exception(exception)
+
+
 class ValidationResult:
+    # `error_code` is kept out of `__dict__`, so that `vars()` of a result still only contains serializable attributes
+    __slots__ = ('__dict__', 'error_code')
+
     def __init__(self, command: str, is_valid: bool, source: CommandSource, validated_param=True,
-                 error_message: Optional[str] = None):
+                 error_message: Optional[str] = None, error_code: Optional[Type[ValidateFailureException]] = None):
         self.command = command
         self.is_valid = is_valid
         self.cmd_source = source
         self.validated_param = validated_param
         self.error_message = error_message
+        self.error_code = error_code
 
     @staticmethod
     def from_exception(e: ValidateFailureException, command: str, source: CommandSource = CommandSource.UNKNOWN):
-        return ValidationResult(command, False, source, error_message=e.msg, validated_param=False)
+        return ValidationResult(command, False, source, error_message=e.msg, validated_param=False,
+                                error_code=type(e))
+
+    def with_command(self, command: str):
+        """A copy of the result for another input command that has the same tokens"""
+        return ValidationResult(command, self.is_valid, self.cmd_source, self.validated_param, self.error_message,
+                                self.error_code)
+
+    @staticmethod
+    def from_failure(failure: Failure, command: str, source: CommandSource = CommandSource.UNKNOWN):
+        return ValidationResult(command, False, source, validated_param=False, error_message=failure.msg,
+                                error_code=failure.code)
 
     def __str__(self):
         if self.is_valid:
@@ -38,6 +106,76 @@ class ScriptValidationItem:
         self.end_col_pos = end_col_pos
         self.result = result
 
+    def shifted(self, line_delta: int):
+        """A copy of the item whose command is moved by `line_delta` lines in the script"""
+        return ScriptValidationItem(self.lineno + line_delta, self.col_pos, self.end_lineno + line_delta,
+                                    self.end_col_pos, self.result)
+
+
+class ScriptCommandLines(object):
+    """
+    Lines of a command in a script that are joined by line continuations, and the validated results of the commands
+    in them, which are reused if the same lines are found in a new version of the script
+    """
+    __slots__ = ('text', 'first_lineno', 'line_count', 'items', 'parse_failed')
+
+    def __init__(self, text: str, first_lineno: int, line_count: int, items: List[ScriptValidationItem],
+                 parse_failed=False):
+        """
+        :param text: the lines of the command with their line endings
+        :param first_lineno: line number of the first line in the script
+        :param line_count: number of the lines
+        :param items: validated results of the commands in the lines
+        :param parse_failed: whether the lines can't be parsed, whose error message contains the line number
+        """
+        self.text = text
+        self.first_lineno = first_lineno
+        self.line_count = line_count
+        self.items = items
+        self.parse_failed = parse_failed
+
+    def moved_to(self, first_lineno: int):
+        """
+        The same lines moved to another line in the script
+        :return: the moved lines, `None` if the results can't be moved
+        """
+        if first_lineno == self.first_lineno:
+            return self
+        if self.parse_failed:
+            return None
+        line_delta = first_lineno - self.first_lineno
+        return ScriptCommandLines(self.text, first_lineno, self.line_count,
+                                  [item.shifted(line_delta) for item in self.items])
+
+
+class ScriptValidationResult(object):
+    """
+    Validated results of all the commands in a script, which are kept to validate the next version of the script
+    incrementally by `CLIValidator.validate_script_incremental` and `CLIValidator.revalidate_script`
+    """
+
+    def __init__(self, lines: List[str], commands: List[ScriptCommandLines], options: tuple):
+        """
+        :param lines: lines of the script with their line endings
+        :param commands: the lines of each command in the script in order
+        :param options: the validation options and the generations of the loaded metadata that the results depend on
+        """
+        self.lines = lines
+        self.commands = commands
+        self.options = options
+        self._items: Optional[List[ScriptValidationItem]] = None
+
+    @property
+    def script(self) -> str:
+        return ''.join(self.lines)
+
+    @property
+    def items(self) -> List[ScriptValidationItem]:
+        """Validated results of the commands in the script, the same as `CLIValidator.iter_validate_script`"""
+        if self._items is None:
+            self._items = [item for command in self.commands for item in command.items]
+        return self._items
+
 
 class CommandSetResultItem(object):
     def __init__(self, command):
@@ -1,18 +1,42 @@
 import re
-import shlex
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Iterable
 
 from cli_validator.exceptions import ScriptParseException
+from cli_validator.tokenizer import iter_tokens
+
+
+class LineIndex(object):
+    """
+    Offsets of the lines in a script, which maps a position of line and column to the index in the script in O(1)
+    """
+
+    def __init__(self, script: str, first_lineno: int = 0):
+        """
+        :param script: the script, or consecutive lines of a script
+        :param first_lineno: line number of the first line of `script` in the whole script
+        """
+        self.line_starts = [0]
+        self.line_lengths = []
+        for line in script.splitlines(keepends=True):
+            self.line_lengths.append(len(line))
+            self.line_starts.append(self.line_starts[-1] + len(line))
+        self.script = script
+        self.first_lineno = first_lineno
+
+    def index(self, lineno: int, col_pos: int):
+        line = lineno - self.first_lineno
+        if 0 <= line < len(self.line_lengths) and col_pos <= self.line_lengths[line]:
+            return self.line_starts[line] + col_pos
+        raise IndexError((self.script, lineno, col_pos))
 
 
 def idx_from_script(script: str, lineno: int, col_pos: int):
-    lines = script.splitlines(keepends=True)
-    if lineno < len(lines):
-        line_start_index = sum(len(lines[i]) for i in range(lineno))
-        if col_pos <= len(lines[lineno]):
-            return line_start_index + col_pos
-    raise IndexError((script, lineno, col_pos))
+    """
+    Map a position of line and column to the index in the script.
+    Build a `LineIndex` instead to map many positions in the same script.
+    """
+    return LineIndex(script).index(lineno, col_pos)
 
 
 @dataclass
@@ -32,84 +56,175 @@ class _Token:
         return _Token(self.content[:-pos_from_right], self.raw[:-pos_from_right], self.lineno, self.col_pos,
                       self.end_lineno, self.end_col_pos - pos_from_right)
 
-    def merge(self, other, script: str):
-        start = idx_from_script(script, self.lineno, self.col_pos)
-        end = idx_from_script(script, other.end_lineno, other.end_col_pos)
+    def merge(self, other, script: str, line_index: Optional[LineIndex] = None):
+        if line_index is None:
+            line_index = LineIndex(script)
+        start = line_index.index(self.lineno, self.col_pos)
+        end = line_index.index(other.end_lineno, other.end_col_pos)
         return _Token(script[start: end].strip('\'"'), script[start: end], self.lineno,
                       self.col_pos, other.end_lineno, other.end_col_pos)
 
 
 def _split_with_pos(line: str, lineno=0):
-    lexer = shlex.shlex(line, posix=True)
-    lexer.whitespace_split = True
-    while True:
-        col_pos = lexer.instream.tell()
-        token = lexer.get_token()
-        if token == lexer.eof:
-            break
-        next_col_pos = lexer.instream.tell()
-        end_col_pos = len(line[:next_col_pos].rstrip())
+    for token, col_pos, end_col_pos in iter_tokens(line):
+        # Equivalent to `len(line[:end_col_pos].rstrip())` without copying the line for every token
+        while end_col_pos > 0 and line[end_col_pos - 1].isspace():
+            end_col_pos -= 1
         yield _Token(token, line[col_pos:end_col_pos], lineno, col_pos, lineno, end_col_pos)
 
 
 def extract_token_sets_from_script(script: str):
+    for token_set, _ in _iter_token_sets(script.splitlines(keepends=True)):
+        if isinstance(token_set, Exception):
+            raise token_set
+        yield token_set
+
+
+def split_lines(lines: Iterable[str]):
+    """
+    Split the chunks of a script, e.g. the lines read from a file object, into lines with their line endings
+    """
+    for chunk in lines:
+        yield from chunk.splitlines(keepends=True)
+
+
+def iter_command_lines(lines: Iterable[str]):
+    """
+    Group the lines of a script into the lines of each command, which are joined by line continuations
+    :param lines: lines of the script with their line endings
+    :return: iterator of the line number of the first line of each command paired with the lines of the command.
+        The lines of an unfinished command at the end of the script are yielded as well
+    """
+    command_lines = []
+    for lineno, line in enumerate(lines):
+        command_lines.append(line)
+        if not (line.splitlines() or [''])[0].endswith('\\'):
+            yield lineno - len(command_lines) + 1, command_lines
+            command_lines = []
+    if command_lines:
+        yield lineno - len(command_lines) + 1, command_lines
+
+
+def iter_token_sets_of_command(command_lines: List[str], first_lineno: int = 0):
+    """
+    Extract the token sets of a command and the commands in its `$(...)` from the lines of the command
+    :param command_lines: lines of the command with their line endings
+    :param first_lineno: line number of the first line of the command in the script
+    :return: iterator of the token sets, where the error of a command that can't be parsed is yielded in place of
+        the rest of its token sets. Each of them is paired with the `LineIndex` of the lines of the command
+    """
+    line_index = LineIndex(''.join(command_lines), first_lineno)
     command_parts = []
-    parenthesis_left = re.compile(r'^[a-zA-Z0-9-_=$]*\(')
-    parenthesis_right = re.compile(r'(\)[a-zA-Z0-9-_=$;\"\']*)+$')
-
-    for lineno, line in enumerate(script.splitlines()):
-        if line.endswith('\\'):
-            line = line[:-1]
-            command_parts.extend(_split_with_pos(line, lineno))
-            continue
-
-        command_parts.extend(_split_with_pos(line, lineno))
-        command_token_set = []
-        token_set_stack: List[List[_Token]] = []
-        if command_parts:
-            for token in command_parts:
-                if token_set_stack:
-                    if command_token_set:
-                        command_token_set[-1] = command_token_set[-1].merge(token, script)
-                    else:
-                        command_token_set.append(token)
-                    token_set_stack[-1].append(token)
-                    for token_set in token_set_stack[:-1]:
-                        if token_set:
-                            token_set[-1] = token_set[-1].merge(token, script)
-                        else:
-                            token_set.append(token)
+    for lineno, line in enumerate(command_lines, first_lineno):
+        # Strip the line ending
+        line = (line.splitlines() or [''])[0]
+        continued = line.endswith('\\')
+        try:
+            command_parts.extend(_split_with_pos(line[:-1] if continued else line, lineno))
+        except ValueError as e:
+            yield e, line_index
+            return
+    if continued or not command_parts:
+        # The unfinished command at the end of the script is ignored
+        return
+    try:
+        for token_set in _group_tokens(command_parts, line, line_index):
+            yield token_set, line_index
+    except ScriptParseException as e:
+        yield e, line_index
+
+
+def _iter_token_sets(lines: Iterable[str]):
+    """
+    Extract the token sets of commands from the lines of a script, and keep only the lines of the current command
+    :param lines: lines of the script with their line endings
+    :return: iterator of the token sets, where the error of a command that can't be parsed is yielded in place of
+        the rest of its token sets. Each of them is paired with the `LineIndex` of the lines of its command
+    """
+    for first_lineno, command_lines in iter_command_lines(lines):
+        yield from iter_token_sets_of_command(command_lines, first_lineno)
+
+
+_PARENTHESIS_LEFT = re.compile(r'^[a-zA-Z0-9-_=$]*\(')
+_PARENTHESIS_RIGHT = re.compile(r'(\)[a-zA-Z0-9-_=$;\"\']*)+$')
+
+
+def _group_tokens(command_parts: List[_Token], line: str, line_index: LineIndex):
+    """
+    Group the tokens of a command into the token sets of the command and the commands in `$(...)`
+    :param line: the last line of the command
+    :param line_index: the `LineIndex` of the lines of the command
+    """
+    script = line_index.script
+
+    def merged(token_set: List[_Token], merged_to: Optional[_Token]):
+        # A token is merged with the following tokens only once it is complete instead of once for each token
+        if merged_to is not None:
+            token_set[-1] = token_set[-1].merge(merged_to, script, line_index)
+        return token_set
+
+    command_token_set = []
+    # The token that the last token of a token set is merged to
+    command_merged_to: Optional[_Token] = None
+    token_set_stack: List[List[_Token]] = []
+    merged_to_stack: List[Optional[_Token]] = []
+    for token in command_parts:
+        if token_set_stack:
+            if command_token_set:
+                command_merged_to = token
+            else:
+                command_token_set.append(token)
+            merged(token_set_stack[-1], merged_to_stack[-1]).append(token)
+            merged_to_stack[-1] = None
+            for idx in range(len(token_set_stack) - 1):
+                if token_set_stack[idx]:
+                    merged_to_stack[idx] = token
                 else:
-                    command_token_set.append(token)
-                detecting_token = token
-                while detecting_token:
-                    match = re.search(parenthesis_left, detecting_token.raw)
-                    if match:
-                        end = match.span()[-1]
-                        detecting_token = detecting_token.split_from(end)
-                        token_set_stack.append([detecting_token])
-                    else:
-                        detecting_token = None
-                match = re.search(parenthesis_right, token.raw)
-                if match:
-                    right_parenthesis_num = len(match.group().split(')')) - 1
-                    for idx in range(right_parenthesis_num):
-                        pos_to_right = len(match.group().split(')', idx + 1)[-1]) + 1
-                        try:
-                            token_set = token_set_stack.pop()
-                            token_set[-1] = token_set[-1].split_to(pos_to_right)
-                            yield token_set
-                        except IndexError:
-                            raise ScriptParseException('No matching LeftParenthesis Found', token.lineno, line,
-                                                       token.end_col_pos - pos_to_right)
-            if token_set_stack:
-                token = token_set_stack[-1][0]
-                raise ScriptParseException('No matching RightParenthesis Found', token.lineno, line, token.col_pos)
-            yield command_token_set
-        command_parts = []
+                    token_set_stack[idx].append(token)
+        else:
+            merged(command_token_set, command_merged_to).append(token)
+            command_merged_to = None
+        detecting_token = token
+        while detecting_token and '(' in detecting_token.raw:
+            match = _PARENTHESIS_LEFT.search(detecting_token.raw)
+            if match:
+                end = match.span()[-1]
+                detecting_token = detecting_token.split_from(end)
+                token_set_stack.append([detecting_token])
+                merged_to_stack.append(None)
+            else:
+                detecting_token = None
+        match = _PARENTHESIS_RIGHT.search(token.raw) if ')' in token.raw else None
+        if match:
+            right_parenthesis_num = len(match.group().split(')')) - 1
+            for idx in range(right_parenthesis_num):
+                pos_to_right = len(match.group().split(')', idx + 1)[-1]) + 1
+                try:
+                    token_set = merged(token_set_stack.pop(), merged_to_stack.pop())
+                    token_set[-1] = token_set[-1].split_to(pos_to_right)
+                    yield token_set
+                except IndexError:
+                    raise ScriptParseException('No matching LeftParenthesis Found', token.lineno, line,
+                                               token.end_col_pos - pos_to_right)
+    if token_set_stack:
+        token = token_set_stack[-1][0]
+        raise ScriptParseException('No matching RightParenthesis Found', token.lineno, line, token.col_pos)
+    yield merged(command_token_set, command_merged_to)
 
 
 def iter_az_commands(script: str):
     for token_set in extract_token_sets_from_script(script):
         if token_set[0].content == 'az':
             yield token_set
+
+
+def iter_az_commands_from_lines(lines: Iterable[str]):
+    """
+    Extract the `az` commands from the lines of a script, and keep only the lines of the current command
+    :param lines: lines of the script, or chunks of lines like a file object
+    :return: iterator of the token sets of the commands paired with the `LineIndex` of the lines of the command,
+        where the error of a command that can't be parsed is yielded in place of the rest of its token sets
+    """
+    for token_set, line_index in _iter_token_sets(split_lines(lines)):
+        if isinstance(token_set, Exception) or token_set[0].content == 'az':
+            yield token_set, line_index
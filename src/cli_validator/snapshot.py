@@ -0,0 +1,136 @@
+"""
+Snapshot of the command trees and the validator-relevant metadata of an `azure-cli` version.\n
+A snapshot is a single binary file, so that a `CLIValidator` starts with one read and without decoding any JSON:
+`b'CLIVSNAP'`, format version, payload length and SHA-256 of the payload, followed by the payload serialized by
+`marshal`. The payload only holds plain containers, strings and numbers, and `marshal` builds data without running
+any code, unlike `pickle`.
+"""
+import argparse
+import hashlib
+import marshal
+import os
+import struct
+import threading
+from typing import Optional
+
+from cli_validator.exceptions import InvalidSnapshotException
+from cli_validator.meta.util import strip_module_meta
+
+MAGIC = b'CLIVSNAP'
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('>8sHQ32s')
+_SNAPSHOT_KEYS = {'version_dir', 'core_tree', 'core_metas', 'extension_tree'}
+
+
+def _iter_modules(tree: dict):
+    for node in tree.values():
+        if isinstance(node, dict):
+            yield from _iter_modules(node)
+        else:
+            yield node
+
+
+def write_snapshot(path: str, version_dir: str, core_tree: dict, core_metas: dict, extension_tree: dict):
+    """
+    Write a snapshot file
+    :param path: path of the snapshot file
+    :param version_dir: the directory of the `azure-cli` version in the Blob, e.g. `azure-cli-2.51.0`
+    :param core_tree: command tree of core modules
+    :param core_metas: metadata of core modules, keyed by file name
+    :param extension_tree: command tree of extensions
+    """
+    payload = marshal.dumps({
+        'version_dir': version_dir,
+        'core_tree': core_tree,
+        'core_metas': {file_name: strip_module_meta(meta) for file_name, meta in core_metas.items()},
+        'extension_tree': extension_tree,
+    })
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(payload), hashlib.sha256(payload).digest())
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as snapshot_file:
+        snapshot_file.write(header)
+        snapshot_file.write(payload)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str):
+    """
+    Read and verify a snapshot file
+    :param path: path of the snapshot file
+    :return: dict with `version_dir`, `core_tree`, `core_metas` and `extension_tree`
+    """
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    if len(data) < _HEADER.size:
+        raise InvalidSnapshotException(path, 'file is truncated')
+    magic, format_version, length, digest = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise InvalidSnapshotException(path, 'not a snapshot file')
+    if format_version != FORMAT_VERSION:
+        raise InvalidSnapshotException(path, f'format version {format_version} is not supported')
+    payload = memoryview(data)[_HEADER.size:]
+    if len(payload) != length or hashlib.sha256(payload).digest() != digest:
+        raise InvalidSnapshotException(path, 'checksum mismatch')
+    try:
+        snapshot = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError) as e:
+        raise InvalidSnapshotException(path, f'payload is corrupted: {e}') from e
+    if not isinstance(snapshot, dict) or not _SNAPSHOT_KEYS.issubset(snapshot):
+        raise InvalidSnapshotException(path, 'payload is corrupted')
+    return snapshot
+
+
+def save_snapshot(validator, path: str):
+    """
+    Write the command trees and metadata loaded by a validator into a snapshot file
+    :param validator: a `CLIValidator` whose metadata is loaded
+    :param path: path of the snapshot file
+    """
+    core_loader = validator.core_repo_loader
+    if core_loader.lazy:
+        metas = {}
+        for module in set(_iter_modules(core_loader.command_tree.cmd_tree)):
+            meta = core_loader.get_module_meta(module)
+            if meta is not None:
+                metas[f'az_{module}_meta.json'] = meta
+    else:
+        metas = core_loader.metas
+    write_snapshot(path, core_loader.version_dir, core_loader.command_tree.cmd_tree, metas,
+                   validator.extension_loader.command_tree.cmd_tree)
+
+
+def build_snapshot(path: str, version: Optional[str] = None, cache_dir: Optional[str] = './cache'):
+    """
+    Load the metadata of an `azure-cli` version and write it into a snapshot file
+    :param path: path of the snapshot file
+    :param version: the version of `azure-cli`, the latest version if not provided
+    :param cache_dir: cache directory that store the downloaded metadata
+    """
+    from cli_validator.validator import CLIValidator
+    validator = CLIValidator(cache_dir)
+    validator.load_metas(version)
+    save_snapshot(validator, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli_validator.snapshot',
+                                     description='Build or inspect a snapshot of Azure CLI command metadata')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    build_parser = subparsers.add_parser('build', help='build a snapshot of an azure-cli version')
+    build_parser.add_argument('path', help='path of the snapshot file')
+    build_parser.add_argument('--version', help='version of azure-cli, the latest version if not provided')
+    build_parser.add_argument('--cache-dir', default='./cache', help='cache directory of the downloaded metadata')
+    load_parser = subparsers.add_parser('load', help='verify a snapshot and show its content')
+    load_parser.add_argument('path', help='path of the snapshot file')
+    args = parser.parse_args(argv)
+    if args.action == 'build':
+        build_snapshot(args.path, args.version, args.cache_dir)
+    snapshot = read_snapshot(args.path)
+    print(f"{args.path}: {snapshot['version_dir']}, {len(snapshot['core_metas'])} core modules, "
+          f"{len(set(_iter_modules(snapshot['extension_tree'])))} extensions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import re
+from typing import List
+
+# Characters that end a word in the POSIX mode of `shlex`, and the runs of characters that are copied as they are
+_WHITESPACE = ' \t\r\n'
+_PLAIN_WORD = re.compile(r'[^ \t\r\n\'"\\#]+')
+_PLAIN_WORD_NO_COMMENTS = re.compile(r'[^ \t\r\n\'"\\]+')
+_PLAIN_DOUBLE_QUOTED = re.compile(r'[^"\\]+')
+
+# Runs of the characters allowed in each kind of placeholder
+_SUBSTITUTION_CHARS = re.compile(r'[a-zA-Z0-9_ -.\[\]]*')
+_TAG_CHARS = re.compile(r'[a-zA-Z0-9_ ]*')
+_DOUBLE_TAG_CHARS = re.compile(r'[a-zA-Z0-9_ -]*')
+
+
+def iter_tokens(text: str, comments=True):
+    """
+    Split a text into tokens in one pass, the same as `shlex` in the POSIX mode with `whitespace_split`,
+    including quotes, escapes and comments
+    :param text: to be split
+    :param comments: skip comments that start with `#` to the end of the line
+    :return: iterator of the tuples of each token, the position where the lexer starts reading it and the position
+        after the character that ends it. The start may be before some whitespaces like what `shlex` reports
+    :raise ValueError: if a quotation is not closed or there is no escaped character
+    """
+    plain_word = _PLAIN_WORD if comments else _PLAIN_WORD_NO_COMMENTS
+    pos = 0
+    length = len(text)
+    while True:
+        start = pos
+        while pos < length:
+            char = text[pos]
+            if char in _WHITESPACE:
+                pos += 1
+            elif comments and char == '#':
+                pos = _skip_comment(text, pos)
+            else:
+                break
+        if pos >= length:
+            return
+        parts = []
+        while pos < length:
+            char = text[pos]
+            if char in _WHITESPACE:
+                pos += 1
+                break
+            elif char == "'":
+                end = text.find("'", pos + 1)
+                if end < 0:
+                    raise ValueError('No closing quotation')
+                parts.append(text[pos + 1: end])
+                pos = end + 1
+            elif char == '"':
+                pos = _read_double_quoted(text, pos + 1, parts)
+            elif char == '\\':
+                if pos + 1 >= length:
+                    raise ValueError('No escaped character')
+                parts.append(text[pos + 1])
+                pos += 2
+            elif comments and char == '#':
+                # The comment is skipped but still read along with the token
+                pos = _skip_comment(text, pos)
+                break
+            else:
+                match = plain_word.match(text, pos)
+                parts.append(match.group())
+                pos = match.end()
+        yield ''.join(parts), start, pos
+
+
+def _skip_comment(text: str, pos: int):
+    end = text.find('\n', pos)
+    return len(text) if end < 0 else end + 1
+
+
+def _read_double_quoted(text: str, pos: int, parts: List[str]):
+    """
+    Read a string in double quotes from `pos`, where only the quote and the escape character can be escaped
+    :return: the position after the closing quote
+    """
+    length = len(text)
+    while True:
+        match = _PLAIN_DOUBLE_QUOTED.match(text, pos)
+        if match:
+            parts.append(match.group())
+            pos = match.end()
+        if pos >= length:
+            raise ValueError('No closing quotation')
+        if text[pos] == '"':
+            return pos + 1
+        if pos + 1 >= length:
+            raise ValueError('No escaped character')
+        escaped = text[pos + 1]
+        if escaped != '\\' and escaped != '"':
+            parts.append('\\')
+        parts.append(escaped)
+        pos += 2
+
+
+def split(command: str, comments=False) -> List[str]:
+    """
+    Split a command into tokens, the same as `shlex.split`
+    :raise ValueError: if a quotation is not closed or there is no escaped character
+    """
+    return [token for token, _, _ in iter_tokens(command, comments)]
+
+
+def _match_placeholder(command: str, pos: int):
+    """
+    Match a placeholder after the space at `pos`, which is one of `$(...)`, `${...}`, `<...>` and `<<...>>`
+    :return: the position after the placeholder, `-1` if there is no placeholder
+    """
+    start = pos + 1
+    if command.startswith('$(', start):
+        # `)` is one of the allowed characters, so the placeholder ends with the last `)` of the run
+        end = _SUBSTITUTION_CHARS.match(command, start + 2).end()
+        end = command.rfind(')', start + 2, end)
+        return end + 1 if end >= 0 else -1
+    if command.startswith('${', start):
+        end = _SUBSTITUTION_CHARS.match(command, start + 2).end()
+        return end + 1 if command.startswith('}', end) else -1
+    if command.startswith('<', start):
+        end = _TAG_CHARS.match(command, start + 1).end()
+        if command.startswith('>', end):
+            return end + 1
+        if command.startswith('<', start + 1):
+            end = _DOUBLE_TAG_CHARS.match(command, start + 2).end()
+            if command.startswith('>>', end):
+                return end + 2
+    return -1
+
+
+def quote_placeholders(command: str):
+    """
+    Quote the placeholders like `<Resource Name>`, `$(...)` after a space so that each of them is one token
+    """
+    if ' $' not in command and ' <' not in command:
+        return command
+    parts = []
+    copied = 0
+    pos = command.find(' ')
+    while pos >= 0:
+        end = _match_placeholder(command, pos)
+        if end < 0:
+            pos = command.find(' ', pos + 1)
+            continue
+        parts.append(command[copied: pos + 1])
+        parts.append(f'"{command[pos + 1: end]}"')
+        copied = end
+        pos = command.find(' ', end)
+    parts.append(command[copied:])
+    return ''.join(parts)
@@ -1,26 +1,87 @@
+import bisect
 import os
-import re
 import shlex
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple, Dict, Iterable, Iterator
 
+from cli_validator import tokenizer
+from cli_validator.cache import LRUCache
+from cli_validator.cmd_tree import MergedCommandTree
+from cli_validator.command import CommandInfo
 from cli_validator.loader import BaseLoader
 from cli_validator.loader.core_repo import CoreRepoLoader
 from cli_validator.loader.extension import ExtensionLoader
+from cli_validator.loader.utils import run_in_executor
 from cli_validator.meta.validator import CommandMetaValidator
 from cli_validator.exceptions import UnknownCommandException, ValidateFailureException, ValidateHelpException, \
-    CommandMetaNotFoundException, MissingSubCommandException, TooLongSignatureException
+    CommandMetaNotFoundException, TooLongSignatureException
 from cli_validator.result import ValidationResult, CommandSetResult, CommandSetResultItem, CommandSource, \
-    ScriptValidationItem
-from cli_validator.script import iter_az_commands, idx_from_script
+    ScriptValidationItem, Failure, ScriptCommandLines, ScriptValidationResult
+from cli_validator.script import iter_az_commands, iter_az_commands_from_lines, LineIndex, iter_command_lines, \
+    iter_token_sets_of_command
+from cli_validator.snapshot import read_snapshot, save_snapshot
 
 
 class CLIValidator(object):
-    def __init__(self, cache_dir: Optional[str] = './cache'):
+    def __init__(self, cache_dir: Optional[str] = './cache', parser_cache_size: Optional[int] = 512,
+                 extension_version_ttl: Optional[float] = 3600,
+                 extension_meta_cache_bytes: Optional[int] = 64 * 1024 * 1024, lazy_core=False,
+                 max_core_modules: Optional[int] = None, use_meta_store=False, max_stale: Optional[float] = None,
+                 cache_compression: Optional[str] = None, result_cache_size: Optional[int] = 0):
+        """
+        :param cache_dir: cache directory that store the downloaded metadata
+        :param parser_cache_size: max number of built command parsers kept in memory, `0` disables the cache
+        :param extension_version_ttl: seconds to reuse the resolved latest version of an extension,
+            `None` to never expire
+        :param extension_meta_cache_bytes: approximate memory budget of decoded extension metadata kept in memory
+        :param lazy_core: decode the metadata of a core module only when one of its commands is validated
+        :param max_core_modules: max number of decoded core modules kept in memory in lazy mode
+        :param use_meta_store: keep the metadata in memory-mapped files shared by processes, and decode only
+            the metadata of the validated command
+        :param max_stale: seconds to use the cached version lists and extension command tree since they are
+            validated, while refreshing them in background. `None` to always revalidate them before use
+        :param cache_compression: compress the cached metadata with `gzip` or `lzma`, `None` for no compression.
+            Compressed cache files are read regardless of it
+        :param result_cache_size: max number of validation results kept in memory and reused for the same tokens
+            and options until the metadata changes, `0` disables the cache
+        """
+        self._init_args = dict(cache_dir=cache_dir, parser_cache_size=parser_cache_size,
+                               extension_version_ttl=extension_version_ttl,
+                               extension_meta_cache_bytes=extension_meta_cache_bytes, lazy_core=lazy_core,
+                               max_core_modules=max_core_modules, use_meta_store=use_meta_store,
+                               max_stale=max_stale, cache_compression=cache_compression,
+                               result_cache_size=result_cache_size)
         core_repo_path = os.path.join(cache_dir, 'core_repo') if cache_dir else None
         extension_path = os.path.join(cache_dir, 'extension') if cache_dir else None
-        self.core_repo_loader = CoreRepoLoader(core_repo_path)
-        self.extension_loader = ExtensionLoader(extension_path)
+        self.core_repo_loader = CoreRepoLoader(core_repo_path, lazy=lazy_core, max_modules=max_core_modules,
+                                               use_meta_store=use_meta_store, max_stale=max_stale,
+                                               compression=cache_compression)
+        self.extension_loader = ExtensionLoader(extension_path, version_ttl=extension_version_ttl,
+                                                meta_cache_bytes=extension_meta_cache_bytes,
+                                                use_meta_store=use_meta_store, max_stale=max_stale,
+                                                compression=cache_compression)
         self.loaders: List[BaseLoader] = []
+        self.parser_cache = LRUCache(parser_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self._merged_tree: Optional[Tuple[List[BaseLoader], list, MergedCommandTree]] = None
+        # The snapshot file that the metadata is loaded from
+        self.snapshot_path: Optional[str] = None
+
+    def __getstate__(self):
+        # Pickled validators refer to the snapshot file or the cache instead of carrying the loaded metadata,
+        # so that they are cheap to send to worker processes
+        if self.snapshot_path is not None:
+            return {'_init_args': self._init_args, 'snapshot_path': self.snapshot_path}
+        state = self.__dict__.copy()
+        state['_merged_tree'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'loaders' in state:
+            self.__dict__.update(state)
+            return
+        self.__init__(**state['_init_args'])
+        self.load_snapshot(state['snapshot_path'])
 
     def load_metas(self, version: Optional[str] = None, force_refresh=False):
         """
@@ -30,6 +91,9 @@ class CLIValidator(object):
         """
         self.core_repo_loader.load(version, force_refresh=force_refresh)
         self.extension_loader.load()
+        self.parser_cache.clear()
+        self.result_cache.clear()
+        self.snapshot_path = None
         self.loaders.extend([self.core_repo_loader, self.extension_loader])
 
     async def load_metas_async(self, version: Optional[str] = None, force_refresh=False):
@@ -42,8 +106,45 @@ class CLIValidator(object):
         await asyncio.gather(
             self.core_repo_loader.load_async(version, force_refresh=force_refresh),
             self.extension_loader.load_async())
+        self.parser_cache.clear()
+        self.result_cache.clear()
+        self.snapshot_path = None
         self.loaders.extend([self.core_repo_loader, self.extension_loader])
 
+    def load_snapshot(self, path: str):
+        """
+        Load command trees and metadata from a snapshot file built by `save_snapshot`,
+        which doesn't access network or decode any JSON
+        :param path: path of the snapshot file
+        """
+        snapshot = read_snapshot(path)
+        self.core_repo_loader.load_snapshot(snapshot['version_dir'], snapshot['core_tree'], snapshot['core_metas'])
+        self.extension_loader.load_snapshot(snapshot['extension_tree'])
+        self.parser_cache.clear()
+        self.result_cache.clear()
+        self.loaders = [self.core_repo_loader, self.extension_loader]
+        self.snapshot_path = path
+
+    def save_snapshot(self, path: str):
+        """
+        Save the loaded command trees and metadata into a snapshot file
+        :param path: path of the snapshot file
+        """
+        save_snapshot(self, path)
+
+    def get_command_tree(self):
+        """
+        Get the command tree merged from all the loaders, which is rebuilt when any loader loads a new tree.
+        :return: tuple of the loaders ordered by priority and the merged tree
+        """
+        loaders = list(dict.fromkeys(self.loaders))
+        trees = [loader.command_tree for loader in loaders]
+        merged = self._merged_tree
+        if merged is None or len(merged[1]) != len(trees) or any(a is not b for a, b in zip(merged[1], trees)):
+            merged = (loaders, trees, MergedCommandTree(trees))
+            self._merged_tree = merged
+        return merged[0], merged[2]
+
     def validate_script(self, script: str, non_interactive=False, no_help=True) -> List[ScriptValidationItem]:
         """
         Validate all CLI commands in a script.
@@ -54,17 +155,12 @@ class CLIValidator(object):
         :return: a list of validated result
         """
         result = []
+        line_index = LineIndex(script)
         try:
             for token_set in iter_az_commands(script):
                 if not token_set:
                     continue
-                tokens = [token.content for token in token_set]
-                script_start = idx_from_script(script, token_set[0].lineno, token_set[0].col_pos)
-                script_end = idx_from_script(script, token_set[-1].end_lineno, token_set[-1].end_col_pos)
-                raw_command = script[script_start: script_end]
-                validation_result = self._validate_command(raw_command, tokens, non_interactive, True, no_help)
-                result.append(ScriptValidationItem(token_set[0].lineno, token_set[0].col_pos, token_set[-1].end_lineno,
-                                                   token_set[-1].end_col_pos, validation_result))
+                result.append(self._validate_token_set(token_set, line_index, non_interactive, no_help))
             return result
         except ValidateFailureException as e:
             lines = script.splitlines()
@@ -73,6 +169,135 @@ class CLIValidator(object):
             result.append(ScriptValidationItem(0, 0, end_lineno, end_col_pos, ValidationResult.from_exception(e, script)))
             return result
 
+    def iter_validate_script(self, lines: Iterable[str], non_interactive=False,
+                             no_help=True) -> Iterator[ScriptValidationItem]:
+        """
+        Validate all CLI commands in a script read line by line, and yield the result of each command once it is
+        parsed. Only the lines of the current command are kept in memory.
+        A command that can't be parsed is reported as an invalid item that covers its lines,
+        and the validation continues with the next command.
+        :param lines: lines of the script, e.g. a file object
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        :return: iterator of the validated results
+        """
+        for token_set, line_index in iter_az_commands_from_lines(lines):
+            if isinstance(token_set, Exception):
+                yield _script_parse_failure(token_set, line_index)
+            elif token_set:
+                yield self._validate_token_set(token_set, line_index, non_interactive, no_help)
+
+    def validate_script_incremental(self, script: str, previous: Optional[ScriptValidationResult] = None,
+                                    non_interactive=False, no_help=True) -> ScriptValidationResult:
+        """
+        Validate all CLI commands in a script, and reuse the results of the commands that are not changed since the
+        previous version of the script, e.g. to validate a script in an editor after every change.
+        The lines of each command are matched with the previous version by their content. Only the new or changed
+        commands are validated, and the positions of the moved commands are adjusted.
+        :param script: to be validated
+        :param previous: the result of the previous version of the script, which is not reused if it is validated
+            with other options or against other metadata
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        :return: the result, whose `items` are the same as the results of `iter_validate_script`
+        """
+        options = self._script_options(non_interactive, no_help)
+        previous_commands = previous.commands if previous is not None and previous.options == options else []
+        lines = script.splitlines(keepends=True)
+        commands = list(self._validate_lines(lines, 0, _index_commands(previous_commands), non_interactive, no_help))
+        return ScriptValidationResult(lines, commands, options)
+
+    def revalidate_script(self, previous: ScriptValidationResult, lineno: int, col_pos: int, end_lineno: int,
+                          end_col_pos: int, text: str) -> ScriptValidationResult:
+        """
+        Validate a script after an edit that replaces a range of the previous version with a text.
+        Only the commands in the edited lines are parsed and validated, and the following commands are reused,
+        so the time depends on the size of the edit instead of the size of the script.
+        :param previous: the result of the previous version of the script
+        :param lineno: line number of the start of the replaced range
+        :param col_pos: column of the start of the replaced range
+        :param end_lineno: line number of the end of the replaced range
+        :param end_col_pos: column of the end of the replaced range, which is not replaced
+        :param text: to replace the range with
+        :return: the result of the edited script, which is validated with the same options as `previous`
+        """
+        non_interactive, no_help = previous.options[:2]
+        options = self._script_options(non_interactive, no_help)
+        start, end, edited_lines = _edit_lines(previous.lines, lineno, col_pos, end_lineno, end_col_pos, text)
+        lines = previous.lines[:start] + edited_lines + previous.lines[end:]
+        commands = previous.commands if previous.options == options else []
+        # The commands before the command of the first edited line are not changed
+        starts = [command.first_lineno for command in commands]
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        begin = commands[first].first_lineno if commands else 0
+        line_delta = len(edited_lines) - (end - start)
+        last = bisect.bisect_left(starts, end)
+        validated = commands[:first]
+        for command in self._validate_lines(lines, begin, _index_commands(commands[first: last + 1]),
+                                            non_interactive, no_help):
+            validated.append(command)
+            next_lineno = command.first_lineno + command.line_count
+            if next_lineno < start + len(edited_lines):
+                continue
+            # The rest of the commands are not changed once a command ends where a command of the previous version ends
+            idx = bisect.bisect_left(starts, next_lineno - line_delta)
+            if idx < len(commands) and starts[idx] == next_lineno - line_delta:
+                validated.extend(self._move_command_lines(unchanged, lines, unchanged.first_lineno + line_delta,
+                                                          non_interactive, no_help) for unchanged in commands[idx:])
+                break
+        return ScriptValidationResult(lines, validated, options)
+
+    def _script_options(self, non_interactive: bool, no_help: bool):
+        """The options that the results of a script depend on, including the generations of the loaded metadata"""
+        return non_interactive, no_help, tuple(loader.generation for loader in self.loaders)
+
+    def _validate_lines(self, lines: List[str], begin: int, previous: Dict[str, List[ScriptCommandLines]],
+                        non_interactive=False, no_help=True) -> Iterator[ScriptCommandLines]:
+        """
+        Validate the commands from the line `begin` of a script
+        :param previous: the lines of the commands in the previous version of the script by their content
+        """
+        for first_lineno, command_lines in iter_command_lines(lines[begin:]):
+            first_lineno += begin
+            text = ''.join(command_lines)
+            candidates = previous.get(text)
+            if candidates:
+                closest = min(candidates, key=lambda candidate: abs(candidate.first_lineno - first_lineno))
+                moved = closest.moved_to(first_lineno)
+                if moved is not None:
+                    yield moved
+                    continue
+            yield self._validate_command_lines(command_lines, first_lineno, non_interactive, no_help)
+
+    def _validate_command_lines(self, command_lines: List[str], first_lineno: int, non_interactive=False,
+                                no_help=True):
+        items = []
+        parse_failed = False
+        for token_set, line_index in iter_token_sets_of_command(command_lines, first_lineno):
+            if isinstance(token_set, Exception):
+                items.append(_script_parse_failure(token_set, line_index))
+                parse_failed = True
+            elif token_set and token_set[0].content == 'az':
+                items.append(self._validate_token_set(token_set, line_index, non_interactive, no_help))
+        return ScriptCommandLines(''.join(command_lines), first_lineno, len(command_lines), items, parse_failed)
+
+    def _move_command_lines(self, command: ScriptCommandLines, lines: List[str], first_lineno: int,
+                            non_interactive=False, no_help=True):
+        moved = command.moved_to(first_lineno)
+        if moved is None:
+            moved = self._validate_command_lines(lines[first_lineno: first_lineno + command.line_count],
+                                                 first_lineno, non_interactive, no_help)
+        return moved
+
+    def _validate_token_set(self, token_set: list, line_index: LineIndex, non_interactive=False, no_help=True):
+        tokens = [token.content for token in token_set]
+        script_start = line_index.index(token_set[0].lineno, token_set[0].col_pos)
+        script_end = line_index.index(token_set[-1].end_lineno, token_set[-1].end_col_pos)
+        raw_command = line_index.script[script_start: script_end]
+        validation_result = self._validate_command(raw_command, tokens, non_interactive, True, no_help)
+        return ScriptValidationItem(token_set[0].lineno, token_set[0].col_pos, token_set[-1].end_lineno,
+                                    token_set[-1].end_col_pos, validation_result)
+
     def validate_command(self, command: str, non_interactive=False, placeholder=True, no_help=True, comments=False):
         """
         Validate an input command
@@ -83,34 +308,230 @@ class CLIValidator(object):
         :param comments: parse comments in the given command
         :return: the validated result
         """
+        split = split_command(command, placeholder, comments)
+        if isinstance(split, ValidationResult):
+            return split
+        key = self._result_key('command', tuple(split[1]), non_interactive, placeholder, no_help)
+        result = self._get_cached_result(key, split[0])
+        if result is None:
+            result = self._validate_command(split[0], split[1], non_interactive, placeholder, no_help)
+            self._cache_result(key, result)
+        return result
+
+    async def validate_command_async(self, command: str, non_interactive=False, placeholder=True, no_help=True,
+                                     comments=False):
+        """
+        Validate an input command without blocking the event loop. Metadata is fetched asynchronously and shared by
+        the concurrent validations that need it, and the parameters are checked in the default executor.
+        :param command: to be validated
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param placeholder: allow placeholder like `<ResourceName>`, `$ResourceName` as field value
+        :param no_help: reject commands with `--help`
+        :param comments: parse comments in the given command
+        :return: the validated result
+        """
+        split = split_command(command, placeholder, comments)
+        if isinstance(split, ValidationResult):
+            return split
+        key = self._result_key('command', tuple(split[1]), non_interactive, placeholder, no_help)
+        result = self._get_cached_result(key, split[0])
+        if result is None:
+            result = await self._validate_command_async(split[0], split[1], non_interactive, placeholder, no_help)
+            self._cache_result(key, result)
+        return result
+
+    def validate_commands(self, commands: Iterable[str], non_interactive=False, placeholder=True, no_help=True,
+                          comments=False) -> List[ValidationResult]:
+        """
+        Validate a batch of input commands.
+        Commands with the same tokens are validated only once, and the commands with the same signature share
+        the lookup of command tree, the loading of metadata and the parser.
+        :param commands: to be validated
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param placeholder: allow placeholder like `<ResourceName>`, `$ResourceName` as field value
+        :param no_help: reject commands with `--help`
+        :param comments: parse comments in the given commands
+        :return: the validated results in the order of `commands`
+        """
+        # Each entry is the normalized command with either its tokens or its result
+        entries = []
+        results: Dict[tuple, Optional[ValidationResult]] = {}
+        groups: Dict[tuple, Tuple[BaseLoader, CommandInfo, list]] = {}
+        for command in commands:
+            split = split_command(command, placeholder, comments)
+            if isinstance(split, ValidationResult):
+                entries.append((split.command, split))
+                continue
+            command, tokens = split
+            key = tuple(tokens)
+            entries.append((command, key))
+            if key in results:
+                continue
+            try:
+                matched = self._match_command(command, tokens, no_help)
+            except ValidateFailureException as e:
+                matched = ValidationResult.from_exception(e, command)
+            if matched is None or isinstance(matched, ValidationResult):
+                results[key] = matched
+                continue
+            results[key] = None
+            loader, cmd_info = matched
+            group = groups.setdefault((id(loader), tuple(cmd_info.signature)), (loader, cmd_info, []))
+            group[2].append((key, command, cmd_info.parameters))
+
+        for loader, cmd_info, members in groups.values():
+            source = loader.command_tree.source
+            try:
+                validator = self._get_meta_validator(loader, cmd_info)
+            except CommandMetaNotFoundException:
+                for key, command, _ in members:
+                    results[key] = ValidationResult(command, True, source, validated_param=False)
+                continue
+            except ValidateFailureException as e:
+                for key, command, _ in members:
+                    results[key] = ValidationResult.from_exception(e, command, source)
+                continue
+            for key, command, parameters in members:
+                results[key] = self._check_params(validator, command, source, parameters, non_interactive,
+                                                  placeholder, no_help)
+
+        validated = []
+        for command, key in entries:
+            if isinstance(key, ValidationResult):
+                validated.append(key)
+            elif results[key] is None:
+                # The message of an unknown command contains the input command itself
+                validated.append(ValidationResult.from_failure(Failure(UnknownCommandException, command), command))
+            else:
+                validated.append(results[key].with_command(command))
+        return validated
+
+    def validate_commands_parallel(self, commands: Iterable[str], processes: Optional[int] = None, chunk_size=256,
+                                   non_interactive=False, placeholder=True, no_help=True,
+                                   comments=False) -> Iterator[ValidationResult]:
+        """
+        Validate a batch of input commands in a pool of worker processes, which share the loaded metadata.
+        Load the metadata before calling this method so that it is loaded only once.
+        :param commands: to be validated
+        :param processes: number of worker processes, the number of CPUs if not provided
+        :param chunk_size: number of commands sent to a worker process at a time
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param placeholder: allow placeholder like `<ResourceName>`, `$ResourceName` as field value
+        :param no_help: reject commands with `--help`
+        :param comments: parse comments in the given commands
+        :return: iterator of the validated results in the order of `commands`
+        """
+        from cli_validator.parallel import validate_commands_parallel
+        return validate_commands_parallel(self, commands, processes, chunk_size, non_interactive=non_interactive,
+                                          placeholder=placeholder, no_help=no_help, comments=comments)
+
+    def _result_key(self, *key):
+        """
+        Key of a validation result in `result_cache`, which contains the generations of the loaded metadata
+        so that the results validated against older metadata are not reused
+        :return: the key, `None` if the results are not cached
+        """
+        if self.result_cache.maxsize == 0:
+            return None
+        return key + (tuple(loader.generation for loader in self.loaders),)
+
+    def _get_cached_result(self, key: Optional[tuple], command: str):
+        if key is None:
+            return None
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+        result, expires_at = cached
+        if expires_at is not None and time.monotonic() >= expires_at:
+            return None
+        if result.error_code is UnknownCommandException and result.command != command:
+            # The message of an unknown command contains the input command itself
+            return ValidationResult.from_failure(Failure(UnknownCommandException, command), command)
+        return result.with_command(command)
+
+    def _cache_result(self, key: Optional[tuple], result: ValidationResult):
+        if key is None or result.is_valid and not result.validated_param:
+            # The parameters may be unchecked because the metadata can't be loaded for now, e.g. no network
+            return
+        expires_at = None
+        if result.cmd_source == CommandSource.EXTENSION and self.extension_loader.version_ttl is not None:
+            # The result of an extension command expires with the resolved version of the extension,
+            # so that the version is resolved again and a new version invalidates the result
+            expires_at = time.monotonic() + self.extension_loader.version_ttl
+        self.result_cache.put(key, (result, expires_at))
+
+    def _match_command(self, command: str, tokens: List[str], no_help=True):
+        """
+        Find the loader and the signature of a command
+        :return: tuple of the loader and the parsed `CommandInfo`, the `ValidationResult` if the command is not
+            a regular command, or `None` if the command is unknown
+        """
+        loaders, command_tree = self.get_command_tree()
+        matched = command_tree.match_command(tokens)
+        if matched is None:
+            return None
+        elif isinstance(matched, Failure):
+            return ValidationResult.from_failure(matched, command)
+        loader = loaders[matched[0]]
+        cmd_info = matched[1]
+        if cmd_info.module is None:
+            return handle_help(no_help, command, loader.command_tree.source)
+        return loader, cmd_info
+
+    def _get_meta_validator(self, loader: BaseLoader, cmd_info: CommandInfo):
+        meta = loader.load_command_meta(cmd_info.signature, cmd_info.module)
+        return self._build_meta_validator(loader, cmd_info, meta)
+
+    def _build_meta_validator(self, loader: BaseLoader, cmd_info: CommandInfo, meta: Optional[dict]):
+        if meta is None:
+            raise CommandMetaNotFoundException(cmd_info.signature)
+        cache_key = (loader.command_tree.source, tuple(cmd_info.signature), loader.get_meta_version(cmd_info.module))
+        return CommandMetaValidator(meta, self.parser_cache, cache_key)
+
+    @staticmethod
+    def _check_params(validator: CommandMetaValidator, command: str, source: CommandSource, parameters: List[str],
+                      non_interactive=False, placeholder=True, no_help=True):
         try:
-            if placeholder:
-                command = re.sub(r' ((\$\([a-zA-Z0-9_ -.\[\]]*\))|(\${[a-zA-Z0-9_ -.\[\]]*})|'
-                                 r'(<[a-zA-Z0-9_ ]*>)|(<<[a-zA-Z0-9_ -]*>>))', r' "\1"', command)
-            tokens = shlex.split(command, comments)
-        except ValueError as e:
-            return ValidationResult(command, False, CommandSource.UNKNOWN, False,
-                                    f'Fail to Parse command: {e}')
-        return self._validate_command(command, tokens, non_interactive, placeholder, no_help)
+            failure = validator.check_params(parameters, non_interactive, placeholder, no_help)
+        except ValidateFailureException as e:
+            return ValidationResult.from_exception(e, command, source)
+        if failure is not None:
+            return ValidationResult.from_failure(failure, command, source)
+        return ValidationResult(command, True, source)
 
     def _validate_command(self, command: str, tokens: List[str], non_interactive=False, placeholder=True, no_help=True):
         source = CommandSource.UNKNOWN
         try:
-            for loader in self.loaders:
-                try:
-                    cmd_info = loader.command_tree.parse_command(tokens)
-                    source = loader.command_tree.source
-                    if cmd_info.module is None:
-                        return handle_help(no_help, command, source)
-                    meta = loader.load_command_meta(cmd_info.signature, cmd_info.module)
-                    if meta is None:
-                        raise CommandMetaNotFoundException(cmd_info.signature)
-                    validator = CommandMetaValidator(meta)
-                    validator.validate_params(cmd_info.parameters, non_interactive, placeholder, no_help)
-                    return ValidationResult(command, True, source)
-                except UnknownCommandException:
-                    continue
-            raise UnknownCommandException(command)
+            matched = self._match_command(command, tokens, no_help)
+            if matched is None:
+                return ValidationResult.from_failure(Failure(UnknownCommandException, command), command)
+            elif isinstance(matched, ValidationResult):
+                return matched
+            loader, cmd_info = matched
+            source = loader.command_tree.source
+            validator = self._get_meta_validator(loader, cmd_info)
+            return self._check_params(validator, command, source, cmd_info.parameters, non_interactive, placeholder,
+                                      no_help)
+        except CommandMetaNotFoundException:
+            return ValidationResult(command, True, source, validated_param=False)
+        except ValidateFailureException as e:
+            return ValidationResult.from_exception(e, command, source)
+
+    async def _validate_command_async(self, command: str, tokens: List[str], non_interactive=False, placeholder=True,
+                                      no_help=True):
+        source = CommandSource.UNKNOWN
+        try:
+            matched = self._match_command(command, tokens, no_help)
+            if matched is None:
+                return ValidationResult.from_failure(Failure(UnknownCommandException, command), command)
+            elif isinstance(matched, ValidationResult):
+                return matched
+            loader, cmd_info = matched
+            source = loader.command_tree.source
+            meta = await loader.load_command_meta_async(cmd_info.signature, cmd_info.module)
+            validator = self._build_meta_validator(loader, cmd_info, meta)
+            return await run_in_executor(self._check_params, validator, command, source, cmd_info.parameters,
+                                         non_interactive, placeholder, no_help)
         except CommandMetaNotFoundException:
             return ValidationResult(command, True, source, validated_param=False)
         except ValidateFailureException as e:
@@ -125,45 +546,104 @@ class CLIValidator(object):
         :param no_help: reject commands with `--help`
         :return: the failure info if command is invalid, else `None`
         """
+        command = '{} {}'.format(signature, ' '.join(parameters))
+        key = self._result_key('signature', signature, tuple(parameters), non_interactive, no_help)
+        result = self._get_cached_result(key, command)
+        if result is None:
+            result = self._validate_sig_params(signature, parameters, command, non_interactive, no_help)
+            self._cache_result(key, result)
+        return result
+
+    def _validate_sig_params(self, signature: str, parameters: List[str], command: str, non_interactive=False,
+                             no_help=True):
         source = CommandSource.UNKNOWN
+        try:
+            matched = self._match_signature(signature, parameters, command, no_help)
+            if isinstance(matched, ValidationResult):
+                return matched
+            loader, cmd_info = matched
+            source = loader.command_tree.source
+            meta = loader.load_command_meta(cmd_info.signature, cmd_info.module)
+            return self._check_param_keys(meta, cmd_info, command, source, parameters, non_interactive, no_help)
+        except CommandMetaNotFoundException:
+            return ValidationResult(command, True, source, validated_param=False)
+        except ValidateFailureException as e:
+            return ValidationResult.from_exception(e, command, source)
+
+    async def validate_sig_params_async(self, signature: str, parameters: List[str], non_interactive=False,
+                                        no_help=True):
+        """
+        Validate a command signature and parameters used with it without blocking the event loop
+        :param signature: signature to be validated
+        :param parameters: parameter key list
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        :return: the failure info if command is invalid, else `None`
+        """
         command = '{} {}'.format(signature, ' '.join(parameters))
+        key = self._result_key('signature', signature, tuple(parameters), non_interactive, no_help)
+        result = self._get_cached_result(key, command)
+        if result is None:
+            result = await self._validate_sig_params_async(signature, parameters, command, non_interactive, no_help)
+            self._cache_result(key, result)
+        return result
+
+    async def _validate_sig_params_async(self, signature: str, parameters: List[str], command: str,
+                                         non_interactive=False, no_help=True):
+        source = CommandSource.UNKNOWN
         try:
-            try:
-                tokens = shlex.split(signature)
-            except ValueError as e:
-                raise ValidateFailureException(str(e)) from e
-            for loader in self.loaders:
-                try:
-                    try:
-                        cmd_info = loader.command_tree.parse_command(tokens)
-                        if cmd_info.module is None:
-                            return handle_help(no_help, command, source, e=ValidateHelpException())
-                    except MissingSubCommandException as e:
-                        if len(parameters) == 1 and parameters[0] in ['-h', '--help']:
-                            return handle_help(no_help, command, source, e=ValidateHelpException())
-                        else:
-                            raise e
-                    if cmd_info.parameters:
-                        raise TooLongSignatureException(signature, 'az ' + shlex.join(cmd_info.signature))
-                    source = loader.command_tree.source
-                    if cmd_info.module is None and no_help:
-                        raise ValidateHelpException()
-                    meta = loader.load_command_meta(cmd_info.signature, cmd_info.module)
-                    if meta is None:
-                        raise CommandMetaNotFoundException(cmd_info.signature)
-                    validator = CommandMetaValidator(meta)
-                    validator.validate_param_keys(parameters, non_interactive, no_help)
-                    return ValidationResult(command, True, source)
-                except TooLongSignatureException as e:
-                    raise e from e
-                except UnknownCommandException:
-                    continue
-            raise UnknownCommandException(signature)
+            matched = self._match_signature(signature, parameters, command, no_help)
+            if isinstance(matched, ValidationResult):
+                return matched
+            loader, cmd_info = matched
+            source = loader.command_tree.source
+            meta = await loader.load_command_meta_async(cmd_info.signature, cmd_info.module)
+            return await run_in_executor(self._check_param_keys, meta, cmd_info, command, source, parameters,
+                                         non_interactive, no_help)
         except CommandMetaNotFoundException:
             return ValidationResult(command, True, source, validated_param=False)
         except ValidateFailureException as e:
             return ValidationResult.from_exception(e, command, source)
 
+    def _match_signature(self, signature: str, parameters: List[str], command: str, no_help=True):
+        """
+        Find the loader of a command signature
+        :return: tuple of the loader and the parsed `CommandInfo`, or the `ValidationResult` if the signature is not
+            the signature of a command
+        """
+        try:
+            tokens = tokenizer.split(signature)
+        except ValueError as e:
+            raise ValidateFailureException(str(e)) from e
+        loaders, command_tree = self.get_command_tree()
+        # A command group with `--help` is a help command
+        matched = command_tree.match_command(
+            tokens, missing_as_help=len(parameters) == 1 and parameters[0] in ['-h', '--help'])
+        if matched is None:
+            return ValidationResult.from_failure(Failure(UnknownCommandException, signature), command)
+        elif isinstance(matched, Failure):
+            return ValidationResult.from_failure(matched, command)
+        loader = loaders[matched[0]]
+        cmd_info = matched[1]
+        if cmd_info.module is None:
+            return handle_help(no_help, command, CommandSource.UNKNOWN)
+        if cmd_info.parameters:
+            return ValidationResult.from_failure(
+                Failure(TooLongSignatureException, signature, cmd_info.signature, build=_too_long_signature),
+                command)
+        return loader, cmd_info
+
+    @staticmethod
+    def _check_param_keys(meta: Optional[dict], cmd_info: CommandInfo, command: str, source: CommandSource,
+                          parameters: List[str], non_interactive=False, no_help=True):
+        if meta is None:
+            raise CommandMetaNotFoundException(cmd_info.signature)
+        validator = CommandMetaValidator(meta)
+        failure = validator.check_param_keys(parameters, non_interactive, no_help)
+        if failure is not None:
+            return ValidationResult.from_failure(failure, command, source)
+        return ValidationResult(command, True, source)
+
     def validate_command_set(self, command_set, non_interactive=False, no_help=True):
         """
         Validate a Command Set with command and example
@@ -180,12 +660,110 @@ class CLIValidator(object):
                 item.result = self.validate_sig_params(
                     command["command"], command.get("arguments", []), non_interactive, no_help)
             if "example" in command:
-                item.example_result = self.validate_command(command["example"], non_interactive, no_help)
+                item.example_result = self.validate_command(command["example"], non_interactive, no_help=no_help)
+            result.append(item)
+        return result
+
+    async def validate_command_set_async(self, command_set, non_interactive=False, no_help=True):
+        """
+        Validate a Command Set with command and example without blocking the event loop.
+        The commands in the set are validated concurrently.
+        :param command_set: a CommandSet is a list of command item. Each command item contains a `command` field,
+            a `argument` field and an `example` field
+        :param non_interactive: check `--yes` in a command with confirmation
+        :param no_help: reject commands with `--help`
+        :return: a commandSetResult that contains the failure details of each command
+        """
+        import asyncio
+
+        async def validate_item(command):
+            item = CommandSetResultItem(command)
+            if "command" in command:
+                item.result = await self.validate_sig_params_async(
+                    command["command"], command.get("arguments", []), non_interactive, no_help)
+            if "example" in command:
+                item.example_result = await self.validate_command_async(command["example"], non_interactive,
+                                                                         no_help=no_help)
+            return item
+
+        result = CommandSetResult()
+        for item in await asyncio.gather(*[validate_item(command) for command in command_set]):
             result.append(item)
         return result
 
 
-def handle_help(no_help, command, source, e=None):
+def split_command(command: str, placeholder=True, comments=False):
+    """
+    Split an input command into tokens
+    :param command: to be split
+    :param placeholder: quote placeholders like `<Resource Name>`, `$(...)` so that each of them is one token
+    :param comments: parse comments in the given command
+    :return: tuple of the normalized command and the tokens, or the `ValidationResult` if the command can't be parsed
+    """
+    if placeholder:
+        command = tokenizer.quote_placeholders(command)
+    try:
+        tokens = tokenizer.split(command, comments)
+    except ValueError as e:
+        return ValidationResult(command, False, CommandSource.UNKNOWN, False,
+                                f'Fail to Parse command: {e}')
+    return command, tokens
+
+
+def _script_parse_failure(e: Exception, line_index: LineIndex):
+    """
+    The result of a command in a script that can't be parsed, which covers all the lines of the command
+    """
+    lines = line_index.script.splitlines()
+    command = '\n'.join(lines)
+    if isinstance(e, ValidateFailureException):
+        result = ValidationResult.from_exception(e, command)
+    else:
+        result = ValidationResult(command, False, CommandSource.UNKNOWN, False, f'Fail to Parse command: {e}')
+    return ScriptValidationItem(line_index.first_lineno, 0, line_index.first_lineno + len(lines) - 1,
+                                len(lines[-1]), result)
+
+
+def _index_commands(commands: Iterable[ScriptCommandLines]):
+    """
+    Index the lines of commands by their content
+    """
+    index: Dict[str, List[ScriptCommandLines]] = {}
+    for command in commands:
+        index.setdefault(command.text, []).append(command)
+    return index
+
+
+def _edit_lines(lines: List[str], lineno: int, col_pos: int, end_lineno: int, end_col_pos: int, text: str):
+    """
+    Replace a range of the lines of a script with a text
+    :return: the start and the end of the replaced lines, and the lines in place of them, which are split the same as
+        splitting the whole edited script
+    """
+    if not 0 <= lineno <= end_lineno <= len(lines) or (lineno == end_lineno and col_pos > end_col_pos):
+        raise IndexError((lineno, col_pos, end_lineno, end_col_pos))
+    start, end = lineno, min(end_lineno + 1, len(lines))
+    edited = (lines[lineno][:col_pos] if lineno < len(lines) else '') + text + \
+        (lines[end_lineno][end_col_pos:] if end_lineno < len(lines) else '')
+    if start > 0 and (lines[start - 1] == lines[start - 1].splitlines()[0] or
+                      edited.startswith('\n') and lines[start - 1].endswith('\r')):
+        # The text is appended to the last line without a line ending, or completes its `\r\n`
+        start -= 1
+        edited = lines[start] + edited
+    edited_lines = edited.splitlines(keepends=True)
+    # The last edited line is joined with the next line if it loses its line ending
+    while end < len(lines) and (not edited_lines or edited_lines[-1] == edited_lines[-1].splitlines()[0] or
+                                edited_lines[-1].endswith('\r') and lines[end].startswith('\n')):
+        edited_lines.extend(((edited_lines.pop() if edited_lines else '') + lines[end]).splitlines(keepends=True))
+        end += 1
+    return start, end, edited_lines
+
+
+def handle_help(no_help, command, source):
     if no_help:
-        raise ValidateHelpException() from e
+        return ValidationResult.from_failure(Failure(ValidateHelpException), command, source)
     return ValidationResult(command, True, source, validated_param=False)
+
+
+def _too_long_signature(code, signature: str, fixed: List[str]):
+    return code(signature, 'az ' + shlex.join(fixed))
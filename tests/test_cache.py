@@ -0,0 +1,106 @@
+import concurrent.futures
+import unittest
+
+from cli_validator.cache import LRUCache, approx_size
+from cli_validator.loader import build_command_index
+from cli_validator.meta.validator import CommandMetaValidator
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIsNone(cache.get('b'))
+        stats = cache.stats
+        self.assertEqual((stats.hits, stats.misses, stats.evictions, stats.size), (1, 1, 1, 2))
+        self.assertEqual(stats.hit_rate, 0.5)
+
+    def test_get_or_create(self):
+        cache = LRUCache(8)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return object()
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            values = list(executor.map(lambda _: cache.get_or_create('key', factory), range(16)))
+        self.assertTrue(all(value is values[0] for value in values))
+        self.assertEqual(cache.stats.hits + cache.stats.misses, 16)
+        self.assertEqual(cache.stats.misses, len(calls))
+
+    def test_weight(self):
+        cache = LRUCache(None, max_weight=10, weigher=len)
+        cache.put('a', 'xxxx')
+        cache.put('b', 'xxxx')
+        self.assertEqual(cache.weight, 8)
+        cache.put('c', 'xxxx')
+        self.assertNotIn('a', cache)
+        self.assertEqual((cache.stats.weight, cache.stats.evicted_weight, cache.stats.evictions), (8, 4, 1))
+        with self.assertLogs('cli_validator.cache', 'WARNING') as logs:
+            cache.put('d', 'x' * 11)
+            cache.put('e', 'x' * 12)
+        self.assertEqual(len(logs.records), 1)
+        self.assertNotIn('d', cache)
+        self.assertEqual((cache.stats.weight, cache.stats.rejections), (8, 2))
+        cache.pop('b')
+        self.assertEqual(cache.stats.weight, 4)
+
+    def test_approx_size(self):
+        small = {'name': 'vm create', 'parameters': []}
+        large = {'name': 'vm create', 'parameters': [{'name': 'vm_name', 'options': ['--name', '-n']}]}
+        self.assertGreater(approx_size(large), approx_size(small))
+
+        # An index of the commands in an extension is weighed close to the decoded metadata it keeps
+        parameters = [{'name': f'param_{i}', 'options': [f'--param-{i}'], 'help': 'x' * 200} for i in range(50)]
+        meta = {'module_name': 'ext', 'commands': {}, 'sub_groups': {'ext': {'commands': {
+            f'ext cmd{i}': {'name': f'ext cmd{i}', 'parameters': parameters} for i in range(20)}, 'sub_groups': {}}}}
+        index = build_command_index({'ext.json': meta})
+        self.assertGreater(approx_size(index), approx_size(meta) * 0.9)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.put('a', 1)
+        self.assertEqual(cache.get_or_create('b', lambda: 2), 2)
+        self.assertEqual(len(cache), 0)
+
+
+class ParserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.meta = {
+            "name": "vm create",
+            "parameters": [{
+                "name": "vm_name",
+                "options": ["--name", "-n"],
+                "required": True
+            }, {
+                "name": "port",
+                "options": ["--port"],
+                "type": "Int"
+            }]
+        }
+
+    def test_parser_reused(self):
+        cache = LRUCache(4)
+        validator = CommandMetaValidator(self.meta, cache, ('Core Module', ('vm', 'create'), '2.51.0'))
+        parser = validator.get_parser()
+        validator = CommandMetaValidator(self.meta, cache, ('Core Module', ('vm', 'create'), '2.51.0'))
+        self.assertIs(validator.get_parser(), parser)
+        self.assertIsNot(validator.get_parser(placeholder=False), parser)
+        validator.validate_params(['-n', 'n', '--port', '80'])
+        self.assertEqual(cache.stats.misses, 2)
+        self.assertEqual(cache.stats.hits, 2)
+
+    def test_without_cache(self):
+        validator = CommandMetaValidator(self.meta)
+        self.assertIsNot(validator.get_parser(), validator.get_parser())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import random
+import unittest
+
+from cli_validator.exceptions import ValidateFailureException, ParserFailureException, ConfirmationNoYesException
+from cli_validator.meta.matcher import ParamMatcher
+from cli_validator.meta.validator import CommandMetaValidator
+from cli_validator.result import Failure
+
+
+def _outcome(parse, args):
+    try:
+        namespace = parse(args)
+    except ValidateFailureException as e:
+        return type(e).__name__, e.msg
+    return 'ok', {k: getattr(v, 'expression', v) for k, v in vars(namespace).items()}
+
+
+class ParamMatcherTestCase(unittest.TestCase):
+    """Differential tests between `ParamMatcher` and the argparse based `CLIParser`"""
+
+    def setUp(self):
+        super().setUp()
+        self.metas = [{
+            "name": "vm create",
+            "parameters": [
+                {"name": "vm_name", "options": ["--name", "-n"], "required": True},
+                {"name": "resource_group_name", "options": ["--resource-group", "-g"], "required": True},
+                {"name": "size", "options": ["--size"], "default": "Standard_DS1_v2"},
+                {"name": "location", "options": ["--location", "-l"], "type": "custom_type"},
+                {"name": "tags", "options": ["--tags"], "nargs": "*"},
+                {"name": "disk_sizes", "options": ["--data-disk-sizes-gb"], "nargs": "+", "type": "Int"},
+                {"name": "zone", "options": ["--zone", "-z"], "nargs": None},
+                {"name": "pair", "options": ["--pair"], "nargs": 2},
+                {"name": "auth", "options": ["--authentication-type"], "choices": ["password", "ssh"]},
+                {"name": "ratio", "options": ["--ratio"], "type": "Float", "default": "0.5"},
+                {"name": "storage_sku", "options": ["--storage-sku"], "nargs": "+"},
+            ]
+        }, {
+            "name": "vm delete",
+            "confirmation": True,
+            "parameters": [
+                {"name": "vm_name", "options": ["--name", "-n"], "required": True, "id_part": "name"},
+                {"name": "resource_group_name", "options": ["--resource-group", "-g"], "id_part": "resource_group"},
+                {"name": "yes", "options": ["--yes", "-y"]},
+                {"name": "port", "options": ["--port", "-p"], "type": "Int", "choices": [80, 443]},
+            ]
+        }, {
+            "name": "acr build",
+            "parameters": [
+                {"name": "source_location", "options": [], "required": True},
+                {"name": "registry_name", "options": ["--registry", "-r"], "required": True},
+            ]
+        }]
+        self.corpus = [
+            [], ['-n', 'n', '-g', 'g'], ['--name=n', '-g', 'g'], ['-n=n'], ['--na', 'n'], ['--s', 'x'], ['--si', 'x'],
+            ['--size'], ['--tags'], ['--tags', 'a=b', 'c'], ['--data-disk-sizes-gb'],
+            ['--data-disk-sizes-gb', '1', 'x'], ['--data-disk-sizes-gb', '$SIZE'], ['--zone'], ['--zone', '1', '2'],
+            ['--pair', 'a'], ['--pair', 'a', 'b'], ['--authentication-type', 'key'],
+            ['--authentication-type', '<TYPE>'], ['--ratio', 'x'], ['--ratio', '-1'], ['-o', 'TSV'], ['-o', 'bogus'],
+            ['-o', '<FORMAT>'], ['--output'], ['--out', 'json'], ['--o', 'json'], ['--query', '[0].id'],
+            ['--query', 'a.b[0]c'], ['--query', '$(az x)'], ['-h'], ['--help'], ['-n', 'n', '--he'], ['--help=x'],
+            ['--verbose=1'], ['-nname'], ['-yn', 'n'], ['-x'], ['--unknown', 'value'], ['extra'], ['-n', '-1'],
+            ['-n', '-x y'], ['-n', 'n', '--', '-g'], ['--ids', 'a', 'b'], ['--ids'], ['--yes'], ['-y', '-n'],
+            ['--port', '80'], ['--port', '8080'], ['--port', 'abc'], ['--subscription', 's'], ['-'], ['-n', 'n', '-n'],
+            ['.', '-r', 'r'], ['-r', 'r'],
+            ['--location', '<LOC>', '--tags', '--verbose', '--debug', '--only-show-errors'],
+        ]
+
+    def assertSameOutcome(self, meta, args, placeholder):
+        matcher = ParamMatcher(meta, placeholder)
+        self.assertEqual(_outcome(matcher.parse_args, list(args)), _outcome(matcher.parser.parse_args, list(args)),
+                         msg=f'{meta["name"]} {args} placeholder={placeholder}')
+
+    def test_corpus(self):
+        for meta in self.metas:
+            for placeholder in [True, False]:
+                for args in self.corpus:
+                    self.assertSameOutcome(meta, args, placeholder)
+
+    def test_random(self):
+        rand = random.Random(0)
+        tokens = sorted(set(token for args in self.corpus for token in args))
+        for meta in self.metas:
+            for placeholder in [True, False]:
+                for _ in range(500):
+                    args = [rand.choice(tokens) for _ in range(rand.randint(0, 6))]
+                    self.assertSameOutcome(meta, args, placeholder)
+
+    def test_fallback(self):
+        self.assertTrue(ParamMatcher(self.metas[0]).supported)
+        # Positional arguments are parsed by argparse
+        self.assertFalse(ParamMatcher(self.metas[2]).supported)
+
+    def test_failure(self):
+        failure = ParamMatcher(self.metas[0]).match(['-n', 'n', '--zone'])
+        self.assertIsInstance(failure, Failure)
+        self.assertIs(failure.code, ParserFailureException)
+        self.assertIsNone(failure._exception)
+        self.assertEqual(failure.msg, 'argument --zone/-z: expected one argument')
+
+        validator = CommandMetaValidator(self.metas[1])
+        self.assertEqual(validator.check_params(['-g', 'g']).msg, 'the following arguments are required: --name/-n ')
+        self.assertIs(validator.check_params(['-n', 'n'], non_interactive=True).code, ConfirmationNoYesException)
+        self.assertIsNone(validator.check_params(['-n', 'n', '--yes'], non_interactive=True))
+        self.assertEqual(validator.check_param_keys(['--port', '--unknown']).msg, 'unrecognized arguments: --unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from cli_validator.cmd_tree import CommandTreeParser, MergedCommandTree
+from cli_validator.exceptions import ValidateFailureException, UnknownCommandException, MissingSubCommandException
+from cli_validator.result import CommandSource, Failure
+
+
+def _sequential_parse(trees, command, missing_as_help):
+    """The behavior of trying the command tree of each source in order"""
+    for idx, tree in enumerate(trees):
+        try:
+            cmd_info = tree.parse_command(command)
+            if cmd_info.module is None and not cmd_info.parameters:
+                return idx, None
+            return idx, cmd_info.module, cmd_info.signature, cmd_info.parameters
+        except MissingSubCommandException:
+            if missing_as_help:
+                return idx, None
+        except UnknownCommandException:
+            continue
+    return None
+
+
+def _merged_parse(tree, command, missing_as_help):
+    parsed = tree.match_command(command, missing_as_help)
+    if parsed is None:
+        return None
+    elif isinstance(parsed, Failure):
+        return parsed.code.__name__, parsed.msg
+    idx, cmd_info = parsed
+    if cmd_info.module is None and not cmd_info.parameters:
+        return idx, None
+    return idx, cmd_info.module, cmd_info.signature, cmd_info.parameters
+
+
+def _outcome(parse, *args):
+    try:
+        return parse(*args)
+    except ValidateFailureException as e:
+        return type(e).__name__, e.msg
+
+
+class MergedCommandTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.core_tree = CommandTreeParser({
+            'vm': {'create': 'vm', 'show': 'vm', 'disk': {'attach': 'vm'}},
+            'group': {'show': 'resource', 'list': 'resource'},
+            'network': {'vnet': {'create': 'network'}},
+            'broken': 1,
+        }, CommandSource.CORE_MODULE)
+        self.extension_tree = CommandTreeParser({
+            'vm': {'repair': {'run': 'vm-repair'}, 'show': 'vm-ext', 'disk': 'disk-ext'},
+            'devcenter': {'dev': {'project': {'list': 'devcenter'}}},
+            'network': {'vnet': 'network-ext', 'broken': [1]},
+        }, CommandSource.EXTENSION)
+        self.merged_tree = MergedCommandTree([self.core_tree, self.extension_tree])
+
+    def test_parse_command(self):
+        idx, cmd_info = self.merged_tree.match_command(['az', 'vm', 'repair', 'run', '-g', 'rg'])
+        self.assertEqual((idx, cmd_info.module, cmd_info.signature, cmd_info.parameters),
+                         (1, 'vm-repair', ['vm', 'repair', 'run'], ['-g', 'rg']))
+        idx, cmd_info = self.merged_tree.match_command(['az', 'vm', 'show', '-n', 'vm'])
+        self.assertEqual((idx, cmd_info.module), (0, 'vm'))
+        self.assertIsNone(self.merged_tree.match_command(['az', 'vm', 'delete']))
+        self.assertIsNone(self.merged_tree.match_command(['az', 'devcenter', 'dev']))
+        self.assertIsNone(MergedCommandTree([]).match_command(['az', 'vm', 'show']))
+        self.assertIsNone(self.merged_tree.match_command(['az']))
+
+    def test_match_command(self):
+        failure = self.core_tree.match_command(['az', 'vm', 'delete', '--name', 'a b'])
+        self.assertIs(failure.code, UnknownCommandException)
+        self.assertIsNone(failure._exception)
+        self.assertEqual(failure.msg, 'Unknown Command: "az vm delete --name \'a b\'".')
+        self.assertEqual(self.core_tree.match_command(['az', 'vm', 'show']).module, 'vm')
+        self.assertIs(self.core_tree.match_command(['az']).code, MissingSubCommandException)
+
+    def test_random(self):
+        rand = random.Random(0)
+        tokens = ['vm', 'create', 'show', 'disk', 'attach', 'repair', 'run', 'group', 'list', 'network', 'vnet',
+                  'devcenter', 'dev', 'project', 'broken', 'unknown', '--help', '-h', '-n', 'help']
+        trees = [self.core_tree, self.extension_tree]
+        for _ in range(5000):
+            command = [rand.choice(['az', 'az', 'az', 'git'])] + \
+                [rand.choice(tokens) for _ in range(rand.randint(0, 5))]
+            if rand.random() < 0.01:
+                command = []
+            missing_as_help = rand.random() < 0.5
+            expected = _outcome(_sequential_parse, trees, command, missing_as_help)
+            self.assertEqual(_outcome(_merged_parse, self.merged_tree, command, missing_as_help), expected,
+                             msg=f'{command} missing_as_help={missing_as_help}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,29 @@
+import asyncio
 import concurrent.futures
+import hashlib
+import http.server
+import json
+import multiprocessing
 import os
+import pickle
 import shutil
+import threading
+import time
 import unittest
 from unittest.mock import patch
 
-from cli_validator.exceptions import VersionNotExistException
+import httpx
+
+from cli_validator.exceptions import VersionNotExistException, CommandMetaNotFoundException
+from cli_validator.loader import build_command_index, CacheStrategy
+from cli_validator.loader import cmd_meta
 from cli_validator.loader.cmd_meta import load_core_metas, load_version_index, load_latest_version, load_http
+from cli_validator.loader.cmd_meta import aio
+from cli_validator.loader.core_repo import CoreRepoLoader
+from cli_validator.loader.extension import ExtensionLoader
+from cli_validator.loader.http import configure_http
+from cli_validator.loader.meta_store import MetaStore, write_meta_store
+from cli_validator.loader.utils import store_to_local, AtomicFile
 
 
 class LoaderTestCase(unittest.IsolatedAsyncioTestCase):
@@ -74,3 +92,461 @@ class LoaderTestCase(unittest.IsolatedAsyncioTestCase):
             shutil.rmtree(self.meta_data_dir)
         if os.path.exists(self.tree_data_dir):
             shutil.rmtree(self.tree_data_dir)
+
+
+class ExtensionLoaderTestCase(unittest.TestCase):
+    @patch('cli_validator.loader.extension.load_latest_version')
+    def test_version_cached(self, mock_load_latest_version: unittest.mock.Mock):
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.0.0.json'
+        loader = ExtensionLoader(None)
+        self.assertEqual(loader.resolve_version('devcenter'), 'az_devcenter_meta_1.0.0.json')
+        self.assertEqual(loader.resolve_version('devcenter'), 'az_devcenter_meta_1.0.0.json')
+        self.assertEqual(mock_load_latest_version.call_count, 1)
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.1.0.json'
+        loader.refresh_versions('devcenter')
+        self.assertEqual(loader.resolve_version('devcenter'), 'az_devcenter_meta_1.1.0.json')
+        self.assertEqual(loader.get_meta_version('devcenter'), 'az_devcenter_meta_1.1.0.json')
+        self.assertEqual(mock_load_latest_version.call_count, 2)
+
+    @patch('cli_validator.loader.extension.load_latest_version')
+    def test_version_expired(self, mock_load_latest_version: unittest.mock.Mock):
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.0.0.json'
+        loader = ExtensionLoader(None, version_ttl=0)
+        loader.resolve_version('devcenter')
+        loader.resolve_version('devcenter')
+        self.assertEqual(mock_load_latest_version.call_count, 2)
+
+    @patch('cli_validator.loader.extension.try_load_meta')
+    @patch('cli_validator.loader.extension.load_latest_version')
+    def test_meta_cached(self, mock_load_latest_version: unittest.mock.Mock, mock_try_load_meta: unittest.mock.Mock):
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.0.0.json'
+        command = {"name": "devcenter dev project list", "parameters": []}
+        mock_try_load_meta.return_value = {
+            "module_name": "devcenter", "commands": {}, "sub_groups": {
+                "devcenter": {"commands": {}, "sub_groups": {
+                    "devcenter dev": {"commands": {}, "sub_groups": {
+                        "devcenter dev project": {"commands": {"devcenter dev project list": command},
+                                                  "sub_groups": {}}}}}}}}
+        loader = ExtensionLoader(None)
+        signature = ['devcenter', 'dev', 'project', 'list']
+        self.assertEqual(loader.load_command_meta(signature, 'devcenter'), command)
+        self.assertEqual(loader.load_command_meta(signature, 'devcenter'), command)
+        self.assertEqual(mock_try_load_meta.call_count, 1)
+        self.assertEqual(loader.meta_cache.stats.hits, 1)
+        self.assertGreater(loader.meta_cache.stats.weight, 0)
+
+        loader = ExtensionLoader(None, meta_cache_bytes=0)
+        loader.load_command_meta(signature, 'devcenter')
+        loader.load_command_meta(signature, 'devcenter')
+        self.assertEqual(mock_try_load_meta.call_count, 3)
+
+
+class CommandIndexTestCase(unittest.TestCase):
+    def test_build_command_index(self):
+        command = {"name": "network vnet subnet list", "parameters": []}
+        metas = {'az_network_meta.json': {
+            "module_name": "network", "commands": {}, "sub_groups": {
+                "network": {"commands": {}, "sub_groups": {
+                    "network vnet": {"commands": {}, "sub_groups": {
+                        "network vnet subnet": {"commands": {"network vnet subnet list": command},
+                                                "sub_groups": {}}}}}}}}}
+        command_index = build_command_index(metas)
+        self.assertEqual(command_index, {('network', 'vnet', 'subnet', 'list'): ('network', command)})
+        loader = CoreRepoLoader(None)
+        loader.command_index = command_index
+        self.assertIs(loader.load_command_meta(['network', 'vnet', 'subnet', 'list'], 'network'), command)
+        self.assertIsNone(loader.load_command_meta(['network', 'vnet', 'subnet', 'show'], 'network'))
+
+
+class LazyCoreRepoLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.meta_data_dir = 'test_lazy_meta'
+        self.command = {"name": "group show", "parameters": []}
+        self.metas = {
+            'az_resource_meta.json': {
+                "module_name": "resource", "commands": {}, "sub_groups": {
+                    "group": {"commands": {"group show": self.command}, "sub_groups": {}}}},
+            'az_vm_meta.json': {
+                "module_name": "vm", "commands": {}, "sub_groups": {
+                    "vm": {"commands": {"vm show": {"name": "vm show", "parameters": []}}, "sub_groups": {}}}}
+        }
+
+    @patch('cli_validator.loader.core_repo.try_load_core_meta')
+    @patch('cli_validator.loader.core_repo.load_core_metas')
+    @patch('cli_validator.loader.core_repo.get_version_dir')
+    def test_lazy_load(self, mock_get_version_dir: unittest.mock.Mock, mock_load_core_metas: unittest.mock.Mock,
+                       mock_try_load_core_meta: unittest.mock.Mock):
+        mock_get_version_dir.return_value = 'azure-cli-2.51.0'
+        mock_load_core_metas.return_value = self.metas
+        mock_try_load_core_meta.side_effect = \
+            lambda version_dir, file_name, target_dir, compression=None: self.metas[file_name]
+        loader = CoreRepoLoader(self.meta_data_dir, lazy=True, max_modules=1)
+        loader.load('2.51.0')
+        self.assertIsNone(loader.metas)
+        self.assertEqual(loader.command_tree.parse_command(['az', 'group', 'show']).module, 'resource')
+        self.assertEqual(loader.load_command_meta(['group', 'show'], 'resource'), self.command)
+        self.assertEqual(loader.load_command_meta(['group', 'show'], 'resource'), self.command)
+        self.assertEqual(mock_try_load_core_meta.call_count, 1)
+        loader.load_command_meta(['vm', 'show'], 'vm')
+        self.assertEqual(loader.module_metas.stats.evictions, 1)
+
+        # The command tree is built from the local cache without decoding all the metadata again
+        loader = CoreRepoLoader(self.meta_data_dir, lazy=True)
+        loader.load('2.51.0')
+        self.assertEqual(mock_load_core_metas.call_count, 1)
+        self.assertEqual(loader.command_tree.parse_command(['az', 'vm', 'show']).module, 'vm')
+
+    @patch('cli_validator.loader.core_repo.try_load_core_meta')
+    @patch('cli_validator.loader.core_repo.load_core_metas')
+    @patch('cli_validator.loader.core_repo.get_version_dir')
+    def test_meta_store(self, mock_get_version_dir: unittest.mock.Mock, mock_load_core_metas: unittest.mock.Mock,
+                        mock_try_load_core_meta: unittest.mock.Mock):
+        mock_get_version_dir.return_value = 'azure-cli-2.51.0'
+        mock_load_core_metas.return_value = self.metas
+        loader = CoreRepoLoader(self.meta_data_dir, use_meta_store=True)
+        loader.load('2.51.0')
+        self.assertTrue(os.path.exists(os.path.join(self.meta_data_dir, 'azure-cli-2.51.0', 'command_meta.store')))
+        self.assertEqual(loader.load_command_meta(['group', 'show'], 'resource'), self.command)
+        self.assertIsNone(loader.load_command_meta(['group', 'list'], 'resource'))
+
+        # The unpickled loader opens the store written in the cache again
+        data = pickle.dumps(loader)
+        self.assertNotIn(b'group show', data)
+        restored = pickle.loads(data)
+        self.assertEqual(restored.load_command_meta(['group', 'show'], 'resource'), self.command)
+        self.assertEqual(restored.command_tree.parse_command(['az', 'vm', 'show']).module, 'vm')
+        self.assertEqual(mock_load_core_metas.call_count, 1)
+
+        # Another loader maps the existing store without decoding the metadata
+        loader = CoreRepoLoader(self.meta_data_dir, use_meta_store=True)
+        loader.load('2.51.0')
+        self.assertEqual(mock_load_core_metas.call_count, 1)
+        self.assertEqual(loader.load_command_meta(['vm', 'show'], 'vm'), {"name": "vm show", "parameters": []})
+        mock_try_load_core_meta.assert_not_called()
+
+    def tearDown(self):
+        super().tearDown()
+        if os.path.exists(self.meta_data_dir):
+            shutil.rmtree(self.meta_data_dir)
+
+
+class MetaStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store_dir = 'test_meta_store'
+        self.command = {"name": "devcenter dev project list", "help": "List projects.", "parameters": [
+            {"name": "dev_center", "options": ["--dev-center", "-d"], "required": True, "help": "The dev center."}]}
+        self.meta = {
+            "module_name": "devcenter", "commands": {}, "sub_groups": {
+                "devcenter": {"commands": {}, "sub_groups": {
+                    "devcenter dev": {"commands": {}, "sub_groups": {
+                        "devcenter dev project": {"commands": {"devcenter dev project list": self.command},
+                                                  "sub_groups": {}}}}}}}}
+
+    def test_store(self):
+        path = os.path.join(self.store_dir, 'devcenter.store')
+        write_meta_store(path, {'az_devcenter_meta.json': self.meta})
+        store = MetaStore.open(path)
+        self.assertEqual(len(store), 1)
+        self.assertIn('devcenter dev project list', store)
+        self.assertEqual(store.get('devcenter dev project list'), {"name": "devcenter dev project list", "parameters": [
+            {"name": "dev_center", "options": ["--dev-center", "-d"], "required": True}]})
+        self.assertIsNone(store.get('devcenter dev project show'))
+        store.close()
+        with open(path, 'wb') as f:
+            f.write(b'{"name": "devcenter dev project list"}')
+        with self.assertRaises(ValueError):
+            MetaStore.open(path)
+        # A store that can't be decoded is written again
+        store = MetaStore.open_or_create(path, lambda: {'az_devcenter_meta.json': self.meta})
+        self.assertEqual(len(store), 1)
+        store.close()
+        # Only JSON is decoded from the store
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertIn(b'{"devcenter dev project list":[0,', data)
+        self.assertNotIn(b'\x80\x05', data)
+
+    @patch('cli_validator.loader.extension.try_load_meta')
+    @patch('cli_validator.loader.extension.load_latest_version')
+    def test_extension_store(self, mock_load_latest_version: unittest.mock.Mock,
+                             mock_try_load_meta: unittest.mock.Mock):
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.0.0.json'
+        mock_try_load_meta.return_value = self.meta
+        signature = ['devcenter', 'dev', 'project', 'list']
+        loader = ExtensionLoader(self.store_dir, use_meta_store=True)
+        self.assertEqual(loader.load_command_meta(signature, 'devcenter')['name'], 'devcenter dev project list')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.store_dir, 'azure-cli-extensions/ext-devcenter/az_devcenter_meta_1.0.0.json.store')))
+        loader = ExtensionLoader(self.store_dir, use_meta_store=True)
+        loader.load_command_meta(signature, 'devcenter')
+        self.assertEqual(mock_try_load_meta.call_count, 1)
+        with self.assertRaises(CommandMetaNotFoundException):
+            loader.load_command_meta(['devcenter', 'dev', 'project', 'show'], 'devcenter')
+
+    def tearDown(self):
+        super().tearDown()
+        if os.path.exists(self.store_dir):
+            shutil.rmtree(self.store_dir)
+
+
+class AsyncExtensionLoaderTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.command = {"name": "devcenter dev project list", "parameters": []}
+        self.meta = {
+            "module_name": "devcenter", "commands": {}, "sub_groups": {
+                "devcenter dev project": {"commands": {"devcenter dev project list": self.command},
+                                          "sub_groups": {}}}}
+
+    async def _load_meta(self, version_dir, file_name, target_dir, compression=None):
+        await asyncio.sleep(0.01)
+        return self.meta
+
+    @patch('cli_validator.loader.cmd_meta.aio.try_load_meta')
+    @patch('cli_validator.loader.cmd_meta.aio.load_latest_version')
+    async def test_shared_load(self, mock_load_latest_version: unittest.mock.AsyncMock,
+                               mock_try_load_meta: unittest.mock.AsyncMock):
+        mock_load_latest_version.return_value = 'az_devcenter_meta_1.0.0.json'
+        mock_try_load_meta.side_effect = self._load_meta
+        signature = ['devcenter', 'dev', 'project', 'list']
+        for use_meta_store in [False, True]:
+            loader = ExtensionLoader(None, use_meta_store=use_meta_store)
+            metas = await asyncio.gather(*[loader.load_command_meta_async(signature, 'devcenter') for _ in range(5)])
+            self.assertEqual([meta['name'] for meta in metas], ['devcenter dev project list'] * 5)
+            with self.assertRaises(CommandMetaNotFoundException):
+                await loader.load_command_meta_async(['devcenter', 'dev', 'project', 'show'], 'devcenter')
+        self.assertEqual(mock_load_latest_version.call_count, 2)
+        self.assertEqual(mock_try_load_meta.call_count, 2)
+        mock_try_load_meta.assert_called_with('azure-cli-extensions/ext-devcenter', 'az_devcenter_meta_1.0.0.json',
+                                              None, compression=None)
+
+    @patch('cli_validator.loader.cmd_meta.aio.try_load_meta')
+    async def test_lazy_core_load(self, mock_try_load_meta: unittest.mock.AsyncMock):
+        mock_try_load_meta.side_effect = self._load_meta
+        loader = CoreRepoLoader(None, lazy=True)
+        loader.version_dir = 'azure-cli-2.51.0'
+        metas = await asyncio.gather(*[
+            loader.load_command_meta_async(['devcenter', 'dev', 'project', 'list'], 'devcenter') for _ in range(3)])
+        self.assertEqual(metas, [self.command] * 3)
+        mock_try_load_meta.assert_called_once_with('azure-cli-2.51.0', 'az_devcenter_meta.json', None,
+                                                   compression=None)
+
+
+class _BlobHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        if self.path in server.redirects:
+            self.send_response(307)
+            self.send_header('Location', server.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(0.005)
+        data = server.blobs.get(self.path)
+        with server.lock:
+            server.active -= 1
+        etag = f'"{hashlib.md5(data).hexdigest()}"' if data is not None else None
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            status, data = 304, b''
+        else:
+            status = 200 if data is not None else 404
+        server.statuses.append(status)
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(data or b'')))
+        self.end_headers()
+        self.wfile.write(data or b'')
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalBlobServerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Download metadata from a local stand-in of the Blob"""
+
+    def setUp(self):
+        super().setUp()
+        self.meta_data_dir = 'test_local_blob'
+        self.metas = {f'az_module{i}_meta.json': {"module_name": f"module{i}", "commands": {}, "sub_groups": {}}
+                      for i in range(40)}
+        blobs = {f'/cmd-metadata-per-version/azure-cli-2.51.0/{name}': json.dumps(meta).encode()
+                 for name, meta in self.metas.items()}
+        blobs['/cmd-metadata-per-version/azure-cli-2.51.0/index.txt'] = '\n'.join(self.metas).encode()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _BlobHandler)
+        self.server.blobs = blobs
+        self.server.lock = threading.Lock()
+        self.server.connections = set()
+        self.server.active = self.server.max_active = 0
+        self.server.statuses = []
+        self.server.redirects = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        blob_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.patches = [patch('cli_validator.loader.cmd_meta.BLOB_URL', blob_url),
+                        patch('cli_validator.loader.cmd_meta.aio.BLOB_URL', blob_url)]
+        for p in self.patches:
+            p.start()
+        configure_http(max_connections=4, timeout=5)
+
+    def test_load_metas(self):
+        self.assertEqual(load_core_metas('2.51.0', self.meta_data_dir), self.metas)
+        self.assertLessEqual(self.server.max_active, 4)
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    async def test_load_metas_async(self):
+        self.assertEqual(await aio.load_metas('2.51.0', None), self.metas)
+        self.assertLessEqual(self.server.max_active, 4)
+        self.assertLessEqual(len(self.server.connections), 4)
+        self.assertIsNone(await aio.try_load_meta('azure-cli-2.51.0', 'az_unknown_meta.json', None))
+
+    def test_revalidate(self):
+        load_core_metas('2.51.0', self.meta_data_dir)
+        self.assertEqual(self.server.statuses, [200] * 41)
+        self.server.statuses.clear()
+        self.assertEqual(load_core_metas('2.51.0', self.meta_data_dir, force_refresh=True), self.metas)
+        self.assertEqual(self.server.statuses, [304] * 41)
+
+        self.server.statuses.clear()
+        changed = {"module_name": "module0", "commands": {}, "sub_groups": {"vm": {}}}
+        self.server.blobs['/cmd-metadata-per-version/azure-cli-2.51.0/az_module0_meta.json'] = \
+            json.dumps(changed).encode()
+        metas = load_core_metas('2.51.0', self.meta_data_dir, force_refresh=True)
+        self.assertEqual(metas['az_module0_meta.json'], changed)
+        self.assertEqual(sorted(self.server.statuses), [200] + [304] * 40)
+
+    def test_unpickle_from_cache(self):
+        loader = CoreRepoLoader(self.meta_data_dir)
+        loader.load('2.51.0')
+        self.server.statuses.clear()
+        # The unpickled loader reads the metadata from the cache without network
+        restored = pickle.loads(pickle.dumps(loader))
+        self.assertEqual(restored.metas, self.metas)
+        self.assertEqual(self.server.statuses, [])
+
+    async def test_revalidate_async(self):
+        await aio.load_metas('2.51.0', self.meta_data_dir)
+        self.server.statuses.clear()
+        self.assertEqual(await aio.load_metas('2.51.0', self.meta_data_dir, force_refresh=True), self.metas)
+        self.assertEqual(self.server.statuses, [304] * 41)
+
+    def test_stale_while_revalidate(self):
+        url = f'{cmd_meta.BLOB_URL}/cmd-metadata-per-version/version_list.txt'
+        cache_path = os.path.join(self.meta_data_dir, 'version_list.txt')
+        self.server.blobs['/cmd-metadata-per-version/version_list.txt'] = b'2.50.0'
+        self.assertEqual(load_http(url, cache_path, CacheStrategy.Fallback), '2.50.0')
+        self.server.blobs['/cmd-metadata-per-version/version_list.txt'] = b'2.50.0\n2.51.0'
+        refreshed = []
+        done = threading.Event()
+        data = load_http(url, cache_path, CacheStrategy.StaleWhileRevalidate, max_stale=3600,
+                         on_refresh=lambda d: (refreshed.append(d), done.set()))
+        self.assertEqual(data, '2.50.0')
+        self.assertTrue(done.wait(5))
+        self.assertEqual(refreshed, ['2.50.0\n2.51.0'])
+        self.assertEqual(load_latest_version(self.meta_data_dir, max_stale=3600), '2.51.0')
+
+        # The cache older than the max stale age is revalidated before use
+        self.server.blobs['/cmd-metadata-per-version/version_list.txt'] = b'2.52.0'
+        os.utime(cache_path, (0, 0))
+        self.assertEqual(load_http(url, cache_path, CacheStrategy.StaleWhileRevalidate, max_stale=3600), '2.52.0')
+
+    def test_stale_extension_tree(self):
+        store_to_local(json.dumps({'vm': {'repair': {'run': 'vm-repair'}}}),
+                       os.path.join(self.meta_data_dir, 'ext_command_tree.json'))
+        self.server.blobs['/extensionCommandTree.json'] = json.dumps({'devcenter': {'dev': 'devcenter'}}).encode()
+        loader = ExtensionLoader(self.meta_data_dir, max_stale=3600)
+        tree_url = f'{cmd_meta.BLOB_URL}/extensionCommandTree.json'
+        with patch.object(ExtensionLoader, 'EXTENSION_COMMAND_TREE_URL', tree_url):
+            loader.load()
+        self.assertIn('vm', loader.command_tree.cmd_tree)
+        for _ in range(500):
+            if 'devcenter' in loader.command_tree.cmd_tree:
+                break
+            time.sleep(0.01)
+        self.assertEqual(loader.command_tree.cmd_tree, {'devcenter': {'dev': 'devcenter'}})
+
+    def test_single_download(self):
+        self.server.blobs['/cmd-metadata-per-version/version_list.txt'] = b'2.51.0' * 100000
+        url = f'{cmd_meta.BLOB_URL}/cmd-metadata-per-version/version_list.txt'
+        cache_path = os.path.join(self.meta_data_dir, 'version_list.txt')
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(4) as pool:
+            results = pool.starmap(load_http, [(url, cache_path)] * 8)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results += list(executor.map(lambda _: load_http(url, cache_path, CacheStrategy.Fallback), range(4)))
+        self.assertEqual(results, ['2.51.0' * 100000] * 12)
+        self.assertEqual(self.server.statuses.count(200), 1)
+        self.assertEqual(sorted(os.listdir(self.meta_data_dir)),
+                         ['version_list.txt', 'version_list.txt.lock', 'version_list.txt.validators'])
+
+    def test_compressed_cache(self):
+        for compression, magic in [('gzip', b'\x1f\x8b'), ('lzma', b'\xfd7zXZ\x00')]:
+            self.server.statuses.clear()
+            self.assertEqual(load_core_metas('2.51.0', self.meta_data_dir, compression=compression), self.metas)
+            with open(os.path.join(self.meta_data_dir, 'azure-cli-2.51.0', 'az_module0_meta.json'), 'rb') as f:
+                self.assertTrue(f.read().startswith(magic))
+            # Compressed files are read without knowing the compression
+            self.assertEqual(load_core_metas('2.51.0', self.meta_data_dir), self.metas)
+            self.assertEqual(self.server.statuses, [200] * 41 + [304])
+            shutil.rmtree(self.meta_data_dir)
+        with self.assertRaises(ValueError):
+            CoreRepoLoader(self.meta_data_dir, compression='zip')
+
+    async def test_streamed_download(self):
+        meta = {"module_name": "module0", "commands": {f"vm create{i}": {"help": "創建\r\n"} for i in range(20000)},
+                "sub_groups": {}}
+        data = json.dumps(meta, ensure_ascii=False).encode()
+        self.server.blobs['/cmd-metadata-per-version/azure-cli-2.51.0/az_module0_meta.json'] = data
+        cache_path = os.path.join(self.meta_data_dir, 'azure-cli-2.51.0', 'az_module0_meta.json')
+        writes = []
+        write = AtomicFile.write
+        with patch.object(AtomicFile, 'write', lambda f, chunk: (writes.append(len(chunk)), write(f, chunk))):
+            self.assertEqual(cmd_meta.try_load_core_meta('azure-cli-2.51.0', 'az_module0_meta.json',
+                                                         self.meta_data_dir), meta)
+            # The response is written in chunks as it is, without decoding and encoding it again
+            self.assertGreater(len(writes), 1)
+            with open(cache_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            os.remove(cache_path)
+            del writes[:]
+            self.assertEqual(await aio.try_load_meta('azure-cli-2.51.0', 'az_module0_meta.json',
+                                                     self.meta_data_dir, compression='gzip'), meta)
+            # The chunks received by the event loop are buffered into one write in the executor, followed by the
+            # write of the validators
+            self.assertEqual(writes[0], len(data))
+            self.assertEqual(len(writes), 2)
+            with open(cache_path, 'rb') as f:
+                self.assertTrue(f.read().startswith(b'\x1f\x8b'))
+        self.assertEqual(cmd_meta.try_load_core_meta('azure-cli-2.51.0', 'az_module0_meta.json'), meta)
+
+    async def test_redirect(self):
+        path = '/cmd-metadata-per-version/azure-cli-2.51.0/az_module0_meta.json'
+        self.server.blobs['/moved/az_module0_meta.json'] = self.server.blobs.pop(path)
+        self.server.redirects[path] = '/moved/az_module0_meta.json'
+        meta = self.metas['az_module0_meta.json']
+        self.assertEqual(cmd_meta.try_load_core_meta('azure-cli-2.51.0', 'az_module0_meta.json'), meta)
+        self.assertEqual(await aio.try_load_meta('azure-cli-2.51.0', 'az_module0_meta.json', None), meta)
+
+    def test_timeout(self):
+        configure_http(timeout=0.001)
+        self.server.blobs = {}
+        with patch.object(_BlobHandler, 'do_GET', lambda handler: time.sleep(0.2)):
+            with self.assertRaises(httpx.TimeoutException):
+                load_http(f'{cmd_meta.BLOB_URL}/cmd-metadata-per-version/version_list.txt')
+
+    def tearDown(self):
+        super().tearDown()
+        configure_http()
+        for p in self.patches:
+            p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.meta_data_dir):
+            shutil.rmtree(self.meta_data_dir)
@@ -0,0 +1,95 @@
+import random
+import shlex
+import time
+import unittest
+
+from cli_validator.script import LineIndex, idx_from_script, extract_token_sets_from_script, _split_with_pos
+
+
+def _shlex_split_with_pos(line: str, lineno=0):
+    """The tokenizer based on `shlex` that `_split_with_pos` replaces"""
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    while True:
+        col_pos = lexer.instream.tell()
+        token = lexer.get_token()
+        if token == lexer.eof:
+            break
+        end_col_pos = len(line[:lexer.instream.tell()].rstrip())
+        yield token, line[col_pos:end_col_pos], lineno, col_pos, lineno, end_col_pos
+
+
+def _split(split_with_pos, line: str):
+    try:
+        return [token if isinstance(token, tuple) else
+                (token.content, token.raw, token.lineno, token.col_pos, token.end_lineno, token.end_col_pos)
+                for token in split_with_pos(line, 1)]
+    except ValueError as e:
+        return str(e)
+
+
+class LineIndexTestCase(unittest.TestCase):
+    def test_index(self):
+        script = 'az vm list\r\n\naz group show \\\n  -n "資源"\rend'
+        line_index = LineIndex(script)
+        lines = script.splitlines(keepends=True)
+        for lineno, line in enumerate(lines):
+            for col_pos in range(len(line) + 1):
+                expected = sum(len(lines[i]) for i in range(lineno)) + col_pos
+                self.assertEqual(line_index.index(lineno, col_pos), expected)
+                self.assertEqual(idx_from_script(script, lineno, col_pos), expected)
+        with self.assertRaises(IndexError):
+            line_index.index(len(lines), 0)
+        with self.assertRaises(IndexError):
+            line_index.index(0, len(lines[0]) + 1)
+
+    def test_merged_tokens(self):
+        script = 'key=$(az keyvault secret show \\\n  --vault-name $(az keyvault list --query "[0].name") -n s)'
+        token_sets = list(extract_token_sets_from_script(script))
+        line_index = LineIndex(script)
+        for token_set in token_sets:
+            for token in token_set:
+                start = line_index.index(token.lineno, token.col_pos)
+                self.assertEqual(script[start: line_index.index(token.end_lineno, token.end_col_pos)], token.raw)
+        self.assertEqual([token.content for token in token_sets[0]], ['az', 'keyvault', 'list', '--query', '[0].name'])
+
+    def test_long_script(self):
+        script = '\n'.join(f'az group show -n rg{i} --query $(az account show --query id)' for i in range(5000))
+        start = time.perf_counter()
+        token_sets = list(extract_token_sets_from_script(script))
+        self.assertEqual(len(token_sets), 10000)
+        # Mapping positions is linear in the size of the script
+        self.assertLess(time.perf_counter() - start, 5)
+
+
+class LexerTestCase(unittest.TestCase):
+    corpus = [
+        '', '   ', 'az vm list', '  az  vm   list  ', 'az vm create -n "my vm" --tags \'a=b c\'',
+        'az group show -n rg # comment', 'az group show -n rg#comment', '# only comment', 'echo "a\\"b" \'c\\\'',
+        'echo "\\$HOME \\x"', 'a\\ b c\\', '"unclosed', "'unclosed", 'echo ""', "echo '' x", 'a"b"c\'d\'e',
+        'az vm create --image $(az vm image list --query "[0].urn" -o tsv)', '\ttab\tseparated\x0cform',
+        'naïve ünïcode "全角　space"', 'x=$(az group list --query "[?location==\'westus\']" -o tsv)',
+    ]
+
+    def test_corpus(self):
+        for line in self.corpus:
+            self.assertEqual(_split(_split_with_pos, line), _split(_shlex_split_with_pos, line), line)
+
+    def test_random(self):
+        rnd = random.Random(0)
+        alphabet = ['a', 'z', ' ', ' ', '\t', '"', "'", '\\', '#', '$', '(', ')', '=', '-', ';', '\x0c', '　', 'é']
+        for _ in range(20000):
+            line = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 24)))
+            self.assertEqual(_split(_split_with_pos, line), _split(_shlex_split_with_pos, line), line)
+
+    def test_commands(self):
+        # Commands without line continuations or `$(...)` are split the same as `shlex.split`
+        for line in self.corpus:
+            if '(' in line or ')' in line or line.endswith('\\') or len(line.splitlines()) > 1:
+                continue
+            try:
+                expected = [tokens for tokens in [shlex.split(line, comments=True)] if tokens]
+            except ValueError:
+                continue
+            self.assertEqual([[token.content for token in token_set]
+                              for token_set in extract_token_sets_from_script(line)], expected, line)
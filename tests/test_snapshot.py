@@ -0,0 +1,99 @@
+import hashlib
+import marshal
+import os
+import pickle
+import shutil
+import unittest
+from unittest import mock
+
+from cli_validator.exceptions import InvalidSnapshotException
+from cli_validator.loader.core_repo import build_command_tree, CoreRepoLoader
+from cli_validator.result import CommandSource
+from cli_validator.snapshot import read_snapshot, FORMAT_VERSION, MAGIC, _HEADER
+from cli_validator.validator import CLIValidator
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot_dir = 'test_snapshot'
+        self.path = os.path.join(self.snapshot_dir, 'azure-cli-2.51.0.snapshot')
+        metas = {
+            'az_resource_meta.json': {
+                "module_name": "resource", "commands": {}, "sub_groups": {
+                    "group": {"name": "group", "help": "Manage resource groups.", "commands": {
+                        "group show": {"name": "group show", "help": "Gets a resource group.", "parameters": [{
+                            "name": "resource_group_name", "options": ["--name", "-n", "--resource-group", "-g"],
+                            "required": True, "help": "Name of resource group."
+                        }]}}, "sub_groups": {}}}}
+        }
+        validator = CLIValidator(None)
+        validator.core_repo_loader.load_snapshot('azure-cli-2.51.0', build_command_tree(
+            metas, CommandSource.CORE_MODULE).cmd_tree, metas)
+        validator.extension_loader.load_snapshot({})
+        validator.save_snapshot(self.path)
+
+    def test_load_snapshot(self):
+        snapshot = read_snapshot(self.path)
+        command = snapshot['core_metas']['az_resource_meta.json']['sub_groups']['group']['commands']['group show']
+        self.assertNotIn('help', command)
+        self.assertNotIn('help', command['parameters'][0])
+
+        validator = CLIValidator(None)
+        validator.load_snapshot(self.path)
+        self.assertEqual(validator.core_repo_loader.version, '2.51.0')
+        self.assertTrue(validator.validate_command('az group show -n rg').is_valid)
+        self.assertFalse(validator.validate_command('az group show --location westus').is_valid)
+        self.assertFalse(validator.validate_command('az vm show -n vm').is_valid)
+
+    def test_pickle(self):
+        validator = CLIValidator(None)
+        validator.load_snapshot(self.path)
+        data = pickle.dumps(validator)
+        self.assertNotIn(b'resource_group_name', data)
+        restored = pickle.loads(data)
+        self.assertEqual(restored.snapshot_path, self.path)
+        self.assertTrue(restored.validate_command('az group show -n rg').is_valid)
+        self.assertFalse(restored.validate_command('az group show').is_valid)
+
+    def test_data_only_payload(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(marshal.loads(data[_HEADER.size:]), read_snapshot(self.path))
+        payload = pickle.dumps(read_snapshot(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(payload), hashlib.sha256(payload).digest()) + payload)
+        with self.assertRaises(InvalidSnapshotException):
+            read_snapshot(self.path)
+
+    def test_load_after_snapshot(self):
+        loader = CoreRepoLoader(None, lazy=True)
+        snapshot = read_snapshot(self.path)
+        loader.load_snapshot(snapshot['version_dir'], snapshot['core_tree'], snapshot['core_metas'])
+        self.assertFalse(loader.lazy)
+        with mock.patch.object(CoreRepoLoader, '_load_lazy') as load_lazy:
+            loader.load('2.51.0')
+        load_lazy.assert_called_once()
+        self.assertTrue(loader.lazy)
+
+    def test_invalid_snapshot(self):
+        with open(self.path, 'rb') as f:
+            data = bytearray(f.read())
+        corrupted = bytearray(data)
+        corrupted[-1] ^= 0xff
+        bad_version = bytearray(data)
+        bad_version[9] += 1
+        for content in [corrupted, bad_version, data[:_HEADER.size - 1], b'{"version": 1}' + data[14:]]:
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            with self.assertRaises(InvalidSnapshotException):
+                read_snapshot(self.path)
+
+    def tearDown(self):
+        super().tearDown()
+        if os.path.exists(self.snapshot_dir):
+            shutil.rmtree(self.snapshot_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import random
+import re
+import shlex
+import unittest
+
+from cli_validator import tokenizer
+
+_PLACEHOLDER = re.compile(r' ((\$\([a-zA-Z0-9_ -.\[\]]*\))|(\${[a-zA-Z0-9_ -.\[\]]*})|'
+                          r'(<[a-zA-Z0-9_ ]*>)|(<<[a-zA-Z0-9_ -]*>>))')
+
+
+def _split(split, command: str, comments: bool):
+    try:
+        return split(command, comments)
+    except ValueError as e:
+        return str(e)
+
+
+class TokenizerTestCase(unittest.TestCase):
+    corpus = [
+        '', 'az vm list', '  az  vm   list  ', 'az vm create -n "my vm" --tags \'a=b c\'',
+        'az group show -n rg # comment', 'az group show -n rg#comment', 'echo "a\\"b" \'c\\\'', 'a\\ b c\\',
+        '"unclosed', "'unclosed", 'echo ""', 'a"b"c\'d\'e', 'az vm show -g <Resource Group> -n <<vm name>>',
+        'az vm create --image $(az vm image list --query [0].urn -o tsv)', 'az webapp create -n ${APP NAME}',
+        'az vm show -n $(a)b) -g $(c', 'az vm show -n <a <b> <<c d->> <<e>', 'az x -n "$(quoted)" <tag>x',
+        'az x\t<not-after-space> $VAR $ (x)', 'az group show -n rg # <comment>\naz vm list',
+    ]
+
+    def test_corpus(self):
+        for command in self.corpus:
+            self.assertEqual(tokenizer.quote_placeholders(command), _PLACEHOLDER.sub(r' "\1"', command), command)
+            for comments in [False, True]:
+                self.assertEqual(_split(tokenizer.split, command, comments),
+                                 _split(shlex.split, command, comments), command)
+
+    def test_random(self):
+        rnd = random.Random(0)
+        alphabet = ['a', 'Z', '0', ' ', ' ', ' ', '\t', '\n', '"', "'", '\\', '#', '$', '(', ')', '{', '}',
+                    '<', '<', '>', '>', '-', '.', '[', ']', '_', 'é']
+        for _ in range(20000):
+            command = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 24)))
+            quoted = tokenizer.quote_placeholders(command)
+            self.assertEqual(quoted, _PLACEHOLDER.sub(r' "\1"', command), command)
+            comments = rnd.random() < 0.5
+            self.assertEqual(_split(tokenizer.split, quoted, comments), _split(shlex.split, quoted, comments),
+                             quoted)
+
+    def test_iter_tokens(self):
+        command = 'az  "vm list"\t-n x#c\ny'
+        self.assertEqual(list(tokenizer.iter_tokens(command)),
+                         [('az', 0, 3), ('vm list', 3, 14), ('-n', 14, 17), ('x', 17, 21), ('y', 21, 22)])
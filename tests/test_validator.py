@@ -1,7 +1,20 @@
+import asyncio
+import gc
+import io
+import json
 import os
+import pickle
 import shutil
 import unittest
+from unittest.mock import patch
 
+import httpx
+
+from cli_validator.cache import LRUCache
+from cli_validator.exceptions import UnknownCommandException
+from cli_validator.loader.core_repo import build_command_tree
+from cli_validator.result import CommandSource
+from cli_validator.script import LineIndex
 from cli_validator.validator import CLIValidator
 
 
@@ -194,3 +207,230 @@ class CLIValidatorNoCacheTestCase(unittest.IsolatedAsyncioTestCase):
         self.assertTrue(result[0].result.is_valid)
         self.assertTrue(result[1].result.is_valid)
         self.assertTrue(result[2].result.is_valid)
+
+
+def _dump_result(r):
+    return r.command, r.is_valid, r.cmd_source, r.validated_param, r.error_message
+
+
+def _dump_item(item):
+    return item.lineno, item.col_pos, item.end_lineno, item.end_col_pos, item.result.command, item.result.is_valid, \
+        item.result.error_message
+
+
+def _dump_items(items):
+    return [_dump_item(item) for item in items]
+
+
+def _dump_set_item(item):
+    return item.result and _dump_result(item.result), item.example_result and _dump_result(item.example_result)
+
+
+class OfflineCLIValidatorTestCase(unittest.TestCase):
+    """Tests of `CLIValidator` with metadata loaded without network"""
+
+    def setUp(self):
+        super().setUp()
+        metas = {
+            'az_resource_meta.json': {
+                "module_name": "resource", "commands": {}, "sub_groups": {
+                    "group": {"commands": {
+                        "group show": {"name": "group show", "parameters": [
+                            {"name": "resource_group_name", "options": ["--name", "-n", "--resource-group", "-g"],
+                             "required": True}]},
+                        "group delete": {"name": "group delete", "confirmation": True, "parameters": [
+                            {"name": "resource_group_name", "options": ["--name", "-n", "--resource-group", "-g"],
+                             "required": True},
+                            {"name": "yes", "options": ["--yes", "-y"]}]}
+                    }, "sub_groups": {}}}},
+            'az_vm_meta.json': {
+                "module_name": "vm", "commands": {}, "sub_groups": {
+                    "vm": {"commands": {"vm create": {"name": "vm create", "parameters": [
+                        {"name": "vm_name", "options": ["--name", "-n"], "required": True},
+                        {"name": "count", "options": ["--count"], "type": "Int"}]}}, "sub_groups": {}}}}
+        }
+        self.validator = CLIValidator(None)
+        self.validator.core_repo_loader.load_snapshot(
+            'azure-cli-2.51.0', build_command_tree(metas, CommandSource.CORE_MODULE).cmd_tree, metas)
+        self.validator.extension_loader.load_snapshot({})
+        self.validator.loaders = [self.validator.core_repo_loader, self.validator.extension_loader]
+        self.commands = [
+            'az group show -n rg', 'az group show  -n rg', 'az group show', 'az group delete -n rg',
+            'az group delete -n rg --yes', 'az vm create -n vm --count 2', 'az vm create -n vm --count two',
+            'az vm create -n <VM NAME>', 'az vm create --help', 'az vm', 'az vm  delete', 'az vm delete', 'az "vm',
+            'git status', '', 'az group show -n rg', 'az vm create -n vm --count two',
+        ]
+
+    def test_validate_commands(self):
+        for kwargs in [{}, {'non_interactive': True}, {'placeholder': False}, {'no_help': False}]:
+            results = self.validator.validate_commands(iter(self.commands), **kwargs)
+            self.assertEqual([_dump_result(r) for r in results],
+                             [_dump_result(self.validator.validate_command(c, **kwargs)) for c in self.commands])
+        result = self.validator.validate_commands(['az vm  delete'])[0]
+        self.assertEqual(result.error_message, 'Unknown Command: "az vm  delete".')
+        self.assertIs(result.error_code, UnknownCommandException)
+        self.assertIs(pickle.loads(pickle.dumps(result)).error_code, UnknownCommandException)
+        # Results are serializable through their attributes
+        self.assertEqual(json.loads(json.dumps(vars(self.validator.validate_command('az vm create --count 2')))),
+                         {'command': 'az vm create --count 2', 'is_valid': False, 'cmd_source': 'Core Module',
+                          'validated_param': False,
+                          'error_message': 'the following arguments are required: --name/-n '})
+        self.validator.parser_cache = LRUCache(16)
+        self.validator.validate_commands(self.commands)
+        self.assertEqual(self.validator.parser_cache.stats.misses, 3)
+
+    def test_result_cache(self):
+        expected = [_dump_result(self.validator.validate_command(c, non_interactive=True)) for c in self.commands]
+        self.validator.result_cache = LRUCache(64)
+        for _ in range(2):
+            self.assertEqual([_dump_result(self.validator.validate_command(c, non_interactive=True))
+                              for c in self.commands], expected)
+        self.assertEqual(self.validator.validate_command('az vm  delete').error_message,
+                         'Unknown Command: "az vm  delete".')
+        self.assertEqual(self.validator.validate_command('az vm delete').error_message,
+                         'Unknown Command: "az vm delete".')
+        stats = self.validator.result_cache.stats
+        self.assertEqual(stats.misses, 13)
+        self.assertEqual(stats.hits, 21)
+        self.assertTrue(self.validator.validate_sig_params('az group show', ['--name']).is_valid)
+        self.assertTrue(self.validator.validate_sig_params('az group show', ['--name']).is_valid)
+        self.assertEqual(self.validator.result_cache.stats.hits, 22)
+
+        # Reloading the metadata invalidates the cached results
+        self.validator.extension_loader.load_snapshot({'vm': {'delete': 'vm-delete'}})
+        self.assertEqual(self.validator.validate_command('az vm delete').cmd_source, CommandSource.EXTENSION)
+
+        # The results of extension commands expire with the resolved extension versions
+        meta = {"module_name": "vm-delete", "commands": {}, "sub_groups": {
+            "vm": {"commands": {"vm delete": {"name": "vm delete", "parameters": [
+                {"name": "vm_name", "options": ["--name", "-n"], "required": True}]}}, "sub_groups": {}}}}
+        self.validator.extension_loader.version_ttl = 0
+        with patch('cli_validator.loader.extension.load_latest_version', return_value='az_vm-delete_meta_1.0.json') \
+                as load_latest_version, patch('cli_validator.loader.extension.try_load_meta', return_value=meta):
+            for _ in range(3):
+                self.assertTrue(self.validator.validate_command('az vm delete -n vm').validated_param)
+            self.assertEqual(load_latest_version.call_count, 3)
+
+        # The results without checking the parameters are not cached
+        self.validator.extension_loader.version_ttl = None
+        with patch('cli_validator.loader.extension.load_latest_version', side_effect=httpx.ConnectError('offline')):
+            self.assertFalse(self.validator.validate_command('az vm delete -n vm --bogus').validated_param)
+        with patch('cli_validator.loader.extension.load_latest_version', return_value='az_vm-delete_meta_1.0.json'), \
+                patch('cli_validator.loader.extension.try_load_meta', return_value=meta):
+            self.assertFalse(self.validator.validate_command('az vm delete -n vm --bogus').is_valid)
+
+    def test_iter_validate_script(self):
+        script = 'rg=$(az group show -n rg --query name)\n# az vm create\naz vm create \\\n  -n vm --count two\r\n' \
+                 'az group delete -n $rg\n\naz vm create -n <VM NAME>'
+        expected = [_dump_item(item) for item in self.validator.validate_script(script)]
+        self.assertEqual(len(expected), 4)
+        self.assertEqual([_dump_item(item) for item in self.validator.iter_validate_script(io.StringIO(script))],
+                         expected)
+
+        read = []
+
+        def lines():
+            for line in ['az group show -n rg\n', 'az vm create -n "vm\n', 'az group show)\n',
+                         'az vm create $(az group show\n', 'az group delete -n rg']:
+                read.append(line)
+                yield line
+
+        items = self.validator.iter_validate_script(lines())
+        # Each result is yielded once its command is parsed
+        self.assertTrue(next(items).result.is_valid)
+        self.assertEqual(len(read), 1)
+        items = [_dump_item(item) for item in items]
+        self.assertEqual(items[0], (1, 0, 1, 19, 'az vm create -n "vm', False,
+                                    'Fail to Parse command: No closing quotation'))
+        self.assertEqual(items[1][:6], (2, 0, 2, 14, 'az group show)', False))
+        self.assertIn('No matching LeftParenthesis Found', items[1][6])
+        self.assertIn('No matching RightParenthesis Found', items[2][6])
+        self.assertEqual(items[3], (4, 0, 4, 21, 'az group delete -n rg', True, None))
+
+    def test_validate_script_incremental(self):
+        script = 'rg=$(az group show -n rg --query name)\naz vm create \\\n  -n vm --count two\r\n' \
+                 'az group delete -n $rg)\n\naz vm create -n <VM NAME>'
+        result = self.validator.validate_script_incremental(script, non_interactive=True)
+        self.assertEqual(_dump_items(result.items),
+                         _dump_items(self.validator.iter_validate_script([script], non_interactive=True)))
+
+        edits = [((0, 0, 0, 0), 'az vm list\n'), ((2, 11, 2, 14), 'three'), ((4, 22, 4, 23), ''),
+                 ((3, 13, 4, 0), ' \\\n'), ((6, 13, 6, 13), ' -g rg\naz group list'), ((0, 0, 7, 0), '')]
+        for (lineno, col_pos, end_lineno, end_col_pos), text in edits:
+            line_index = LineIndex(script)
+            script = script[:line_index.index(lineno, col_pos)] + text + \
+                script[line_index.index(end_lineno, end_col_pos):]
+            previous = result
+            result = self.validator.revalidate_script(previous, lineno, col_pos, end_lineno, end_col_pos, text)
+            expected = _dump_items(self.validator.iter_validate_script([script], non_interactive=True))
+            self.assertEqual(result.script, script)
+            self.assertEqual(_dump_items(result.items), expected)
+            self.assertEqual(_dump_items(self.validator.validate_script_incremental(script, previous, True).items),
+                             expected)
+
+        # A bare `az` is an unknown command
+        result = self.validator.revalidate_script(result, 0, 0, 0, 0, 'az\n')
+        self.assertEqual(_dump_items(result.items[:1]), [(0, 0, 0, 2, 'az', False, 'Unknown Command: "az".')])
+        self.assertEqual(_dump_items(result.items), _dump_items(self.validator.validate_script(result.script)))
+
+        # The results of the unchanged commands are reused, and moved along with their lines
+        previous = self.validator.validate_script_incremental('az group show -n rg\naz vm create -n vm\n',
+                                                              non_interactive=True)
+        result = self.validator.revalidate_script(previous, 1, 0, 1, 0, 'az group delete -n rg\n')
+        self.assertIs(result.commands[0], previous.commands[0])
+        self.assertFalse(result.items[1].result.is_valid)
+        self.assertEqual(result.items[2].lineno, 2)
+        self.assertIs(result.items[2].result, previous.items[1].result)
+        # The results are not reused with other options or after the metadata is reloaded
+        self.assertIsNot(self.validator.validate_script_incremental(result.script, result).items[0].result,
+                         result.items[0].result)
+        self.validator.extension_loader.load_snapshot({})
+        self.assertIsNot(self.validator.revalidate_script(result, 0, 0, 0, 0, '').items[0].result,
+                         result.items[0].result)
+
+    def test_validate_commands_parallel(self):
+        commands = self.commands * 5
+        results = self.validator.validate_commands_parallel(iter(commands), processes=2, chunk_size=7,
+                                                            non_interactive=True)
+        self.assertEqual([_dump_result(r) for r in results],
+                         [_dump_result(r) for r in self.validator.validate_commands(commands, non_interactive=True)])
+
+    def test_validate_commands_parallel_with_held_locks(self):
+        commands = self.commands * 5
+        expected = [r.is_valid for r in self.validator.validate_commands(commands, non_interactive=True)]
+        # The workers are forked while the locks are held by the parent process, and the gc is not left frozen
+        with self.validator.parser_cache._lock, self.validator.extension_loader._version_lock:
+            results = list(self.validator.validate_commands_parallel(commands, processes=2, non_interactive=True))
+        self.assertEqual([r.is_valid for r in results], expected)
+        self.assertEqual(gc.get_freeze_count(), 0)
+
+    def test_validate_async(self):
+        async def validate(command):
+            return await self.validator.validate_command_async(command, non_interactive=True)
+
+        async def validate_all():
+            return await asyncio.gather(*[validate(command) for command in self.commands])
+
+        self.assertEqual([_dump_result(r) for r in asyncio.run(validate_all())],
+                         [_dump_result(self.validator.validate_command(c, non_interactive=True))
+                          for c in self.commands])
+        command_set = [
+            {'command': 'az group show', 'arguments': ['-n'], 'example': 'az group show -n rg'},
+            {'command': 'az group show', 'arguments': ['--location']}, {'command': 'az vm create show'},
+            {'command': 'az vm', 'arguments': ['--help']}, {'example': 'az vm create --count 2'},
+            {'example': 'az vm create --help'}, {'example': 'az vm create -n <VM NAME>'},
+        ]
+        expected = self.validator.validate_command_set(command_set, no_help=False)
+        result = asyncio.run(self.validator.validate_command_set_async(command_set, no_help=False))
+        self.assertEqual([_dump_set_item(item) for item in result.items],
+                         [_dump_set_item(item) for item in expected.items])
+        self.assertEqual(len(result.errors), 2)
+        # The examples are validated with placeholders and `no_help`
+        self.assertEqual([item.example for item in result.example_errors], ['az vm create --count 2'])
+
+    def test_pickle(self):
+        self.validator.validate_commands(self.commands)
+        restored = pickle.loads(pickle.dumps(self.validator))
+        self.assertEqual(len(restored.parser_cache), 0)
+        self.assertEqual([r.error_message for r in restored.validate_commands(self.commands)],
+                         [r.error_message for r in self.validator.validate_commands(self.commands)])